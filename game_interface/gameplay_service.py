@@ -0,0 +1,274 @@
+'''
+Write-behind buffer for the gameplay progress of logged in players.
+
+start_quest and answer_question only update the state of the gameplay in the buffer and append
+its key to a dirty log (a sequence number per change). flush_gameplay_buffer, run periodically by
+celery beat, reads the dirty log from its cursor, upserts the latest state of every touched gameplay
+with bulk_create(update_conflicts=True) and only then moves the cursor forward.
+
+The buffer is the 'gameplay' cache, a redis which persists and never evicts its keys (see settings),
+as it holds the only copy of the progress till it is flushed. Without it nothing is buffered and
+every change is written to the database at once.
+
+The buffered state holds absolute values (current question, completed, score per category) instead
+of deltas, so replaying a part of the log after a crashed flush writes the same rows again.
+
+Live players of a quest are counted in per-minute buckets in the shared cache, a start increments
+the bucket of the current minute and the count is the sum of the last LIVE_PLAYERS_WINDOW buckets.
+'''
+import time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import transaction
+from structlog import get_logger
+
+from .models import UserGameplay, UserScoreByCategoryForGameplay
+from .leaderboard_service import update_leaderboards_for_gameplays
+
+logger = get_logger()
+
+GAMEPLAY_STATE_TIMEOUT  = 60 * 60 * 24 * 7
+DIRTY_ENTRY_TIMEOUT     = 60 * 60 * 24
+FLUSH_LOCK_TIMEOUT      = 60 * 5
+FLUSH_BATCH_SIZE        = 1000
+LIVE_PLAYERS_WINDOW     = 10    # minutes
+
+BUFFER_CACHE            = 'gameplay'
+DIRTY_SEQUENCE_KEY      = 'gameplay_dirty_sequence'
+FLUSH_CURSOR_KEY        = 'gameplay_flush_cursor'
+FLUSH_LOCK_KEY          = 'gameplay_flush_lock'
+FLUSH_GAP_KEY           = 'gameplay_flush_gap'
+
+
+def get_buffer():
+    '''
+    returns the cache buffering the progress, None when no durable one is configured
+    '''
+    if BUFFER_CACHE not in settings.CACHES:
+        return None
+    return caches[BUFFER_CACHE]
+
+
+def get_state_key(user_id, quest_id):
+    return f"gameplay_state:{user_id}:{quest_id}"
+
+
+def get_dirty_entry_key(sequence):
+    return f"gameplay_dirty:{sequence}"
+
+
+def load_gameplay_state(user_id, quest_id):
+    '''
+    returns the persisted state of the gameplay, None if the user never played the quest
+    '''
+    user_gameplay = UserGameplay.objects.filter(user_id=user_id, quest_id=quest_id).first()
+    if not user_gameplay:
+        return None
+
+    scores = UserScoreByCategoryForGameplay.objects.filter(user_gameplay=user_gameplay).values_list('score_category_id', 'score')
+    return {
+        'user_id'               : user_id,
+        'quest_id'              : quest_id,
+        'current_question_id'   : user_gameplay.current_question_id,
+        'completed'             : user_gameplay.completed,
+        'scores'                : {category_id: score for category_id, score in scores}
+    }
+
+
+def get_gameplay_state(user_id, quest_id):
+    '''
+    returns the latest state of the gameplay, the buffered one if it isn't flushed yet
+    '''
+    buffer = get_buffer()
+    state = buffer.get(get_state_key(user_id, quest_id)) if buffer else None
+    if state is None:
+        state = load_gameplay_state(user_id, quest_id)
+    return state
+
+
+def mark_dirty(buffer, state_key):
+    try:
+        sequence = buffer.incr(DIRTY_SEQUENCE_KEY)
+    except ValueError:
+        buffer.add(DIRTY_SEQUENCE_KEY, 0, timeout=None)
+        sequence = buffer.incr(DIRTY_SEQUENCE_KEY)
+    buffer.set(get_dirty_entry_key(sequence), state_key, timeout=DIRTY_ENTRY_TIMEOUT)
+
+
+def save_gameplay_state(state):
+    buffer = get_buffer()
+    if buffer is None:
+        with transaction.atomic():
+            write_gameplay_states([state])
+        update_leaderboards_for_gameplays([state])
+        return
+
+    state_key = get_state_key(state['user_id'], state['quest_id'])
+    buffer.set(state_key, state, timeout=GAMEPLAY_STATE_TIMEOUT)
+    mark_dirty(buffer, state_key)
+
+
+def record_quest_start(user, quest_id, question_id, score_category_ids):
+    '''
+    (re)starts the gameplay of the quest from the given question with every score category at 0.
+    A replayed completed gameplay is taken off the leaderboards once written, till it is completed again.
+    Nothing is recorded for anonymous players.
+    '''
+    if not user or not user.is_authenticated:
+        return
+
+    save_gameplay_state({
+        'user_id'               : user.id,
+        'quest_id'              : quest_id,
+        'current_question_id'   : question_id,
+        'completed'             : False,
+        'scores'                : {int(category_id): 0 for category_id in score_category_ids}
+    })
+
+
+def record_answer(user, quest_id, next_question_id, score_changes, completed=False):
+    '''
+    adds the score changes of the chosen option to the gameplay and moves it to the next question.
+    Answers of the same player on the same quest are expected one at a time, two concurrent answers
+    can overwrite each other's score change. Nothing is recorded for anonymous players.
+    '''
+    if not user or not user.is_authenticated:
+        return
+
+    state = get_gameplay_state(user.id, quest_id)
+    if state is None:
+        if not next_question_id:
+            return
+        state = {
+            'user_id'               : user.id,
+            'quest_id'              : quest_id,
+            'current_question_id'   : next_question_id,
+            'completed'             : False,
+            'scores'                : {}
+        }
+
+    for category_id, points in score_changes.items():
+        state['scores'][int(category_id)] = state['scores'].get(int(category_id), 0) + points
+
+    if next_question_id:
+        state['current_question_id'] = next_question_id
+    state['completed'] = completed
+
+    save_gameplay_state(state)
+
+
+def write_gameplay_states(states):
+    '''
+    upserts the gameplays and their scores, 3 queries for any number of states
+    '''
+    UserGameplay.objects.bulk_create(
+        [UserGameplay(
+            user_id=state['user_id'],
+            quest_id=state['quest_id'],
+            current_question_id=state['current_question_id'],
+            completed=state['completed']
+        ) for state in states],
+        update_conflicts=True,
+        unique_fields=['user', 'quest'],
+        update_fields=['current_question', 'completed']
+    )
+
+    # bulk_create doesn't return the ids of the updated rows
+    user_gameplay_ids = {}
+    for user_gameplay in UserGameplay.objects.filter(
+        user_id__in={state['user_id'] for state in states},
+        quest_id__in={state['quest_id'] for state in states}
+    ).values('id', 'user_id', 'quest_id'):
+        user_gameplay_ids[(user_gameplay['user_id'], user_gameplay['quest_id'])] = user_gameplay['id']
+
+    UserScoreByCategoryForGameplay.objects.bulk_create(
+        [UserScoreByCategoryForGameplay(
+            user_gameplay_id=user_gameplay_ids[(state['user_id'], state['quest_id'])],
+            score_category_id=category_id,
+            score=score
+        ) for state in states for category_id, score in state['scores'].items()],
+        update_conflicts=True,
+        unique_fields=['user_gameplay', 'score_category'],
+        update_fields=['score']
+    )
+
+
+def flush_gameplay_buffer(batch_size=FLUSH_BATCH_SIZE):
+    '''
+    writes the gameplays changed since the last flush to the database.
+    returns the number of gameplays written
+    '''
+    buffer = get_buffer()
+    if buffer is None:
+        return 0
+
+    if not buffer.add(FLUSH_LOCK_KEY, 1, timeout=FLUSH_LOCK_TIMEOUT):
+        logger.info("Gameplay flush already running")
+        return 0
+
+    try:
+        cursor = buffer.get(FLUSH_CURSOR_KEY, 0)
+        last_sequence = min(buffer.get(DIRTY_SEQUENCE_KEY, 0), cursor + batch_size)
+        sequences = range(cursor + 1, last_sequence + 1)
+        entries = buffer.get_many([get_dirty_entry_key(sequence) for sequence in sequences])
+
+        state_keys = []
+        flushed_sequence = cursor
+        for sequence in sequences:
+            state_key = entries.get(get_dirty_entry_key(sequence))
+            if state_key is None:
+                # the entry is written right after the sequence is taken, so a missing entry is
+                # waited for once. If it is still missing on the next flush it expired, skip it.
+                if buffer.get(FLUSH_GAP_KEY) != sequence:
+                    buffer.set(FLUSH_GAP_KEY, sequence, timeout=None)
+                    break
+                logger.warning("Skipping missing gameplay dirty entry", sequence=sequence)
+            elif state_key not in state_keys:
+                state_keys.append(state_key)
+            flushed_sequence = sequence
+
+        states = list(buffer.get_many(state_keys).values())
+        if states:
+            with transaction.atomic():
+                write_gameplay_states(states)
+
+            # replaying a completion or a restart doesn't change the boards
+            update_leaderboards_for_gameplays(states)
+
+        # the cursor moves only after the commit, a crash before this line replays the same states
+        buffer.set(FLUSH_CURSOR_KEY, flushed_sequence, timeout=None)
+        buffer.delete_many([get_dirty_entry_key(sequence) for sequence in range(cursor + 1, flushed_sequence + 1)])
+
+        logger.info("Flushed gameplay buffer", gameplays=len(states), cursor=flushed_sequence)
+        return len(states)
+    finally:
+        buffer.delete(FLUSH_LOCK_KEY)
+
+
+def get_live_players_key(quest_id, minute):
+    return f"quest_live_players:{quest_id}:{minute}"
+
+
+def record_live_player(quest_id):
+    key = get_live_players_key(quest_id, int(time.time() // 60))
+    cache.add(key, 0, timeout=(LIVE_PLAYERS_WINDOW + 1) * 60)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # the bucket expired between add and incr
+        cache.add(key, 1, timeout=(LIVE_PLAYERS_WINDOW + 1) * 60)
+
+
+def get_live_players(quest_ids):
+    '''
+    returns {quest_id: players who started the quest in the last LIVE_PLAYERS_WINDOW minutes}
+    with a single cache read for all the quests
+    '''
+    current_minute = int(time.time() // 60)
+    minutes = range(current_minute - LIVE_PLAYERS_WINDOW + 1, current_minute + 1)
+    buckets = cache.get_many([get_live_players_key(quest_id, minute) for quest_id in quest_ids for minute in minutes])
+
+    return {quest_id: sum(
+        buckets.get(get_live_players_key(quest_id, minute), 0) for minute in minutes
+    ) for quest_id in quest_ids}
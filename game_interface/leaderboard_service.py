@@ -0,0 +1,359 @@
+'''
+Leaderboards are sorted sets of user ids by score: one global board, one per quest and one per universe.
+
+The quest board holds the score of the user's completed gameplay of the quest. When a gameplay is
+completed the difference with the previous score on the quest board is added to the global and
+universe boards, so totals are maintained incrementally and a replayed completion changes nothing.
+Replaying a completed quest makes its gameplay no longer completed, like in the database, so its
+score is taken off the boards till the replay is completed.
+
+The boards live in a redis ZSET when the default cache is redis, else in an in-process indexable
+skip list (local development and tests). Both serve top-N and rank in O(log n).
+'''
+import random
+import threading
+
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+from django.db.models import Sum
+from structlog import get_logger
+
+from generator.models import Quest, Universe
+from .models import UserScoreByCategoryForGameplay
+from .service import add_to_user_score
+
+logger = get_logger()
+
+GLOBAL_BOARD = 'leaderboard:global'
+
+
+def get_quest_board(quest_id):
+    return f"leaderboard:quest:{quest_id}"
+
+
+def get_universe_board(universe_id):
+    return f"leaderboard:universe:{universe_id}"
+
+
+class SkipListNode:
+    __slots__ = ('key', 'forward', 'width')
+
+    def __init__(self, key, level):
+        self.key        = key
+        self.forward    = [None] * level
+        self.width      = [1] * level
+
+
+class IndexableSkipList:
+    '''
+    sorted list of (score, member) keys with the number of nodes each link skips,
+    so that the position of a key and the key at a position are found in O(log n)
+    '''
+    MAX_LEVEL = 32
+
+    def __init__(self):
+        self.head   = SkipListNode(None, self.MAX_LEVEL)
+        self.size   = 0
+
+    def random_level(self):
+        level = 1
+        while level < self.MAX_LEVEL and random.random() < 0.5:
+            level += 1
+        return level
+
+    def insert(self, key):
+        update = [self.head] * self.MAX_LEVEL
+        rank = [0] * self.MAX_LEVEL
+        node = self.head
+        for i in reversed(range(self.MAX_LEVEL)):
+            rank[i] = rank[i + 1] if i < self.MAX_LEVEL - 1 else 0
+            while node.forward[i] and node.forward[i].key < key:
+                rank[i] += node.width[i]
+                node = node.forward[i]
+            update[i] = node
+
+        level = self.random_level()
+        new_node = SkipListNode(key, level)
+        for i in range(self.MAX_LEVEL):
+            if i < level:
+                new_node.forward[i] = update[i].forward[i]
+                update[i].forward[i] = new_node
+                # rank[0] is the number of nodes before the new node
+                new_node.width[i] = update[i].width[i] - (rank[0] - rank[i])
+                update[i].width[i] = rank[0] - rank[i] + 1
+            else:
+                update[i].width[i] += 1
+        self.size += 1
+
+    def remove(self, key):
+        update = [self.head] * self.MAX_LEVEL
+        node = self.head
+        for i in reversed(range(self.MAX_LEVEL)):
+            while node.forward[i] and node.forward[i].key < key:
+                node = node.forward[i]
+            update[i] = node
+
+        node = node.forward[0]
+        if node is None or node.key != key:
+            return
+
+        for i in range(self.MAX_LEVEL):
+            if update[i].forward[i] is node:
+                update[i].forward[i] = node.forward[i]
+                update[i].width[i] += node.width[i] - 1
+            else:
+                update[i].width[i] -= 1
+        self.size -= 1
+
+    def index(self, key):
+        '''
+        returns the 0 based position of the key in ascending order
+        '''
+        position = 0
+        node = self.head
+        for i in reversed(range(self.MAX_LEVEL)):
+            while node.forward[i] and node.forward[i].key <= key:
+                position += node.width[i]
+                node = node.forward[i]
+        return position - 1
+
+    def slice(self, start, count):
+        '''
+        returns count keys from the 0 based position start in ascending order
+        '''
+        node = self.head
+        remaining = start + 1
+        for i in reversed(range(self.MAX_LEVEL)):
+            while node.forward[i] and node.width[i] <= remaining:
+                remaining -= node.width[i]
+                node = node.forward[i]
+
+        keys = []
+        while node and node is not self.head and len(keys) < count:
+            keys.append(node.key)
+            node = node.forward[0]
+        return keys
+
+
+class LocalLeaderboardBackend:
+    '''
+    in-process stand-in for the redis sorted sets, ordered like ZREVRANGE (score, then member, descending)
+    '''
+    def __init__(self):
+        self.boards = {}     # board -> (IndexableSkipList, {member: score})
+        self.lock   = threading.Lock()
+
+    def get_board(self, board):
+        if board not in self.boards:
+            self.boards[board] = (IndexableSkipList(), {})
+        return self.boards[board]
+
+    def _set_score(self, board, member, score):
+        skip_list, scores = self.get_board(board)
+        if member in scores:
+            skip_list.remove((scores[member], member))
+        scores[member] = score
+        skip_list.insert((score, member))
+
+    def set_score(self, board, member, score):
+        with self.lock:
+            self._set_score(board, member, score)
+
+    def increment_score(self, board, member, amount):
+        with self.lock:
+            score = self.get_board(board)[1].get(member, 0) + amount
+            self._set_score(board, member, score)
+        return score
+
+    def get_score(self, board, member):
+        with self.lock:
+            return self.get_board(board)[1].get(member)
+
+    def get_rank(self, board, member):
+        with self.lock:
+            skip_list, scores = self.get_board(board)
+            if member not in scores:
+                return None
+            return skip_list.size - 1 - skip_list.index((scores[member], member))
+
+    def get_top(self, board, start, count):
+        with self.lock:
+            skip_list, _ = self.get_board(board)
+            end = skip_list.size - start
+            first = max(end - count, 0)
+            keys = skip_list.slice(first, end - first) if end > 0 else []
+        return [(member, score) for score, member in reversed(keys)]
+
+    def remove(self, board, member):
+        with self.lock:
+            skip_list, scores = self.get_board(board)
+            if member in scores:
+                skip_list.remove((scores.pop(member), member))
+
+    def get_size(self, board):
+        with self.lock:
+            return self.get_board(board)[0].size
+
+    def clear(self, board):
+        with self.lock:
+            self.boards.pop(board, None)
+
+
+class RedisLeaderboardBackend:
+    def __init__(self, redis_cache):
+        self.redis_cache = redis_cache
+
+    def get_client(self):
+        return self.redis_cache._cache.get_client(write=True)
+
+    def set_score(self, board, member, score):
+        self.get_client().zadd(board, {member: score})
+
+    def increment_score(self, board, member, amount):
+        return self.get_client().zincrby(board, amount, member)
+
+    def get_score(self, board, member):
+        return self.get_client().zscore(board, member)
+
+    def get_rank(self, board, member):
+        return self.get_client().zrevrank(board, member)
+
+    def get_top(self, board, start, count):
+        if count <= 0:
+            return []
+        entries = self.get_client().zrevrange(board, start, start + count - 1, withscores=True)
+        return [(member.decode() if isinstance(member, bytes) else member, score) for member, score in entries]
+
+    def remove(self, board, member):
+        self.get_client().zrem(board, member)
+
+    def get_size(self, board):
+        return self.get_client().zcard(board)
+
+    def clear(self, board):
+        self.get_client().delete(board)
+
+
+_local_backend = LocalLeaderboardBackend()
+
+
+def get_backend():
+    cache = caches['default']
+    if isinstance(cache, RedisCache):
+        return RedisLeaderboardBackend(cache)
+    return _local_backend
+
+
+def update_leaderboards(user_id, quest_id, universe_id, quest_score, update_user_score=True):
+    '''
+    puts the score of the user's completed gameplay of the quest on the quest board and adds the
+    difference with the previous completion to the global and universe boards (and the cached
+    total score of the user)
+    '''
+    backend = get_backend()
+    member = str(user_id)
+
+    previous_score = backend.get_score(get_quest_board(quest_id), member)
+    change = quest_score - (previous_score or 0)
+    if previous_score is not None and not change:
+        return
+
+    backend.set_score(get_quest_board(quest_id), member, quest_score)
+    backend.increment_score(GLOBAL_BOARD, member, change)
+    backend.increment_score(get_universe_board(universe_id), member, change)
+    if update_user_score:
+        add_to_user_score(user_id, change)
+
+
+def remove_from_leaderboards(user_id, quest_id, universe_id, previous_score):
+    '''
+    takes the score of the user's replayed gameplay of the quest off the boards (and the cached total
+    score of the user)
+    '''
+    backend = get_backend()
+    member = str(user_id)
+
+    backend.remove(get_quest_board(quest_id), member)
+    backend.increment_score(GLOBAL_BOARD, member, -previous_score)
+    backend.increment_score(get_universe_board(universe_id), member, -previous_score)
+    add_to_user_score(user_id, -previous_score)
+
+
+def update_leaderboards_for_gameplays(states):
+    '''
+    updates the leaderboards with the flushed gameplay states: the completed gameplays are put on the
+    boards and the replayed ones (not completed but still on the quest board) are taken off
+    '''
+    backend = get_backend()
+    completed_states = [state for state in states if state['completed']]
+    replayed_states = []
+    for state in states:
+        if not state['completed']:
+            previous_score = backend.get_score(get_quest_board(state['quest_id']), str(state['user_id']))
+            if previous_score is not None:
+                replayed_states.append((state, int(previous_score)))
+    if not completed_states and not replayed_states:
+        return
+
+    universe_ids = dict(Quest.objects.filter(
+        id__in={state['quest_id'] for state in states}
+    ).values_list('id', 'universe_id'))
+
+    for state, previous_score in replayed_states:
+        remove_from_leaderboards(state['user_id'], state['quest_id'], universe_ids[state['quest_id']], previous_score)
+
+    for state in completed_states:
+        update_leaderboards(state['user_id'], state['quest_id'], universe_ids[state['quest_id']], sum(state['scores'].values()))
+
+
+def get_leaderboard(board, limit=10, offset=0):
+    '''
+    returns [(user_id, score, rank)] of the board, rank starting at 1
+    '''
+    entries = get_backend().get_top(board, offset, limit)
+    return [(int(member), int(score), offset + i + 1) for i, (member, score) in enumerate(entries)]
+
+
+def get_user_rank(board, user_id):
+    '''
+    returns (score, rank) of the user on the board, None if the user isn't on it
+    '''
+    backend = get_backend()
+    rank = backend.get_rank(board, str(user_id))
+    if rank is None:
+        return None
+    return int(backend.get_score(board, str(user_id))), rank + 1
+
+
+def rebuild_leaderboards():
+    '''
+    rebuilds every board from the completed gameplays in the database.
+    returns the number of gameplays put on the boards
+    '''
+    backend = get_backend()
+
+    backend.clear(GLOBAL_BOARD)
+    for quest_id in Quest.objects.values_list('id', flat=True):
+        backend.clear(get_quest_board(quest_id))
+    for universe_id in Universe.objects.values_list('id', flat=True):
+        backend.clear(get_universe_board(universe_id))
+
+    gameplay_scores = UserScoreByCategoryForGameplay.objects.filter(
+        user_gameplay__completed=True
+    ).values(
+        'user_gameplay__user_id', 'user_gameplay__quest_id', 'user_gameplay__quest__universe_id'
+    ).annotate(quest_score=Sum('score'))
+
+    count = 0
+    for gameplay in gameplay_scores:
+        update_leaderboards(
+            gameplay['user_gameplay__user_id'],
+            gameplay['user_gameplay__quest_id'],
+            gameplay['user_gameplay__quest__universe_id'],
+            gameplay['quest_score'],
+            update_user_score=False
+        )
+        count += 1
+
+    logger.info("Rebuilt leaderboards", gameplays=count)
+    return count
@@ -0,0 +1,87 @@
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from generator.models import Universe, Quest, Question, ScoreCategory
+from game_interface.models import UserGameplay, UserScoreByCategoryForGameplay
+from game_interface.service import calculate_user_score, get_user_score, get_user_score_key
+from user.models import User
+
+
+def calculate_user_score_in_python(user_id):
+    '''
+    the previous implementation: every score row is fetched and summed in python
+    '''
+    user_gameplays = UserGameplay.objects.filter(user_id=user_id, completed=True)
+    scores = UserScoreByCategoryForGameplay.objects.filter(user_gameplay__in=user_gameplays)
+
+    total_score = 0
+    for score in scores:
+        total_score += score.score
+    return total_score
+
+
+class Command(BaseCommand):
+    help = 'Benchmark calculate_user_score for a user with many completed gameplays. The data is rolled back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--gameplays', type=int, default=2000, help='Number of completed gameplays of the user')
+        parser.add_argument('--categories', type=int, default=4, help='Number of score categories per quest')
+        parser.add_argument('--runs', type=int, default=20, help='Number of timed runs per implementation')
+
+    def create_gameplays(self, num_of_gameplays, num_of_categories):
+        user = User.objects.create(username='benchmark-user', email='benchmark-user@example.com')
+        universe = Universe.objects.create(universe_name='Benchmark', description='benchmark', slug='benchmark-universe')
+
+        quests = Quest.objects.bulk_create([
+            Quest(universe=universe, quest_name=f'Quest {i}', intro='', description='', slug=f'benchmark-quest-{i}')
+            for i in range(num_of_gameplays)
+        ])
+        questions = Question.objects.bulk_create([Question(quest=quest, question_text='') for quest in quests])
+        categories = ScoreCategory.objects.bulk_create([
+            ScoreCategory(quest=quest, name=f'Category {i}', description='', icon='')
+            for quest in quests for i in range(num_of_categories)
+        ])
+        user_gameplays = UserGameplay.objects.bulk_create([
+            UserGameplay(user=user, quest=quest, current_question=question, completed=True)
+            for quest, question in zip(quests, questions)
+        ])
+
+        categories_of_quest = {}
+        for category in categories:
+            categories_of_quest.setdefault(category.quest_id, []).append(category)
+
+        UserScoreByCategoryForGameplay.objects.bulk_create([
+            UserScoreByCategoryForGameplay(user_gameplay=user_gameplay, score_category=category, score=1)
+            for user_gameplay in user_gameplays for category in categories_of_quest[user_gameplay.quest_id]
+        ], batch_size=1000)
+        return user
+
+    def time_runs(self, function, user_id, runs):
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            result = function(user_id)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        return result, timings[len(timings) // 2], timings[-1]
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user = self.create_gameplays(options['gameplays'], options['categories'])
+            self.stdout.write(f"{options['gameplays']} gameplays, {options['gameplays'] * options['categories']} score rows")
+
+            for name, function in [
+                ('python loop', calculate_user_score_in_python),
+                ('aggregate', calculate_user_score),
+                ('cached', get_user_score),
+            ]:
+                total_score, median, slowest = self.time_runs(function, user.id, options['runs'])
+                self.stdout.write(f"{name:<12} total={total_score} median={median:.2f}ms max={slowest:.2f}ms")
+
+            transaction.set_rollback(True)
+        cache.delete(get_user_score_key(user.id))
+
+        self.stdout.write(self.style.SUCCESS("Benchmark data rolled back."))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from game_interface.leaderboard_service import rebuild_leaderboards
+
+class Command(BaseCommand):
+    help = 'Rebuild the global, quest and universe leaderboards from the completed gameplays'
+
+    def handle(self, *args, **options):
+        count = rebuild_leaderboards()
+
+        self.stdout.write(self.style.SUCCESS(f"Leaderboards rebuilt from {count} completed gameplays."))
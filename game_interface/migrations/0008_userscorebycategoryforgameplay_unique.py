@@ -0,0 +1,36 @@
+# Generated by Django 4.2.1 on 2026-10-18 14:53
+
+from django.db import migrations
+from django.db.models import Count, Max
+
+
+def remove_duplicate_scores(apps, schema_editor):
+    '''
+    keeps the latest score row of every (user_gameplay, score_category) pair
+    '''
+    UserScoreByCategoryForGameplay = apps.get_model('game_interface', 'UserScoreByCategoryForGameplay')
+
+    duplicates = UserScoreByCategoryForGameplay.objects.values('user_gameplay_id', 'score_category_id').annotate(
+        rows=Count('id'), latest_id=Max('id')
+    ).filter(rows__gt=1)
+
+    for duplicate in duplicates:
+        UserScoreByCategoryForGameplay.objects.filter(
+            user_gameplay_id=duplicate['user_gameplay_id'],
+            score_category_id=duplicate['score_category_id']
+        ).exclude(id=duplicate['latest_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_interface', '0007_useruniversesuggestion_mobile'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_scores, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='userscorebycategoryforgameplay',
+            unique_together={('user_gameplay', 'score_category')},
+        ),
+    ]
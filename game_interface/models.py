@@ -36,6 +36,9 @@ class UserScoreByCategoryForGameplay(models.Model):
     score_category = models.ForeignKey(ScoreCategory, on_delete=models.CASCADE)
     score = models.IntegerField(default=0)
 
+    class Meta:
+        unique_together = ['user_gameplay', 'score_category']
+
 class UserCollectible(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='collectibles')
     collectible = models.ForeignKey('generator.Collectible', on_delete=models.CASCADE)
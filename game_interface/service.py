@@ -1,22 +1,47 @@
-from user.models import User, UserProfile
-from game_interface.models import UserGameplay, UserScoreByCategoryForGameplay
+from django.core.cache import cache
+from django.db.models import Sum
+
+from game_interface.models import UserScoreByCategoryForGameplay
+
+USER_SCORE_TIMEOUT = 60 * 60 * 24
+
+
+def get_user_score_key(user_id):
+    return f"user_total_score:{user_id}"
 
 
 def calculate_user_score(user_id):
     '''
-    Calculates the user's total score from accross gameplays.
+    Calculates the user's total score from accross the completed gameplays in one aggregated query
+    and caches it.
     '''
-    user_gameplays = UserGameplay.objects.filter(user_id=user_id, completed=True)
-
-    # get all the scores from UserScoreByCategoryForGameplay for the gameplays
-    scores = UserScoreByCategoryForGameplay.objects.filter(user_gameplay__in=user_gameplays)
-
-    total_score = 0
-    for score in scores:
-        total_score += score.score
-        
-    user_profile = UserProfile.objects.get(user_id=user_id)
-    user_profile.total_score = total_score
-    user_profile.save()
+    total_score = UserScoreByCategoryForGameplay.objects.filter(
+        user_gameplay__user_id=user_id,
+        user_gameplay__completed=True
+    ).aggregate(total_score=Sum('score'))['total_score'] or 0
+
+    cache.set(get_user_score_key(user_id), total_score, timeout=USER_SCORE_TIMEOUT)
     return total_score
 
+
+def get_user_score(user_id):
+    '''
+    returns the cached total score of the user, calculating it on a miss
+    '''
+    total_score = cache.get(get_user_score_key(user_id))
+    if total_score is None:
+        total_score = calculate_user_score(user_id)
+    return total_score
+
+
+def add_to_user_score(user_id, change):
+    '''
+    applies the score change of a completed gameplay to the cached total. A missing total is left
+    missing, the next read calculates it from the database.
+    '''
+    if not change:
+        return
+    try:
+        cache.incr(get_user_score_key(user_id), change)
+    except ValueError:
+        pass
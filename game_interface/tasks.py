@@ -0,0 +1,10 @@
+from qverse.celery_manager import celery_app
+from .gameplay_service import flush_gameplay_buffer
+
+
+@celery_app.task(ignore_result=True)
+def flush_gameplay_buffer_task():
+    '''
+    run by celery beat every GAMEPLAY_FLUSH_INTERVAL seconds
+    '''
+    flush_gameplay_buffer()
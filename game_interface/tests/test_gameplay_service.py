@@ -0,0 +1,79 @@
+from django.core.cache import caches
+from django.test import override_settings
+
+from generator.tests.base import QuestTestCase
+from generator.models import Question, Option
+from user.models import User
+from ..gameplay_service import flush_gameplay_buffer
+from ..models import UserGameplay, UserScoreByCategoryForGameplay
+
+
+BUFFERED_CACHES = {
+    'default'   : {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'gameplay'  : {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'gameplay'},
+}
+
+
+@override_settings(CACHES=BUFFERED_CACHES)
+class GameplayWriteBehindTest(QuestTestCase):
+    def setUp(self):
+        super().setUp()
+        caches['gameplay'].clear()
+        self.user = User.objects.create(username='player', email='player@example.com')
+        self.client.force_authenticate(user=self.user)
+
+        self.next_question = Question.objects.create(quest=self.quest, question_text='Second question', depth=1)
+        Option.objects.create(question=self.next_question, option_text='Stay')
+        self.options[0].next_question = self.next_question
+        self.options[0].save()
+
+    def test_progress_is_written_on_flush(self):
+        self.client.post(f'/api/gameplay/start_quest/{self.quest.slug}/', {}, format='json')
+        response = self.client.post(
+            f'/api/gameplay/answer_question/{self.question.id}/',
+            {'option_id': self.options[0].id},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(UserGameplay.objects.exists())
+
+        self.assertEqual(flush_gameplay_buffer(), 1)
+        user_gameplay = UserGameplay.objects.get(user=self.user, quest=self.quest)
+        self.assertEqual(user_gameplay.current_question_id, self.next_question.id)
+        self.assertFalse(user_gameplay.completed)
+        self.assertEqual(UserScoreByCategoryForGameplay.objects.get(user_gameplay=user_gameplay, score_category=self.category).score, 1)
+
+        # nothing new to write
+        self.assertEqual(flush_gameplay_buffer(), 0)
+
+    def test_replayed_flush_writes_the_same_rows(self):
+        self.client.post(f'/api/gameplay/start_quest/{self.quest.slug}/', {}, format='json')
+        self.client.post(
+            f'/api/gameplay/answer_question/{self.question.id}/',
+            {'option_id': self.options[0].id},
+            format='json'
+        )
+
+        flush_gameplay_buffer()
+        # a flush that crashed before moving the cursor replays the same part of the log
+        caches['gameplay'].set('gameplay_flush_cursor', 0, timeout=None)
+        for sequence in range(1, 3):
+            caches['gameplay'].set(f'gameplay_dirty:{sequence}', f'gameplay_state:{self.user.id}:{self.quest.id}')
+        flush_gameplay_buffer()
+
+        self.assertEqual(UserGameplay.objects.count(), 1)
+        self.assertEqual(UserScoreByCategoryForGameplay.objects.get().score, 1)
+
+    def test_progress_is_written_at_once_without_buffer(self):
+        with self.settings(CACHES={'default': BUFFERED_CACHES['default']}):
+            self.client.post(f'/api/gameplay/start_quest/{self.quest.slug}/', {}, format='json')
+            self.client.post(
+                f'/api/gameplay/answer_question/{self.question.id}/',
+                {'option_id': self.options[0].id},
+                format='json'
+            )
+            self.assertEqual(flush_gameplay_buffer(), 0)
+
+        user_gameplay = UserGameplay.objects.get(user=self.user, quest=self.quest)
+        self.assertEqual(user_gameplay.current_question_id, self.next_question.id)
+        self.assertEqual(UserScoreByCategoryForGameplay.objects.get(user_gameplay=user_gameplay).score, 1)
@@ -0,0 +1,110 @@
+import random
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from generator.tests.base import QuestTestCase
+from generator.models import ScoreCategory
+from user.models import User
+from ..leaderboard_service import GLOBAL_BOARD, LocalLeaderboardBackend, get_backend, get_leaderboard, get_quest_board, get_universe_board, get_user_rank, rebuild_leaderboards, update_leaderboards
+from ..models import UserGameplay, UserScoreByCategoryForGameplay
+from ..service import calculate_user_score, get_user_score
+
+
+class LocalLeaderboardBackendTest(TestCase):
+    def test_matches_sorted_scores(self):
+        backend = LocalLeaderboardBackend()
+        scores = {}
+        for _ in range(500):
+            member = str(random.randint(1, 60))
+            if random.random() < 0.5:
+                scores[member] = random.randint(-20, 20)
+                backend.set_score('board', member, scores[member])
+            else:
+                amount = random.randint(-5, 5)
+                scores[member] = scores.get(member, 0) + amount
+                backend.increment_score('board', member, amount)
+
+        # redis orders ZREVRANGE by score, then member, both descending
+        expected = sorted(scores.items(), key=lambda item: (item[1], item[0]), reverse=True)
+        self.assertEqual(backend.get_size('board'), len(expected))
+        self.assertEqual(backend.get_top('board', 0, len(expected)), expected)
+        self.assertEqual(backend.get_top('board', 5, 10), expected[5:15])
+        for rank, (member, _) in enumerate(expected):
+            self.assertEqual(backend.get_rank('board', member), rank)
+
+
+class LeaderboardTest(QuestTestCase):
+    def setUp(self):
+        super().setUp()
+        get_backend().boards.clear()
+        self.users = [User.objects.create(username=f'player{i}', email=f'player{i}@example.com') for i in range(3)]
+
+    def test_totals_are_updated_incrementally(self):
+        universe_id = self.quest.universe_id
+        update_leaderboards(self.users[0].id, self.quest.id, universe_id, 5)
+        update_leaderboards(self.users[1].id, self.quest.id, universe_id, 8)
+        # replaying a completion changes nothing, replaying the quest replaces its score
+        update_leaderboards(self.users[0].id, self.quest.id, universe_id, 5)
+        update_leaderboards(self.users[1].id, self.quest.id, universe_id, 3)
+
+        for board in [GLOBAL_BOARD, get_quest_board(self.quest.id), get_universe_board(universe_id)]:
+            self.assertEqual(get_leaderboard(board), [(self.users[0].id, 5, 1), (self.users[1].id, 3, 2)])
+        self.assertEqual(get_user_rank(GLOBAL_BOARD, self.users[1].id), (3, 2))
+        self.assertIsNone(get_user_rank(GLOBAL_BOARD, self.users[2].id))
+
+    def test_rebuild_and_endpoints(self):
+        for user, score in zip(self.users, [4, 9]):
+            user_gameplay = UserGameplay.objects.create(user=user, quest=self.quest, current_question=self.question, completed=True)
+            UserScoreByCategoryForGameplay.objects.create(
+                user_gameplay=user_gameplay, score_category=ScoreCategory.objects.get(quest=self.quest), score=score
+            )
+
+        self.assertEqual(rebuild_leaderboards(), 2)
+
+        response = self.client.get('/api/gameplay/leaderboard/', {'quest': self.quest.slug})
+        details = response.json()['data']['leaderboard_details']
+        self.assertEqual([(entry['name'], entry['score'], entry['rank']) for entry in details], [('player1', 9, 1), ('player0', 4, 2)])
+        self.assertEqual(details[0]['quests_completed'], 1)
+
+        response = self.client.get('/api/gameplay/leaderboard/', {'limit': 0, 'offset': -5})
+        self.assertEqual(len(response.json()['data']['leaderboard_details']), 1)
+        response = self.client.get('/api/gameplay/leaderboard/', {'limit': 'ten'})
+        self.assertEqual(response.status_code, 400)
+
+        self.client.force_authenticate(user=self.users[0])
+        response = self.client.get('/api/gameplay/leaderboard/me/')
+        self.assertEqual(response.json()['data']['rank'], 2)
+
+    def test_cached_user_score_follows_completions(self):
+        user_gameplay = UserGameplay.objects.create(user=self.users[0], quest=self.quest, current_question=self.question, completed=True)
+        UserScoreByCategoryForGameplay.objects.create(
+            user_gameplay=user_gameplay, score_category=ScoreCategory.objects.get(quest=self.quest), score=4
+        )
+        rebuild_leaderboards()
+        cache.clear()
+        self.assertEqual(get_user_score(self.users[0].id), 4)
+
+        # the quest is completed again with a higher score
+        update_leaderboards(self.users[0].id, self.quest.id, self.quest.universe_id, 6)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_user_score(self.users[0].id), 6)
+
+
+    def test_replayed_quest_is_taken_off_the_boards(self):
+        user_gameplay = UserGameplay.objects.create(user=self.users[0], quest=self.quest, current_question=self.question, completed=True)
+        UserScoreByCategoryForGameplay.objects.create(
+            user_gameplay=user_gameplay, score_category=ScoreCategory.objects.get(quest=self.quest), score=4
+        )
+        rebuild_leaderboards()
+        cache.clear()
+        self.assertEqual(get_user_score(self.users[0].id), 4)
+
+        self.client.force_authenticate(user=self.users[0])
+        self.client.post(f'/api/gameplay/start_quest/{self.quest.slug}/', {}, format='json')
+
+        self.assertFalse(UserGameplay.objects.get(id=user_gameplay.id).completed)
+        self.assertIsNone(get_user_rank(get_quest_board(self.quest.id), self.users[0].id))
+        self.assertEqual(get_user_rank(GLOBAL_BOARD, self.users[0].id), (0, 1))
+        self.assertEqual(get_user_score(self.users[0].id), 0)
+        self.assertEqual(calculate_user_score(self.users[0].id), 0)
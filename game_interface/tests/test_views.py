@@ -0,0 +1,123 @@
+import json
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+
+from generator.tests.base import QuestTestCase, QuestTransactionTestCase, claude_question_response
+from generator.lookup_service import get_quest_lookups, get_character_index
+from generator.models import Question, Option, Collectible
+from generator.service import get_question_lease_key
+
+
+@override_settings(QUEST_SNAPSHOT_ENABLED=False)
+class AnswerQuestionTest(QuestTestCase):
+    def setUp(self):
+        super().setUp()
+        self.next_question = Question.objects.create(
+            quest=self.quest,
+            question_text='Second question',
+            parent_option=self.options[0],
+            characters=json.dumps(['Ava']),
+            depth=1,
+            path=self.question.get_child_path()
+        )
+        for text in ['Stay', 'Run']:
+            Option.objects.create(question=self.next_question, option_text=text)
+
+        self.options[0].next_question = self.next_question
+        self.options[0].save()
+        Collectible.objects.create(option=self.options[0], name='Sword', description='sharp', image_path='sword.png')
+
+    def test_answer_with_generated_next_question(self):
+        get_quest_lookups(self.quest.id)
+        get_character_index(self.quest.id)
+
+        # option (with question and next question) and next question options. Score categories,
+        # collectibles and characters come from the cached lookup tables.
+        with self.assertNumQueries(2):
+            response = self.client.post(
+                f'/api/gameplay/answer_question/{self.question.id}/',
+                {'option_id': self.options[0].id},
+                format='json'
+            )
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['id'], self.next_question.id)
+        self.assertTrue(data['pregenerated'])
+        self.assertEqual([option['option_text'] for option in data['options']], ['Stay', 'Run'])
+        self.assertEqual(data['characters'][0]['name'], 'Ava')
+        self.assertEqual(data['collectible']['name'], 'Sword')
+        self.assertEqual(list(data['score'].values())[0]['score_change'], 1)
+
+    def test_answer_with_option_of_another_question(self):
+        other_option = Option.objects.get(question=self.next_question, option_text='Stay')
+        response = self.client.post(
+            f'/api/gameplay/answer_question/{self.question.id}/',
+            {'option_id': other_option.id},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(QUEST_SNAPSHOT_ENABLED=False)
+class AnswerQuestionGenerationTest(QuestTransactionTestCase):
+    def test_claude_is_called_outside_of_a_transaction(self):
+        in_atomic_block = []
+
+        def claude(prompt, **kwargs):
+            in_atomic_block.append(connection.in_atomic_block)
+            return claude_question_response(self.category.id)
+
+        with mock.patch('generator.service.query_claude', side_effect=claude), \
+                mock.patch('game_interface.views.schedule_lookahead'):
+            response = self.client.post(
+                f'/api/gameplay/answer_question/{self.question.id}/',
+                {'option_id': self.options[0].id},
+                format='json'
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.json()['pregenerated'])
+        self.assertEqual(in_atomic_block, [False])
+        # the lease is released once the question is committed, not at the end of the request
+        self.assertIsNone(cache.get(get_question_lease_key(self.quest.id, self.options[0].id)))
+
+
+class UniverseCatalogTest(QuestTestCase):
+    def test_catalog_is_cached_until_a_quest_changes(self):
+        self.client.post(f'/api/gameplay/start_quest/{self.quest.slug}/', {}, format='json')
+        self.client.get('/api/gameplay/universes/')
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/gameplay/universes/')
+        quest = response.json()['universe'][0]['quests'][0]
+        self.assertEqual((quest['slug'], quest['playing']), (self.quest.slug, 1))
+
+        self.quest.quest_name = 'Renamed Quest'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.quest.save()
+        response = self.client.get('/api/gameplay/universes/')
+        self.assertEqual(response.json()['universe'][0]['quests'][0]['name'], 'Renamed Quest')
+
+
+class QuestBundleTest(QuestTestCase):
+    def test_bundle_is_revalidated_with_its_etag(self):
+        response = self.client.get(f'/api/gameplay/quest_bundle/{self.quest.slug}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['first_question_id'], self.question.id)
+        etag = response['ETag']
+
+        for if_none_match in [etag, f'W/{etag}', f'"other", {etag}', '*']:
+            with mock.patch('game_interface.views.get_quest_bundle_from_snapshot') as get_bundle:
+                response = self.client.get(f'/api/gameplay/quest_bundle/{self.quest.slug}/', HTTP_IF_NONE_MATCH=if_none_match)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], etag)
+            get_bundle.assert_not_called()
+
+        response = self.client.get(f'/api/gameplay/quest_bundle/{self.quest.slug}/', HTTP_IF_NONE_MATCH='"other"')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get('/api/gameplay/quest_bundle/missing-quest/')
+        self.assertEqual(response.status_code, 404)
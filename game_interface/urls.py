@@ -1,13 +1,16 @@
 from django.urls import path
-from .views import GameplayViewSet, MockLeaderboardView,UserUniverseSuggestionViewSet
+from .views import GameplayViewSet, LeaderBoardViewSet, UserUniverseSuggestionViewSet
 
 urlpatterns = [
     path('start_quest/<str:slug>/', GameplayViewSet.as_view({'post': 'start_quest'}), name='start-quest'),
+    path('start_quest_stream/<str:slug>/', GameplayViewSet.as_view({'get': 'start_quest_stream'}), name='start-quest-stream'),
     path('universes/', GameplayViewSet.as_view({'get': 'get_universes'}), name='universes'),
     path('answer_question/<int:pk>/', GameplayViewSet.as_view({'post': 'answer_question'}), name='answer-question'),
+    path('quest_bundle/<str:slug>/', GameplayViewSet.as_view({'get': 'get_quest_bundle'}), name='quest-bundle'),
     path('score_categories/<str:slug>/', GameplayViewSet.as_view({'get': 'get_score_categories'}), name='score-categories'),
     path('suggest_universe/', UserUniverseSuggestionViewSet.as_view({'post': 'suggest_universe'}), name='suggest-universe'),
-    # path('leaderboard/', MockLeaderboardView.as_view(), name='leaderboard'),
+    path('leaderboard/', LeaderBoardViewSet.as_view({'get': 'get_leaderboard'}), name='leaderboard'),
+    path('leaderboard/me/', LeaderBoardViewSet.as_view({'get': 'get_my_rank'}), name='leaderboard-my-rank'),
     # path('current_gameplay_score/', GameplayViewSet.as_view({'get': 'current_gameplay_score'}), name='current-gameplay-score'),
     # path('user_stats/', GameplayViewSet.as_view({'get': 'user_stats'}), name='user-stats'),
 ]
\ No newline at end of file
@@ -1,109 +1,146 @@
+import json
+
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from django.db import transaction
-from user.models import UserProfile
+from django.http import StreamingHttpResponse
+from django.utils.http import parse_etags
+from user.models import User
 from generator.models import Quest, Question, Option, ScoreCategory, Collectible, Universe
-from generator.service import get_quest_question
-from rest_framework.views import APIView
+from generator.service import get_quest_question, generate_question_stream
+from generator.tasks import schedule_lookahead
+from generator.lookup_service import get_quest_lookups, get_option_collectible, get_score_values
+from generator.catalog_service import get_catalog
+from generator.snapshot_service import get_start_from_snapshot, get_answer_from_snapshot, is_frontier_question, get_quest_bundle_etag, get_quest_bundle_from_snapshot, get_quest_id_of_slug, get_quest_id_of_question
+from django.conf import settings
 from .models import UserGameplay, UserScoreByCategoryForGameplay, UserCollectible, UserUniverseSuggestion
-from django.db.models import Sum
+from .gameplay_service import record_quest_start, record_answer, record_live_player, get_live_players
+from .leaderboard_service import GLOBAL_BOARD, get_quest_board, get_universe_board, get_leaderboard, get_user_rank
+from utils.authenticate import OptionalCustomAuthentication
+from django.db.models import Sum, Count
 from utils.slack_helper import generate_slack_message, slack_send_wrapper
 class GameplayViewSet(viewsets.ViewSet):
-    authentication_classes = ()
+    # gameplay progress is recorded for logged in players, anonymous players can still play
+    authentication_classes = (OptionalCustomAuthentication,)
     permission_classes = ()
     @action(detail=True, methods=['post'])
     def start_quest(self, request, slug=None):
         try:
+            if settings.QUEST_SNAPSHOT_ENABLED:
+                snapshot_data = get_start_from_snapshot(slug)
+                if snapshot_data:
+                    if is_frontier_question(snapshot_data['id']):
+                        schedule_lookahead(snapshot_data['id'])
+                    quest_id = get_quest_id_of_slug(slug)
+                    record_live_player(quest_id)
+                    record_quest_start(request.user, quest_id, snapshot_data['id'], snapshot_data['score'].keys())
+                    return Response(snapshot_data)
+
             quest = Quest.objects.get(slug=slug)
             # if user_profile.total_score < quest.min_score_requirement:
             #     return Response({'error': 'Insufficient score to start this quest'}, status=status.HTTP_400_BAD_REQUEST)
             num_of_options = int(request.data.get('num_of_options', 2))
             question_data = get_quest_question(quest.id, None, num_of_options)
-            quest_audio = quest.audio_url
-            # # Create or get UserGameplay
-            # user_gameplay, created = UserGameplay.objects.get_or_create(
-            #     user=request.user,
-            #     quest=quest,
-            #     defaults={'current_question': Question.objects.get(id=question_data['id'])}
-            # )
-            collectible = {}
-
-            score_categories = ScoreCategory.objects.filter(quest=quest).all()
-
-            score_values = {category.id: {
-                'score_change'  : 0,
-                'max_score'     : 10,
-                'image'         : category.icon,
-                'description'   : category.description,
-                'name'          : category.name
-            } for category in score_categories}
-
-            return Response({
-                **question_data,
-                'score'         : score_values,
-                'collectible'   : collectible,
-                'quest_audio': quest_audio,
-                'quest_thumbnail' : quest.thumbnail,
-                'description' : quest.description,
-                'quest_name' : quest.quest_name,
-                'quest_intro' : quest.intro
-                })
+            return Response(self.start_gameplay(request, quest, question_data))
         
         except Quest.DoesNotExist:
             return Response({'error': 'Quest not found'}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    def start_gameplay(self, request, quest, question_data):
+        '''
+        records the start of the quest and returns the start_quest response for its first question
+        '''
+        schedule_lookahead(question_data['id'])
+        quest_audio = quest.audio_url
+        collectible = {}
+
+        score_values = get_score_values(quest.id)
+
+        record_live_player(quest.id)
+        record_quest_start(request.user, quest.id, question_data['id'], score_values.keys())
+
+        return {
+            **question_data,
+            'score'         : score_values,
+            'collectible'   : collectible,
+            'quest_audio': quest_audio,
+            'quest_thumbnail' : quest.thumbnail,
+            'description' : quest.description,
+            'quest_name' : quest.quest_name,
+            'quest_intro' : quest.intro
+            }
+
+    @action(detail=True, methods=['get'])
+    def start_quest_stream(self, request, slug=None):
+        '''
+        start_quest as server sent events, for quests whose first question isn't generated yet.
+        {'status': 'text', 'text': ...} events carry the question text while claude writes it,
+        {'status': 'question', ...} carries the start_quest response once the question is committed.
+        '''
+        try:
+            quest = Quest.objects.get(slug=slug)
+        except Quest.DoesNotExist:
+            return Response({'error': 'Quest not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        num_of_options = int(request.query_params.get('num_of_options', 2))
+
+        def event_stream():
+            try:
+                streamed = False
+                for event in generate_question_stream(quest.id, None, num_of_options):
+                    if event['status'] == 'text':
+                        streamed = True
+                        yield f"data: {json.dumps(event)}\n\n"
+
+                question_data = {**get_quest_question(quest.id, None, num_of_options), 'pregenerated': not streamed}
+                yield f"data: {json.dumps({'status': 'question', **self.start_gameplay(request, quest, question_data)})}\n\n"
+                yield "data: {\"status\": \"completed\"}\n\n"
+            except Exception as e:
+                yield f"data: {json.dumps({'status': 'error', 'message': str(e)})}\n\n"
+
+        response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    # not atomic: a question generated for the answer calls claude, which must not run in a transaction.
+    # The generated question and the recorded progress are each saved in their own transaction
     @action(detail=True, methods=['post'])
-    @transaction.atomic
     def answer_question(self, request, pk=None):
         try:
-            question = Question.objects.get(pk=pk)
             option_id = request.data.get('option_id')
-            option = Option.objects.get(id=option_id)
-            # user_gameplay = UserGameplay.objects.filter(user=request.user, quest=question.quest).last()
-
-            # Update user's score and collectibles
-            # for category_id, points in option.score_rewards.items():
-            #     user_score, created = UserScoreByCategoryForGameplay.objects.get_or_create(
-            #         user_gameplay=user_gameplay,
-            #         score_category_id=category_id,
-            #         defaults={'score': 0}
-            #     )
-            #     user_score.score += points
-            #     user_score.save()
-            
-            collectible = {}
-
-            # get applicable collectible
-            collectible_item = Collectible.objects.filter(option=option).first()
-
-            if collectible_item:
-                collectible = {
-                    'name'          : collectible_item.name,
-                    'description'   : collectible_item.description,
-                    'image_path'    : collectible_item.image_path
-                }
 
-            # fetch categories of the score rewards
-            score_categories = ScoreCategory.objects.filter(id__in=option.score_rewards.keys())
-
-            # initialise score_values to 0
-            score_values = {category.id: {
-                'score_change'  : 0,
-                'max_score'     : 10,
-                'image'         : category.icon,
-                'description'   : category.description,
-                'name'          : category.name
-            } for category in score_categories}
-
-            # update the score_values with the points from the option
-            for category_id, points in option.score_rewards.items():
-                score_values[int(category_id)] = {
-                    **score_values[int(category_id)],
-                    'score_change': points
-                }
+            if settings.QUEST_SNAPSHOT_ENABLED and option_id:
+                snapshot_data = get_answer_from_snapshot(int(pk), int(option_id))
+                if snapshot_data:
+                    # only the frontier of the tree needs the lookahead task
+                    if snapshot_data.get('id') and is_frontier_question(snapshot_data['id']):
+                        schedule_lookahead(snapshot_data['id'])
+                    record_answer(
+                        request.user,
+                        get_quest_id_of_question(int(pk)),
+                        snapshot_data.get('id'),
+                        {category_id: score['score_change'] for category_id, score in snapshot_data['score'].items()},
+                        completed='id' not in snapshot_data
+                    )
+                    return Response(snapshot_data)
+
+            # one query for the option, its question and the next question, the prefetch
+            # brings the options of the next question
+            option = Option.objects.select_related(
+                'question', 'next_question'
+            ).prefetch_related(
+                'next_question__options'
+            ).annotate(
+                num_of_options=Count('question__options')
+            ).get(id=option_id, question_id=pk)
+            question = option.question
+
+            # applicable collectible and the score categories of the rewards from the quest's lookup tables
+            collectible = get_option_collectible(question.quest_id, option.id)
+            score_values = get_score_values(question.quest_id, option.score_rewards)
 
             # if collectible:
             #     user_collectible, created = UserCollectible.objects.get_or_create(
@@ -114,29 +151,30 @@ class GameplayViewSet(viewsets.ViewSet):
             #     user_collectible.quantity += 1
             #     user_collectible.save()
 
-            # Update total score
-            # total_score = UserScoreByCategoryForGameplay.objects.filter(
-            #     user_gameplay=user_gameplay
-            # ).aggregate(total_score=Sum('score'))['total_score'] or 0
-            next_question_data = get_quest_question(question.quest.id, option.id, len(question.options.all()))
+            next_question_data = get_quest_question(question.quest_id, option.id, option.num_of_options, prev_option=option)
 
             if next_question_data:
+                schedule_lookahead(next_question_data['id'])
                 return_data = {
                     **next_question_data,
                     'score'         : score_values,
                     'collectible'   : collectible
                 }
-                # user_gameplay.current_question = Question.objects.get(id=next_question_data['id'])
-                # user_gameplay.save()
             else:
-                # user_gameplay.completed = True
-                # user_gameplay.save()
                 return_data = {
                     'message'       : 'Quest completed',
                     'score'         : score_values,
                     'collectible'   : collectible
                 }
 
+            record_answer(
+                request.user,
+                question.quest_id,
+                next_question_data['id'] if next_question_data else None,
+                option.score_rewards,
+                completed=not next_question_data
+            )
+
             return Response(return_data)
         
         except (Question.DoesNotExist, Option.DoesNotExist, UserGameplay.DoesNotExist):
@@ -169,95 +207,135 @@ class GameplayViewSet(viewsets.ViewSet):
     #         'completed_quests': completed_quests
     #     })
     
+    @action(detail=False, methods=['get'])
+    def get_quest_bundle(self, request, slug=None):
+        '''
+        returns the full generated tree of the quest so that the client can play the generated
+        branches offline and only call answer_question at the frontier
+        '''
+        quest_id = get_quest_id_of_slug(slug)
+        if quest_id is None:
+            return Response({'error': 'Quest not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        # the etag only needs the snapshot version, the bundle isn't built for a client which has it.
+        # If-None-Match compares weakly, W/"x" matches "x"
+        etag = get_quest_bundle_etag(quest_id)
+        client_etags = [tag[2:] if tag.startswith('W/') else tag for tag in parse_etags(request.headers.get('If-None-Match', ''))]
+        if '*' in client_etags or etag in client_etags:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        bundle, etag = get_quest_bundle_from_snapshot(quest_id)
+        return Response(bundle, headers={'ETag': etag})
+
     @action(detail=False, methods=['get'])
     def get_score_categories(self, request, slug=None):
         # get the quest id from the slug
-        quest = Quest.objects.get(slug=slug)
-        score_categories = ScoreCategory.objects.filter(quest=quest).all()
-        return Response([{'id': category.id, 'name': category.name, 'description': category.description, 'icon': category.icon} for category in score_categories])
+        quest_id = get_quest_id_of_slug(slug)
+        if quest_id is None:
+            return Response({'error': 'Quest not found'}, status=status.HTTP_404_NOT_FOUND)
+        score_categories = get_quest_lookups(quest_id)['score_categories']
+        return Response([{'id': category_id, 'name': category['name'], 'description': category['description'], 'icon': category['icon']} for category_id, category in score_categories.items()])
     
     @action(detail=False, methods=['get'])
     def get_universes(self, request):
-        universes = Universe.objects.all()
-        universe_data = []
-
-        for i in universes:
-            quests = Quest.objects.filter(universe=i)
-            quest_data = []
-            for j in quests:
-                quest_data.append({
-                    'name': j.quest_name,
-                    'description': j.description,
-                    'thumbnail': j.thumbnail,
-                    'slug': j.slug,
-                    'playing': 100,
-                    'tag': "Popular"
-                })
-            universe_data.append({
-                'name': i.universe_name,
-                'description': i.description,
-                'thumbnail': i.thumbnail,
-                'slug': i.slug,
-                'quests': quest_data
-            })
+        catalog = get_catalog()
+        live_players = get_live_players([quest['id'] for universe in catalog for quest in universe['quests']])
+
+        universe_data = [{
+            **universe,
+            'quests': [{
+                'name'          : quest['name'],
+                'description'   : quest['description'],
+                'thumbnail'     : quest['thumbnail'],
+                'slug'          : quest['slug'],
+                'playing'       : live_players[quest['id']],
+                'tag'           : "Popular"
+            } for quest in universe['quests']]
+        } for universe in catalog]
 
         return Response({'universe': universe_data})
 
 
 class LeaderBoardViewSet(viewsets.ViewSet):
-    authentication_classes = ()
+    authentication_classes = (OptionalCustomAuthentication,)
     permission_classes = ()
+
+    def get_board(self, request):
+        '''
+        returns the board and its name for the quest or universe slug in the query params,
+        the global board if neither is given
+        '''
+        if request.query_params.get('quest'):
+            quest = Quest.objects.get(slug=request.query_params['quest'])
+            return get_quest_board(quest.id), quest.quest_name
+        if request.query_params.get('universe'):
+            universe = Universe.objects.get(slug=request.query_params['universe'])
+            return get_universe_board(universe.id), universe.universe_name
+        return GLOBAL_BOARD, 'Top Players'
+
+    def get_page(self, request):
+        '''
+        returns the limit (1 to 100) and offset (0 or more) in the query params, raises ValueError if they aren't integers
+        '''
+        limit = int(request.query_params.get('limit', 10))
+        offset = int(request.query_params.get('offset', 0))
+        return min(max(limit, 1), 100), max(offset, 0)
+
     @action(detail=False, methods=['get'])
     def get_leaderboard(self, request):
-        user_profiles = UserProfile.objects.order_by('-total_score')[:10]
-        leaderboard = [{'username': profile.user.username, 'total_score': profile.total_score} for profile in user_profiles]
-        return Response(leaderboard)
+        try:
+            board, leaderboard_name = self.get_board(request)
+            limit, offset = self.get_page(request)
+            entries = get_leaderboard(board, limit, offset)
 
+            user_ids = [user_id for user_id, _, _ in entries]
+            usernames = dict(User.objects.filter(id__in=user_ids).values_list('id', 'username'))
+            quests_completed = dict(UserGameplay.objects.filter(user_id__in=user_ids, completed=True).values('user_id').annotate(
+                count=Count('id')
+            ).values_list('user_id', 'count'))
+            rewards_collected = dict(UserCollectible.objects.filter(user_id__in=user_ids).values('user_id').annotate(
+                count=Sum('quantity')
+            ).values_list('user_id', 'count'))
 
-class MockLeaderboardView(APIView):
-    authentication_classes = ()
-    permission_classes = ()
-    def get(self, request):
-        mock_data = {
+            return Response({
+                'success': True,
+                'data': {
+                    'leaderboard_name': leaderboard_name,
+                    'leaderboard_details': [{
+                        'rank'              : rank,
+                        'name'              : usernames.get(user_id),
+                        'score'             : score,
+                        'rewards_collected' : rewards_collected.get(user_id, 0),
+                        'quests_completed'  : quests_completed.get(user_id, 0)
+                    } for user_id, score, rank in entries]
+                },
+                'message': 'Success'
+            })
+        except (Quest.DoesNotExist, Universe.DoesNotExist):
+            return Response({'error': 'Quest or Universe not found'}, status=status.HTTP_404_NOT_FOUND)
+        except ValueError:
+            return Response({'error': 'limit and offset must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=False, methods=['get'])
+    def get_my_rank(self, request):
+        if not request.user or not request.user.is_authenticated:
+            return Response({'error': 'Login to see your rank'}, status=status.HTTP_401_UNAUTHORIZED)
+
+        try:
+            board, leaderboard_name = self.get_board(request)
+        except (Quest.DoesNotExist, Universe.DoesNotExist):
+            return Response({'error': 'Quest or Universe not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        user_rank = get_user_rank(board, request.user.id)
+        return Response({
             'success': True,
             'data': {
-                'leaderboard_name': "Kunal Shah's Top Fans",
-                'leaderboard_details': [
-                    {
-                        'name': 'Kaushik',
-                        'score': '10',
-                        'rewards_collected': '100',
-                        'quests_completed': '2'
-                    },
-                    {
-                        'name': 'Gunjan',
-                        'score': '2',
-                        'rewards_collected': '50',
-                        'quests_completed': '2'
-                    },
-                    {
-                        'name': 'Rahul',
-                        'score': '8',
-                        'rewards_collected': '75',
-                        'quests_completed': '3'
-                    },
-                    {
-                        'name': 'Priya',
-                        'score': '5',
-                        'rewards_collected': '60',
-                        'quests_completed': '1'
-                    },
-                    {
-                        'name': 'Amit',
-                        'score': '7',
-                        'rewards_collected': '80',
-                        'quests_completed': '2'
-                    }
-                ]
+                'leaderboard_name'  : leaderboard_name,
+                'rank'              : user_rank[1] if user_rank else None,
+                'score'             : user_rank[0] if user_rank else 0
             },
             'message': 'Success'
-        }
-        return Response(mock_data)
+        })
     
 
 # user can suggest universes. the suggestions will be stored in the database
@@ -3,14 +3,13 @@
 from django import forms
 from django.contrib import admin
 from django.contrib import messages
-from .models import Universe, Quest, Question, Option, ScoreCategory, Collectible, Character, Trivia, TriviaQuestion, HomePage, News
-from .service import generate_universe, generate_quest, generate_question
+from .models import Universe, Quest, Question, Option, ScoreCategory, Collectible, Character, Trivia, TriviaQuestion, HomePage, News, AssetJob, AssetJobStep
+from .service import generate_universe, generate_quest, generate_question_single_flight
 from .universe_service import get_generate_universe_prompt, get_main_characters_migrated, generate_universe_assets
-from .quest_service import generate_quest_assets
 from django.shortcuts import render, redirect
 from django.urls import path, reverse
 import json
-from .admin_views import universe_details, generate_assets_sse, quest_details, generate_quest_assets_sse
+from .admin_views import universe_details, generate_assets, quest_details, generate_quest_assets, asset_job_status
 from django.http import StreamingHttpResponse, HttpResponseBadRequest
 
 class UniverseAdminForm(forms.ModelForm):
@@ -38,7 +37,7 @@ class UniverseAdmin(admin.ModelAdmin):
             path('add/', self.admin_site.admin_view(self.add_universe), name='generator_universe_add'),
             path('create/', self.admin_site.admin_view(self.create_universe_sse), name='generator_universe_create'),
             path('<int:universe_id>/details/', self.admin_site.admin_view(self.universe_details), name='generator_universe_details'),
-            path('<int:universe_id>/generate_assets/', self.admin_site.admin_view(self.generate_assets_sse), name='generator_universe_generate_assets'),
+            path('<int:universe_id>/generate_assets/', self.admin_site.admin_view(generate_assets), name='generator_universe_generate_assets'),
         ]
         return custom_urls + urls
 
@@ -51,7 +50,7 @@ class UniverseAdmin(admin.ModelAdmin):
             universe_prompt = request.session.get('universe_prompt')
             if universe_prompt:
                 try:
-                    universe_id = generate_universe(universe_prompt)
+                    universe_id = generate_universe(universe_prompt, use_cache=False)
                 except Exception as e:
                     messages.error(
                         request, f"Failed to generate universe: {str(e)}")
@@ -65,20 +64,6 @@ class UniverseAdmin(admin.ModelAdmin):
         # This method should return the prompt that will be sent to Claude
         return get_generate_universe_prompt(user_prompt)
 
-    def generate_assets_sse(self, request, universe_id):
-        def event_stream():
-            try:
-                for status in generate_universe_assets(universe_id):
-                    yield f"data: {json.dumps(status)}\n\n"
-                yield "data: {\"status\": \"completed\"}\n\n"
-            except Exception as e:
-                yield f"data: {json.dumps({'status': 'error', 'message': str(e)})}\n\n"
-
-        response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
-        response['Cache-Control'] = 'no-cache'
-        response['X-Accel-Buffering'] = 'no'
-        return response
-
     def universe_details(self, request, universe_id):
         universe = Universe.objects.get(id=universe_id)
         generate_assets_url = reverse('admin:generator_universe_generate_assets', args=[universe_id])
@@ -111,7 +96,7 @@ class UniverseAdmin(admin.ModelAdmin):
             max_questions = request.session.get('max_questions', 9)
             if quest_prompt:
                 try:
-                    quest_id = generate_quest(universe_id, quest_prompt, max_questions)
+                    quest_id = generate_quest(universe_id, quest_prompt, max_questions, use_cache=False)
                     del request.session['quest_prompt']
                     del request.session['max_questions']
                     self.message_user(request, "Quest generated successfully!", messages.SUCCESS)
@@ -155,7 +140,7 @@ class UniverseAdmin(admin.ModelAdmin):
 
         def event_stream():
             try:
-                for status in generate_universe(universe_prompt):
+                for status in generate_universe(universe_prompt, use_cache=False):
                     yield f"data: {json.dumps(status)}\n\n"
                     if 'universe_id' in status:
                         yield f"data: {json.dumps({'status': 'completed', 'universe_id': status['universe_id']})}\n\n"
@@ -186,7 +171,7 @@ class QuestAdmin(admin.ModelAdmin):
         urls = super().get_urls()
         custom_urls = [
             path('<int:quest_id>/details/', self.admin_site.admin_view(quest_details), name='generator_quest_details'),
-            path('<int:quest_id>/generate_assets/', self.admin_site.admin_view(generate_quest_assets_sse), name='generator_quest_generate_assets'),
+            path('<int:quest_id>/generate_assets/', self.admin_site.admin_view(generate_quest_assets), name='generator_quest_generate_assets'),
             path('<int:quest_id>/generate_question/', self.admin_site.admin_view(self.generate_question_sse), name='generator_quest_generate_question'),
         ]
         return custom_urls + urls
@@ -199,7 +184,7 @@ class QuestAdmin(admin.ModelAdmin):
             try:
                 quest = Quest.objects.get(id=quest_id)
                 yield f"data: {json.dumps({'status': 'Generating question'})}\n\n"
-                question_id = generate_question(
+                question_id = generate_question_single_flight(
                     quest_id=quest.id, 
                     prev_option_id=None,
                     num_of_options=2
@@ -228,12 +213,35 @@ class QuestionAdminForm(forms.ModelForm):
         fields = ['quest']
 
 
+class AssetJobStepInline(admin.TabularInline):
+    model = AssetJobStep
+    fields = ('name', 'status', 'error', 'started_at', 'finished_at')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+
+class AssetJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'entity_type', 'entity_id', 'status', 'created_at', 'finished_at')
+    list_filter = ('entity_type', 'status')
+    readonly_fields = ('entity_type', 'entity_id', 'status', 'created_at', 'finished_at')
+    inlines = [AssetJobStepInline]
+
+    def get_urls(self):
+        urls = super().get_urls()
+        custom_urls = [
+            path('<int:job_id>/status/', self.admin_site.admin_view(asset_job_status), name='generator_assetjob_status'),
+        ]
+        return custom_urls + urls
+
+
 admin.site.register(Universe, UniverseAdmin)
 admin.site.register(Quest, QuestAdmin)
 admin.site.register(Option)
 admin.site.register(ScoreCategory)
 admin.site.register(Collectible)
 admin.site.register(Character)
+admin.site.register(AssetJob, AssetJobAdmin)
 
 admin.site.register(Trivia)
 admin.site.register(TriviaQuestion)
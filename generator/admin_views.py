@@ -1,14 +1,15 @@
 from django.contrib.admin.views.decorators import staff_member_required
-from django.http import StreamingHttpResponse
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_POST
 from django.shortcuts import render, get_object_or_404
 from django.urls import reverse
 from django.conf import settings
 import json
 
-from .models import Universe, Quest, ScoreCategory, Question
-from .universe_service import generate_universe_assets, get_main_characters_migrated
-from .quest_service import generate_quest_assets
+from .models import AssetJob, Universe, Quest, ScoreCategory, Question
+from .universe_service import get_main_characters_migrated
 from .universe_service import generate_universe
+from .asset_job_service import get_asset_job_status, start_asset_job
 
 FRONTEND_URL = settings.FRONTEND_URL
 
@@ -24,37 +25,37 @@ def universe_details(request, universe_id):
         'generate_assets_url': generate_assets_url
     })
 
-@staff_member_required
-def generate_assets_sse(request, universe_id):
-    def event_stream():
-        try:
-            for status in generate_universe_assets(universe_id):
-                yield f"data: {json.dumps(status)}\n\n"
-            yield "data: {\"status\": \"completed\"}\n\n"
-        except Exception as e:
-            yield f"data: {json.dumps({'status': 'error', 'message': str(e)})}\n\n"
+def get_asset_job_response(job):
+    return JsonResponse({
+        **get_asset_job_status(job.id),
+        'status_url': reverse('admin:generator_assetjob_status', args=[job.id])
+    })
 
-    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
-    response['Cache-Control'] = 'no-cache'
-    response['X-Accel-Buffering'] = 'no'
-    return response
 
+@staff_member_required
+@require_POST
+def generate_assets(request, universe_id):
+    '''
+    starts the asset job of the universe, the page polls its status_url
+    '''
+    get_object_or_404(Universe, id=universe_id)
+    return get_asset_job_response(start_asset_job(AssetJob.EntityTypes.UNIVERSE, universe_id))
 
 
 @staff_member_required
-def generate_quest_assets_sse(request, quest_id):
-    def event_stream():
-        try:
-            for status in generate_quest_assets(quest_id):
-                yield f"data: {json.dumps(status)}\n\n"
-            yield "data: {\"status\": \"completed\"}\n\n"
-        except Exception as e:
-            yield f"data: {json.dumps({'status': 'error', 'message': str(e)})}\n\n"
+@require_POST
+def generate_quest_assets(request, quest_id):
+    '''
+    starts the asset job of the quest, the page polls its status_url
+    '''
+    get_object_or_404(Quest, id=quest_id)
+    return get_asset_job_response(start_asset_job(AssetJob.EntityTypes.QUEST, quest_id))
 
-    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
-    response['Cache-Control'] = 'no-cache'
-    response['X-Accel-Buffering'] = 'no'
-    return response
+
+@staff_member_required
+def asset_job_status(request, job_id):
+    get_object_or_404(AssetJob, id=job_id)
+    return JsonResponse(get_asset_job_status(job_id))
 
 
 @staff_member_required
@@ -64,7 +65,7 @@ def create_universe_sse(request):
         
         def event_stream():
             try:
-                for status in generate_universe(universe_prompt):
+                for status in generate_universe(universe_prompt, use_cache=False):
                     yield f"data: {json.dumps(status)}\n\n"
                     if 'universe_id' in status:
                         # If we have a universe_id, the creation is complete
@@ -0,0 +1,148 @@
+'''
+Asset generation of universes and quests as a DAG of celery tasks, tracked by an AssetJob.
+
+Every asset is a step run by its own task, so the steps of a job run in parallel across the workers:
+
+    universe:   thumbnail | characters
+    quest:      (rewards -> reward_images) | thumbnail | characters | score_category_icons
+                | background_images | audio
+
+The steps are the header of a chord whose callback ends the job. A step records its own state on its
+AssetJobStep row and never raises, so a failed step doesn't keep the callback from running. The admin
+starts a job with start_asset_job and polls get_asset_job_status instead of holding a request open.
+'''
+from datetime import timedelta
+
+from celery import chain, chord, group
+from django.db import transaction
+from django.utils import timezone
+from structlog import get_logger
+
+from .models import AssetJob, AssetJobStep, Quest, Universe
+from .quest_service import (
+    generate_all_images_for_quest_rewards, generate_background_images, generate_icons_for_score_categories,
+    generate_image_for_character_in_quest, generate_quest_audio, generate_quest_thumbnail_image, generate_rewards_for_quest
+)
+from .telemetry_service import tag_entity
+from .universe_service import generate_image_for_character_in_universe, generate_universe_thumbnail_image
+
+logger = get_logger()
+
+# a job older than this is considered lost (e.g. its worker died) and a new one can be started
+ACTIVE_JOB_TIMEOUT = 60 * 60
+
+STEPS = {
+    AssetJob.EntityTypes.UNIVERSE: {
+        'thumbnail'             : generate_universe_thumbnail_image,
+        'characters'            : generate_image_for_character_in_universe,
+    },
+    AssetJob.EntityTypes.QUEST: {
+        'rewards'               : generate_rewards_for_quest,
+        'reward_images'         : generate_all_images_for_quest_rewards,
+        'thumbnail'             : generate_quest_thumbnail_image,
+        'characters'            : generate_image_for_character_in_quest,
+        'score_category_icons'  : generate_icons_for_score_categories,
+        'background_images'     : generate_background_images,
+        'audio'                 : generate_quest_audio,
+    },
+}
+
+ENTITY_MODELS = {
+    AssetJob.EntityTypes.UNIVERSE   : Universe,
+    AssetJob.EntityTypes.QUEST      : Quest,
+}
+
+# steps which need another one to end first, the others start at once
+DEPENDENCIES = {
+    'reward_images' : 'rewards',
+}
+
+
+def get_workflow(job, step_names):
+    '''
+    returns the celery canvas of the job's steps, with the steps which depend on another one chained after it
+    '''
+    from .tasks import finish_asset_job_task, run_asset_step_task
+
+    branches = []
+    for name in step_names:
+        if name in DEPENDENCIES:
+            continue
+        branch = [run_asset_step_task.si(job.id, name)]
+        branch += [run_asset_step_task.si(job.id, after) for after, before in DEPENDENCIES.items() if before == name and after in step_names]
+        branches.append(chain(*branch) if len(branch) > 1 else branch[0])
+
+    return chord(group(branches), finish_asset_job_task.si(job.id))
+
+
+def start_asset_job(entity_type, entity_id):
+    '''
+    creates the job of the assets of the universe or quest and enqueues its tasks once committed.
+    returns the job, the one already running for the entity if any
+    '''
+    step_names = list(STEPS[entity_type])
+    with transaction.atomic():
+        # the lock on the entity row keeps two requests from both finding no active job
+        ENTITY_MODELS[entity_type].objects.select_for_update().get(id=entity_id)
+        active = AssetJob.objects.filter(
+            entity_type=entity_type,
+            entity_id=entity_id,
+            status__in=[AssetJob.JobStatuses.PENDING, AssetJob.JobStatuses.RUNNING],
+            created_at__gte=timezone.now() - timedelta(seconds=ACTIVE_JOB_TIMEOUT)
+        ).order_by('-id').first()
+        if active:
+            return active
+
+        job = AssetJob.objects.create(entity_type=entity_type, entity_id=entity_id)
+        AssetJobStep.objects.bulk_create([AssetJobStep(job=job, name=name) for name in step_names])
+        transaction.on_commit(lambda: get_workflow(job, step_names).apply_async())
+
+    logger.info("Started asset job", job_id=job.id, entity_type=entity_type, entity_id=entity_id, steps=step_names)
+    return job
+
+
+def run_asset_step(job_id, name):
+    '''
+    generates the asset of the step, recording its state. returns True if it succeeded
+    '''
+    job = AssetJob.objects.get(id=job_id)
+    now = timezone.now()
+    AssetJob.objects.filter(id=job_id, status=AssetJob.JobStatuses.PENDING).update(status=AssetJob.JobStatuses.RUNNING)
+    AssetJobStep.objects.filter(job_id=job_id, name=name).update(status=AssetJob.JobStatuses.RUNNING, started_at=now)
+
+    try:
+        with tag_entity(job.entity_type.lower(), job.entity_id):
+            STEPS[job.entity_type][name](job.entity_id)
+    except Exception as e:
+        logger.error("Asset step failed", job_id=job_id, step=name, er=e)
+        AssetJobStep.objects.filter(job_id=job_id, name=name).update(
+            status=AssetJob.JobStatuses.FAILED, error=repr(e), finished_at=timezone.now()
+        )
+        return False
+
+    AssetJobStep.objects.filter(job_id=job_id, name=name).update(status=AssetJob.JobStatuses.SUCCEEDED, finished_at=timezone.now())
+    return True
+
+
+def finish_asset_job(job_id):
+    '''
+    ends the job once all its steps have run, failed if any step failed
+    '''
+    failed = AssetJobStep.objects.filter(job_id=job_id).exclude(status=AssetJob.JobStatuses.SUCCEEDED).exists()
+    status = AssetJob.JobStatuses.FAILED if failed else AssetJob.JobStatuses.SUCCEEDED
+    AssetJob.objects.filter(id=job_id).update(status=status, finished_at=timezone.now())
+    logger.info("Finished asset job", job_id=job_id, status=status)
+
+
+def get_asset_job_status(job_id):
+    job = AssetJob.objects.get(id=job_id)
+    return {
+        'id'            : job.id,
+        'entity_type'   : job.entity_type,
+        'entity_id'     : job.entity_id,
+        'status'        : job.status,
+        'steps'         : [
+            {'name': step.name, 'status': step.status, 'error': step.error}
+            for step in job.steps.order_by('id')
+        ],
+    }
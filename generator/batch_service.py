@@ -0,0 +1,253 @@
+'''
+Batch generation: prompts of bulk offline work are sent as one claude message batch, which costs
+less and isn't bound by the per minute limits, and the results are stored when the batch ends.
+
+- questions: the question after every option of the quests which has none yet (one level of the
+  quest trees). With continue_tree the next level is submitted once a level is stored.
+- rewards: the rewards of the quests which have none yet.
+- trivia: a trivia for each of the given topics.
+
+poll_generation_batches (run by celery beat) stores the results of the batches which have ended.
+GENERATION_BATCH_BACKEND selects the claude batches api ('anthropic') or the in-process fake ('fake'),
+which is for tests only.
+'''
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from structlog import get_logger
+
+from utils.streaming_json import StreamingJsonParser
+from .models import GenerationBatch, Option, Quest, Question, QuestRewardCollection
+from .fake_provider_service import get_response
+from .quest_service import get_rewards_prompt
+from .service import (
+    CLAUDE_MODEL, CLAUDE_MAX_TOKENS, client, generate_trivia_prompt, get_generated_question_id, parse_question_response,
+    prepare_question_generation, save_generated_question, save_trivia
+)
+
+logger = get_logger()
+
+POLL_LOCK_KEY       = 'generation_batch_poll_lock'
+POLL_LOCK_TIMEOUT   = 60 * 30
+
+
+class AnthropicBatchClient:
+    def create(self, requests):
+        return client.beta.messages.batches.create(requests=requests).id
+
+    def has_ended(self, batch_id):
+        return client.beta.messages.batches.retrieve(batch_id).processing_status == 'ended'
+
+    def get_results(self, batch_id):
+        '''
+        yields (custom_id, text of the response) of the requests, None for the ones which failed
+        '''
+        for entry in client.beta.messages.batches.results(batch_id):
+            if entry.result.type == 'succeeded':
+                yield entry.custom_id, entry.result.message.content[0].text
+            else:
+                logger.error("Batch request failed", batch_id=batch_id, custom_id=entry.custom_id, result=entry.result.type)
+                yield entry.custom_id, None
+
+
+class FakeBatchClient:
+    '''
+    in-process stand-in for the batches api: a batch ends when it is polled and every request is
+    answered by respond(prompt), which returns the text after the '{' prefill (None for a failure).
+    The default answers like the fake claude of fake_provider_service.
+    For tests only: the batches live in the memory of the process which submitted them, a batch
+    submitted by another process (e.g. the command while celery beat polls) is never found and is
+    marked failed.
+    '''
+    def __init__(self):
+        self.batches = {}
+        self.respond = get_response
+
+    def create(self, requests):
+        batch_id = f"fake_batch_{uuid.uuid4().hex}"
+        self.batches[batch_id] = requests
+        return batch_id
+
+    def has_ended(self, batch_id):
+        return True
+
+    def get_results(self, batch_id):
+        for request in self.batches.pop(batch_id, []):
+            yield request['custom_id'], self.respond(request['params']['messages'][0]['content'])
+
+
+fake_batch_client = FakeBatchClient()
+
+
+def get_batch_client():
+    if settings.GENERATION_BATCH_BACKEND == 'fake':
+        return fake_batch_client
+    return AnthropicBatchClient()
+
+
+def submit_batch(kind, jobs, continue_tree=False):
+    '''
+    sends the [(prompt, target)] jobs as one batch. target is stored with the batch and tells
+    where the result of the prompt goes. returns the GenerationBatch, None if there are no jobs
+    '''
+    if not jobs:
+        return None
+
+    requests = []
+    targets = {}
+    for i, (prompt, target) in enumerate(jobs):
+        custom_id = f"{kind.lower()}-{i}"
+        targets[custom_id] = target
+        requests.append({
+            'custom_id' : custom_id,
+            'params'    : {
+                'model'         : CLAUDE_MODEL,
+                'max_tokens'    : CLAUDE_MAX_TOKENS,
+                'messages'      : [
+                    {"role": "user", "content": prompt},
+                    {"role": "assistant", "content": "{"}
+                ]
+            }
+        })
+
+    batch = GenerationBatch.objects.create(
+        kind=kind,
+        provider_batch_id=get_batch_client().create(requests),
+        requests=targets,
+        continue_tree=continue_tree
+    )
+    logger.info("Submitted generation batch", kind=kind, batch_id=batch.provider_batch_id, requests=len(requests))
+    return batch
+
+
+def submit_question_batch(quest_ids, num_of_options=2, continue_tree=False):
+    '''
+    submits the generation of the question after every option of the quests that has no next question
+    (or of the first question of a quest without questions)
+    '''
+    jobs = []
+    for quest in Quest.objects.filter(id__in=quest_ids):
+        if not Question.objects.filter(quest=quest).exists():
+            prev_option_ids = [None]
+        else:
+            prev_option_ids = Option.objects.filter(
+                question__quest=quest,
+                next_question__isnull=True,
+                question__depth__lt=quest.max_questions
+            ).values_list('id', flat=True)
+
+        for prev_option_id in prev_option_ids:
+            generation = prepare_question_generation(quest.id, prev_option_id, num_of_options)
+            if generation:
+                jobs.append((generation['prompt'], {
+                    'quest_id'          : quest.id,
+                    'prev_option_id'    : prev_option_id,
+                    'num_of_options'    : num_of_options
+                }))
+
+    return submit_batch(GenerationBatch.BatchKinds.QUESTION, jobs, continue_tree)
+
+
+def submit_reward_batch(quest_ids):
+    '''
+    submits the generation of the rewards of the quests which have none
+    '''
+    quests = Quest.objects.filter(id__in=quest_ids).exclude(
+        id__in=QuestRewardCollection.objects.values('quest_id')
+    ).select_related('universe')
+    return submit_batch(GenerationBatch.BatchKinds.REWARD, [(get_rewards_prompt(quest), {'quest_id': quest.id}) for quest in quests])
+
+
+def submit_trivia_batch(trivia_prompts, no_of_questions=10):
+    '''
+    submits the generation of a trivia for each of the prompts
+    '''
+    return submit_batch(GenerationBatch.BatchKinds.TRIVIA, [
+        (generate_trivia_prompt(trivia_prompt, no_of_questions), {'trivia_prompt': trivia_prompt})
+        for trivia_prompt in trivia_prompts
+    ])
+
+
+def parse_response(text):
+    parser = StreamingJsonParser()
+    parser.feed('{' + text)
+    return parser.close()
+
+
+def store_question(target, text):
+    # the question could have been generated for a player while the batch was processed
+    if get_generated_question_id(target['quest_id'], target['prev_option_id']):
+        return
+    generation = prepare_question_generation(target['quest_id'], target['prev_option_id'], target['num_of_options'])
+    if generation is None:
+        return
+    save_generated_question(generation, parse_question_response('{' + text))
+
+
+def store_rewards(target, text):
+    if QuestRewardCollection.objects.filter(quest_id=target['quest_id']).exists():
+        return
+    QuestRewardCollection.objects.bulk_create([
+        QuestRewardCollection(quest_id=target['quest_id'], name=reward['name'], description=reward['description'])
+        for reward in parse_response(text)['collectible_rewards']
+    ])
+
+
+def store_trivia(target, text):
+    save_trivia(parse_response(text))
+
+
+STORE_RESULT = {
+    GenerationBatch.BatchKinds.QUESTION : store_question,
+    GenerationBatch.BatchKinds.REWARD   : store_rewards,
+    GenerationBatch.BatchKinds.TRIVIA   : store_trivia,
+}
+
+
+def process_batch(batch):
+    '''
+    stores the results of the batch if it has ended. returns True once the batch is processed
+    '''
+    batch_client = get_batch_client()
+    if not batch_client.has_ended(batch.provider_batch_id):
+        return False
+
+    for custom_id, text in batch_client.get_results(batch.provider_batch_id):
+        target = batch.requests.get(custom_id)
+        if target is None or text is None:
+            batch.failed_count += 1
+            continue
+        try:
+            STORE_RESULT[batch.kind](target, text)
+            batch.succeeded_count += 1
+        except Exception as e:
+            logger.error("Failed to store batch result", batch_id=batch.provider_batch_id, custom_id=custom_id, er=e)
+            batch.failed_count += 1
+
+    batch.status = GenerationBatch.BatchStatuses.PROCESSED if batch.succeeded_count else GenerationBatch.BatchStatuses.FAILED
+    batch.save()
+    logger.info("Processed generation batch", batch_id=batch.provider_batch_id, succeeded=batch.succeeded_count, failed=batch.failed_count)
+
+    if batch.kind == GenerationBatch.BatchKinds.QUESTION and batch.continue_tree and batch.succeeded_count:
+        targets = list(batch.requests.values())
+        submit_question_batch({target['quest_id'] for target in targets}, targets[0]['num_of_options'], continue_tree=True)
+    return True
+
+
+def poll_generation_batches():
+    '''
+    processes the batches which have ended. returns the number of batches processed
+    '''
+    if not cache.add(POLL_LOCK_KEY, 1, timeout=POLL_LOCK_TIMEOUT):
+        logger.info("Generation batch poll already running")
+        return 0
+
+    try:
+        processed = 0
+        for batch in GenerationBatch.objects.filter(status=GenerationBatch.BatchStatuses.IN_PROGRESS).order_by('id'):
+            if process_batch(batch):
+                processed += 1
+        return processed
+    finally:
+        cache.delete(POLL_LOCK_KEY)
@@ -0,0 +1,56 @@
+'''
+The universe and quest catalog shown on the gameplay home screen, built with one prefetch and cached
+under a version token that is replaced when a Universe or Quest is saved or deleted (generator/signals.py).
+'''
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Universe
+
+CATALOG_TIMEOUT     = 60 * 60 * 24
+CATALOG_VERSION_KEY = 'catalog_version'
+
+
+def get_catalog_version():
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def invalidate_catalog():
+    transaction.on_commit(lambda: cache.set(CATALOG_VERSION_KEY, uuid.uuid4().hex, timeout=None))
+
+
+def build_catalog():
+    catalog = []
+    for universe in Universe.objects.prefetch_related('quests'):
+        catalog.append({
+            'name'          : universe.universe_name,
+            'description'   : universe.description,
+            'thumbnail'     : universe.thumbnail,
+            'slug'          : universe.slug,
+            'quests'        : [{
+                'id'            : quest.id,
+                'name'          : quest.quest_name,
+                'description'   : quest.description,
+                'thumbnail'     : quest.thumbnail,
+                'slug'          : quest.slug
+            } for quest in universe.quests.all()]
+        })
+    return catalog
+
+
+def get_catalog():
+    '''
+    returns [{universe..., 'quests': [{'id', quest...}]}] of every universe
+    '''
+    key = f"catalog:{get_catalog_version()}"
+    catalog = cache.get(key)
+    if catalog is None:
+        catalog = build_catalog()
+        cache.set(key, catalog, timeout=CATALOG_TIMEOUT)
+    return catalog
@@ -0,0 +1,155 @@
+'''
+Content-addressed cache of claude responses. The key is a hash of the model, max_tokens and prompt,
+so identical requests (admin retries, repeated classifications) are answered without an API call.
+
+CLAUDE_RESPONSE_CACHE_BACKEND selects where responses are kept:
+- 'django': the default django cache. Size and eviction are the cache's (redis maxmemory policy,
+  LocMem MAX_ENTRIES).
+- 'sqlite': a local sqlite file at CLAUDE_RESPONSE_CACHE_PATH, bounded to
+  CLAUDE_RESPONSE_CACHE_MAX_ENTRIES by evicting the least recently used responses.
+- 'none': no caching.
+CLAUDE_RESPONSE_CACHE_BYPASS skips the cache for reads and writes.
+'''
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from structlog import get_logger
+
+logger = get_logger()
+
+HITS_KEY    = 'claude_cache_hits'
+MISSES_KEY  = 'claude_cache_misses'
+
+
+def get_response_cache_key(model, max_tokens, prompt):
+    payload = json.dumps([model, max_tokens, prompt], ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class DjangoCacheBackend:
+    def get(self, key):
+        return cache.get(f"claude_response:{key}")
+
+    def set(self, key, response):
+        cache.set(f"claude_response:{key}", response, timeout=settings.CLAUDE_RESPONSE_CACHE_TTL)
+
+    def clear(self):
+        # responses expire with the ttl, there is no index of the keys to delete
+        pass
+
+
+class SqliteBackend:
+    def __init__(self, path, max_entries, ttl):
+        self.max_entries    = max_entries
+        self.ttl            = ttl
+        self.lock           = threading.Lock()
+        self.connection     = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT, created_at REAL, last_used REAL)'
+        )
+        self.connection.execute('CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)')
+        self.connection.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT response FROM responses WHERE key = ? AND created_at > ?', (key, now - self.ttl)
+            ).fetchone()
+            if row is None:
+                return None
+            self.connection.execute('UPDATE responses SET last_used = ? WHERE key = ?', (now, key))
+            self.connection.commit()
+        return row[0]
+
+    def set(self, key, response):
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO responses (key, response, created_at, last_used) VALUES (?, ?, ?, ?)',
+                (key, response, now, now)
+            )
+            # expired responses first, then the least recently used ones above max_entries
+            self.connection.execute('DELETE FROM responses WHERE created_at <= ?', (now - self.ttl,))
+            self.connection.execute(
+                'DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+            self.connection.commit()
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute('DELETE FROM responses')
+            self.connection.commit()
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if settings.CLAUDE_RESPONSE_CACHE_BACKEND == 'none':
+        return None
+
+    with _backend_lock:
+        if _backend is None:
+            if settings.CLAUDE_RESPONSE_CACHE_BACKEND == 'sqlite':
+                _backend = SqliteBackend(
+                    settings.CLAUDE_RESPONSE_CACHE_PATH,
+                    settings.CLAUDE_RESPONSE_CACHE_MAX_ENTRIES,
+                    settings.CLAUDE_RESPONSE_CACHE_TTL
+                )
+            else:
+                _backend = DjangoCacheBackend()
+    return _backend
+
+
+def count(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+def get_cached_response(model, max_tokens, prompt):
+    '''
+    returns the cached response of the request, None on a miss or when the cache is off
+    '''
+    backend = get_backend()
+    if backend is None or settings.CLAUDE_RESPONSE_CACHE_BYPASS:
+        return None
+
+    response = backend.get(get_response_cache_key(model, max_tokens, prompt))
+    count(HITS_KEY if response is not None else MISSES_KEY)
+    if response is not None:
+        logger.info("Claude response served from cache", model=model)
+    return response
+
+
+def store_response(model, max_tokens, prompt, response):
+    backend = get_backend()
+    if backend is None or settings.CLAUDE_RESPONSE_CACHE_BYPASS:
+        return
+    backend.set(get_response_cache_key(model, max_tokens, prompt), response)
+
+
+def get_cache_stats():
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    return {
+        'backend'   : settings.CLAUDE_RESPONSE_CACHE_BACKEND,
+        'hits'      : hits,
+        'misses'    : misses,
+        'hit_rate'  : hits / (hits + misses) if hits + misses else 0
+    }
+
+
+def reset_cache_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
@@ -0,0 +1,394 @@
+'''
+Local stand-ins of the generation providers (claude, openai images and speech, elevenlabs) and of
+the asset storage (s3 uploads and downloads), used when GENERATION_PROVIDER_BACKEND is 'fake' to
+benchmark and load test the generation pipeline without calling, or paying for, the providers.
+
+The fakes have the interface of the clients which the services use and answer like them:
+- claude answers the prompts of the generator (universe, quest, question, trivia, rewards,
+  background images, news category) with json of the schema the prompt asks for. The answer
+  only depends on the prompt, so the same prompt always gets the same response.
+- images are urls of a placeholder png, speech and sound effects are placeholder mp3 bytes.
+
+Each call waits a latency drawn from a lognormal distribution around FAKE_PROVIDERS[provider]['latency']
+seconds (spread by 'latency_sigma') and fails with a retryable 'error_status' error for an
+'error_rate' share of the calls. FAKE_PROVIDER_SEED makes the draws repeatable.
+'''
+import asyncio
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+from django.conf import settings
+
+FAKE_URL = 'https://fake-provider.local'
+
+# 1x1 transparent png
+PNG = bytes.fromhex(
+    '89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+    '1f15c4890000000d49444154789c6360000002000001e221bc330000000049454e44ae426082'
+)
+# one silent mpeg 1 layer 3 frame (128 kbps, 44.1 kHz)
+MP3 = b'\xff\xfb\x90\x64' + bytes(413)
+
+RESPONSE_CHUNK_SIZE = 64
+
+_random = None
+_random_lock = threading.Lock()
+_cached_prefixes = set()
+
+
+class FakeProviderError(Exception):
+    '''
+    failure of a fake call, retryable like the overloaded and unavailable errors of the providers
+    '''
+    def __init__(self, provider, status_code):
+        super().__init__(f"Fake {provider} call failed with {status_code}")
+        self.status_code = status_code
+        self.response = None
+
+
+def get_behaviour(provider):
+    return settings.FAKE_PROVIDERS.get(provider, {})
+
+
+def draw(provider):
+    '''
+    returns (seconds the call takes, whether it fails)
+    '''
+    global _random
+    behaviour = get_behaviour(provider)
+    with _random_lock:
+        if _random is None:
+            _random = random.Random(settings.FAKE_PROVIDER_SEED)
+        latency = behaviour.get('latency', 0)
+        if latency > 0:
+            latency = _random.lognormvariate(math.log(latency), behaviour.get('latency_sigma', 0))
+        fails = _random.random() < behaviour.get('error_rate', 0)
+    return latency, fails
+
+
+def simulate(provider):
+    latency, fails = draw(provider)
+    time.sleep(latency)
+    if fails:
+        raise FakeProviderError(provider, get_behaviour(provider).get('error_status', 503))
+
+
+async def simulate_async(provider):
+    latency, fails = draw(provider)
+    await asyncio.sleep(latency)
+    if fails:
+        raise FakeProviderError(provider, get_behaviour(provider).get('error_status', 503))
+
+
+def get_digest(text):
+    return hashlib.sha256(text.encode()).hexdigest()[:8]
+
+
+def get_count(pattern, prompt, default):
+    match = re.search(pattern, prompt)
+    return int(match.group(1)) if match else default
+
+
+def get_characters(name):
+    return [
+        {
+            'name'              : f"{name} character {i}",
+            'role'              : 'hero' if i == 0 else 'ally',
+            'description'       : f"Character {i} of {name}",
+            'image_description' : f"Portrait of character {i} of {name}",
+            'voice_description' : 'Calm and warm',
+        }
+        for i in range(4)
+    ]
+
+
+def get_universe(prompt, digest):
+    name = f"Fake universe {digest}"
+    return {
+        'name'              : name,
+        'description'       : f"A universe generated locally for {digest}",
+        'key_elements'      : ['courage', 'friendship', 'mystery'],
+        'main_characters'   : get_characters(name),
+    }
+
+
+def get_quest(prompt, digest):
+    name = f"Fake quest {digest}"
+    return {
+        'name'                          : name,
+        'description'                   : f"A quest generated locally for {digest}",
+        'main_characters'               : [
+            {key: c[key] for key in ('name', 'role', 'description', 'image_description')} for c in get_characters(name)
+        ],
+        'story_outline'                 : ['The call', 'The journey', 'The return'],
+        'intro'                         : f"The quest {digest} begins",
+        'background_audio_description'  : 'Soft strings and light percussion at a slow tempo, no vocals',
+        'score_categories'              : [
+            {'category_name': name, 'description': f"How much {name.lower()} the player shows"}
+            for name in ('Courage', 'Wisdom', 'Kindness')
+        ],
+    }
+
+
+def get_question(prompt, digest):
+    category_ids = re.findall(r'ID: (\d+)', prompt)
+    num_of_options = get_count(r'Provide (\d+) options', prompt, 2)
+    return {
+        'text'          : f"Question {digest}: the path splits in front of you",
+        'options'       : [
+            {
+                'text'          : f"Option {i + 1} of {digest}",
+                'score_rewards' : {category_id: (i + j) % 3 - 1 for j, category_id in enumerate(category_ids)},
+            }
+            for i in range(num_of_options)
+        ],
+        'characters'    : ['Narrator'],
+    }
+
+
+def get_trivia(prompt, digest):
+    no_of_questions = get_count(r'Create a trivia with (\d+) questions', prompt, 10)
+    name = f"Fake trivia {digest}"
+    return {
+        'name'                          : name,
+        'description'                   : f"A trivia generated locally for {digest}",
+        'thumbnail_description'         : f"Thumbnail of {name}",
+        'background_audio_description'  : 'Light piano loop, no vocals',
+        'main_characters'               : [{key: c[key] for key in ('name', 'role', 'description')} for c in get_characters(name)[:2]],
+        'questions'                     : [
+            {
+                'question_text'                 : f"Question {i} of {digest}?",
+                'question_number'               : i,
+                'options'                       : [{'text': f"Answer {j}", 'is_correct': j == i % 4} for j in range(4)],
+                'question_image_description'    : f"Image of question {i} of {name}",
+            }
+            for i in range(1, no_of_questions + 1)
+        ],
+    }
+
+
+def get_rewards(prompt, digest):
+    return {
+        'collectible_rewards': [
+            {'name': f"Reward {i} of {digest}", 'description': f"A rare collectible {i}"}
+            for i in range(get_count(r'Generate (\d+) such rewards', prompt, 30))
+        ]
+    }
+
+
+def get_image_descriptions(prompt, digest):
+    return {
+        'image_descriptions': [
+            f"Scene {i} of {digest}" for i in range(get_count(r'descriptions for (\d+) images', prompt, 20))
+        ]
+    }
+
+
+def get_news_category(prompt, digest):
+    return {'category': 'OTHERS'}
+
+
+# (text in the prompt, builder of the response), the first match answers the prompt
+RESPONSES = [
+    ('Create a game universe', get_universe),
+    ('Create a quest for the universe', get_quest),
+    ('Generate a new question for the quest', get_question),
+    ('Create a trivia with', get_trivia),
+    ('collectible_rewards', get_rewards),
+    ('image_descriptions', get_image_descriptions),
+    ('Categorize the news', get_news_category),
+]
+
+
+def get_response(prompt):
+    '''
+    returns the response of the fake claude to the prompt, the text after the '{' prefill
+    '''
+    digest = get_digest(prompt)
+    data = {}
+    for marker, get_data in RESPONSES:
+        if marker in prompt:
+            data = get_data(prompt, digest)
+            break
+    return json.dumps(data)[1:]
+
+
+def get_tokens(text):
+    return math.ceil(len(text) / 4)
+
+
+def get_message(messages):
+    '''
+    answers the user message, whose content is a prompt or a list of text blocks. The blocks marked
+    with cache_control are counted as cache writes the first time and as cache reads after
+    '''
+    content = next(message['content'] for message in messages if message['role'] == 'user')
+    blocks = [{'text': content}] if isinstance(content, str) else content
+    usage = SimpleNamespace(input_tokens=0, output_tokens=0, cache_creation_input_tokens=0, cache_read_input_tokens=0)
+    for block in blocks:
+        if not block.get('cache_control'):
+            usage.input_tokens += get_tokens(block['text'])
+        elif block['text'] in _cached_prefixes:
+            usage.cache_read_input_tokens += get_tokens(block['text'])
+        else:
+            _cached_prefixes.add(block['text'])
+            usage.cache_creation_input_tokens += get_tokens(block['text'])
+
+    text = get_response(''.join(block['text'] for block in blocks))
+    usage.output_tokens = get_tokens(text)
+    return SimpleNamespace(content=[SimpleNamespace(type='text', text=text)], usage=usage, stop_reason='end_turn')
+
+
+def get_image_response(prompt):
+    return SimpleNamespace(data=[SimpleNamespace(url=f"{FAKE_URL}/images/{get_digest(prompt)}.png")])
+
+
+def get_url_content(url):
+    return MP3 if url.endswith(('.mp3', '.wav')) else PNG
+
+
+class FakeResponse:
+    def __init__(self, url):
+        self.url            = url
+        self.status_code    = 200
+        self.content        = get_url_content(url)
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeMessageStream:
+    def __init__(self, messages):
+        self.messages = messages
+        self.message = None
+
+    def __enter__(self):
+        simulate('anthropic')
+        self.message = get_message(self.messages)
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    @property
+    def text_stream(self):
+        text = self.message.content[0].text
+        for i in range(0, len(text), RESPONSE_CHUNK_SIZE):
+            yield text[i:i + RESPONSE_CHUNK_SIZE]
+
+    def get_final_message(self):
+        return self.message
+
+
+class FakeMessages:
+    def create(self, messages, **kwargs):
+        simulate('anthropic')
+        return get_message(messages)
+
+    def stream(self, messages, **kwargs):
+        return FakeMessageStream(messages)
+
+
+class FakeAnthropic:
+    def __init__(self):
+        self.messages = FakeMessages()
+        self.beta = SimpleNamespace(prompt_caching=SimpleNamespace(messages=self.messages))
+
+
+class FakeImages:
+    def generate(self, prompt, **kwargs):
+        simulate('openai')
+        return get_image_response(prompt)
+
+
+class FakeSpeech:
+    def create(self, **kwargs):
+        simulate('openai')
+        return SimpleNamespace(content=MP3)
+
+
+class FakeOpenAI:
+    def __init__(self):
+        self.images = FakeImages()
+        self.audio = SimpleNamespace(speech=FakeSpeech())
+
+
+class FakeS3:
+    def put_object(self, **kwargs):
+        simulate('s3')
+        return {'ETag': get_digest(kwargs.get('Key', ''))}
+
+
+def get(url, **kwargs):
+    '''
+    requests.get of the assets, answered with the placeholder of the url's file type
+    '''
+    simulate('http')
+    return FakeResponse(url)
+
+
+class AsyncFakeImages:
+    async def generate(self, prompt, **kwargs):
+        await simulate_async('openai')
+        return get_image_response(prompt)
+
+
+class AsyncFakeSpeech:
+    async def create(self, **kwargs):
+        await simulate_async('openai')
+        return SimpleNamespace(content=MP3)
+
+
+class AsyncFakeOpenAI:
+    def __init__(self):
+        self.images = AsyncFakeImages()
+        self.audio = SimpleNamespace(speech=AsyncFakeSpeech())
+
+
+class AsyncFakeSoundEffects:
+    async def convert(self, **kwargs):
+        await simulate_async('elevenlabs')
+        yield MP3
+
+
+class AsyncFakeElevenLabs:
+    def __init__(self):
+        self.text_to_sound_effects = AsyncFakeSoundEffects()
+
+    async def generate(self, **kwargs):
+        await simulate_async('elevenlabs')
+
+        async def audio():
+            yield MP3
+        return audio()
+
+    async def clone(self, name, **kwargs):
+        await simulate_async('elevenlabs')
+        return SimpleNamespace(voice_id=f"fake_voice_{get_digest(name)}", name=name)
+
+
+class AsyncFakeHttpClient:
+    async def get(self, url, **kwargs):
+        await simulate_async('http')
+        return FakeResponse(url)
+
+
+ASYNC_CLIENTS = {
+    'openai'        : AsyncFakeOpenAI,
+    'elevenlabs'    : AsyncFakeElevenLabs,
+    'http'          : AsyncFakeHttpClient,
+}
+
+fake_anthropic  = FakeAnthropic()
+fake_openai     = FakeOpenAI()
+fake_s3         = FakeS3()
+
+
+def is_enabled():
+    return settings.GENERATION_PROVIDER_BACKEND == 'fake'
@@ -0,0 +1,124 @@
+'''
+Per-quest lookup tables of the score categories, the collectibles of the options and the characters,
+cached in the shared cache and dropped by the model signals in generator/signals.py whenever the
+quest, a category or a collectible of the quest changes.
+'''
+import json
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Quest, ScoreCategory, Collectible
+
+LOOKUPS_TIMEOUT     = 60 * 60 * 24
+MAX_SCORE           = 10
+
+
+def get_lookups_key(quest_id):
+    return f"quest_lookups:{quest_id}"
+
+
+def build_quest_lookups(quest_id):
+    score_categories = {category.id: {
+        'name'          : category.name,
+        'icon'          : category.icon,
+        'description'   : category.description,
+        'max_score'     : MAX_SCORE
+    } for category in ScoreCategory.objects.filter(quest_id=quest_id)}
+
+    # an option shows the first collectible assigned to it
+    collectibles = {}
+    for collectible in Collectible.objects.filter(option__question__quest_id=quest_id).order_by('id'):
+        collectibles.setdefault(collectible.option_id, {
+            'name'          : collectible.name,
+            'description'   : collectible.description,
+            'image_path'    : collectible.image_path
+        })
+
+    return {
+        'score_categories'  : score_categories,
+        'collectibles'      : collectibles
+    }
+
+
+def get_quest_lookups(quest_id):
+    '''
+    returns {'score_categories': {category_id: {...}}, 'collectibles': {option_id: {...}}} of the quest
+    '''
+    key = get_lookups_key(quest_id)
+    lookups = cache.get(key)
+    if lookups is None:
+        lookups = build_quest_lookups(quest_id)
+        cache.set(key, lookups, timeout=LOOKUPS_TIMEOUT)
+    return lookups
+
+
+def invalidate_quest_lookups(quest_id):
+    '''
+    drops the lookup tables of the quest once the current transaction commits
+    '''
+    transaction.on_commit(lambda: cache.delete(get_lookups_key(quest_id)))
+
+
+def get_option_collectible(quest_id, option_id):
+    return get_quest_lookups(quest_id)['collectibles'].get(option_id, {})
+
+
+def get_score_values(quest_id, score_rewards=None, score_categories=None):
+    '''
+    returns the score values shown to the player. With score_rewards only the rewarded categories
+    are returned with their score change, else every category of the quest with a change of 0.
+    The score categories are read from the lookup tables unless given (e.g. those of a snapshot).
+    '''
+    if score_categories is None:
+        score_categories = get_quest_lookups(quest_id)['score_categories']
+    category_ids = score_categories.keys() if score_rewards is None else [int(category_id) for category_id in score_rewards]
+
+    score_values = {}
+    for category_id in category_ids:
+        category = score_categories.get(category_id)
+        if not category:
+            continue
+        score_values[category_id] = {
+            'score_change'  : 0,
+            'max_score'     : category['max_score'],
+            'image'         : category['icon'],
+            'description'   : category['description'],
+            'name'          : category['name']
+        }
+
+    for category_id, points in (score_rewards or {}).items():
+        if int(category_id) in score_values:
+            score_values[int(category_id)]['score_change'] = points
+
+    return score_values
+
+
+def get_character_index_key(quest_id):
+    return f"quest_characters:{quest_id}"
+
+
+def build_character_index(quest_id):
+    main_characters = Quest.objects.filter(id=quest_id).values_list('main_characters', flat=True).first()
+    return {character.get('name'): {
+        'name'          : character.get('name'),
+        'image'         : character.get('image'),
+        'role'          : character.get('role'),
+        'description'   : character.get('description')
+    } for character in json.loads(main_characters or '[]')}
+
+
+def get_character_index(quest_id):
+    '''
+    returns {name: character} of the main characters of the quest
+    '''
+    key = get_character_index_key(quest_id)
+    index = cache.get(key)
+    if index is None:
+        index = build_character_index(quest_id)
+        cache.set(key, index, timeout=LOOKUPS_TIMEOUT)
+    return index
+
+
+def invalidate_character_index(quest_id):
+    transaction.on_commit(lambda: cache.delete(get_character_index_key(quest_id)))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from generator.claude_cache_service import get_cache_stats, reset_cache_stats
+
+class Command(BaseCommand):
+    help = 'Show the hit and miss counters of the claude response cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Reset the counters after showing them')
+
+    def handle(self, *args, **options):
+        stats = get_cache_stats()
+        self.stdout.write(f"backend={stats['backend']} hits={stats['hits']} misses={stats['misses']} hit_rate={stats['hit_rate']:.1%}")
+
+        if options['reset']:
+            reset_cache_stats()
+            self.stdout.write(self.style.SUCCESS("Counters reset."))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from generator.quest_tree_service import generate_quest_tree
+from generator.tasks import generate_quest_tree_task
+
+
+class Command(BaseCommand):
+    help = 'Pre-generate the decision tree of quests breadth-first, resuming from the questions already generated'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--quest', type=int, action='append', required=True, help='Quest id, can be repeated')
+        parser.add_argument('--max-nodes', type=int, help='Questions generated per quest at most (QUEST_TREE_MAX_NODES by default)')
+        parser.add_argument('--concurrency', type=int, help='Questions generated at the same time (QUEST_TREE_CONCURRENCY by default)')
+        parser.add_argument('--options', type=int, default=2, help='Number of options per question')
+        parser.add_argument('--async', action='store_true', dest='run_async', help='Enqueue a celery task per quest instead of generating here')
+
+    def handle(self, *args, **options):
+        for quest_id in options['quest']:
+            if options['run_async']:
+                generate_quest_tree_task.delay(quest_id, options['max_nodes'], options['concurrency'], options['options'])
+                self.stdout.write(f"Enqueued the tree of quest {quest_id}.")
+                continue
+
+            result = generate_quest_tree(quest_id, options['max_nodes'], options['concurrency'], options['options'])
+            self.stdout.write(self.style.SUCCESS(
+                f"Quest {quest_id}: {result['generated']} questions generated, {result['failed']} failed, "
+                f"{'complete' if result['complete'] else 'incomplete'}."
+            ))
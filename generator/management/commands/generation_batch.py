@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from generator.batch_service import poll_generation_batches, submit_question_batch, submit_reward_batch, submit_trivia_batch
+
+
+class Command(BaseCommand):
+    help = 'Submit generation prompts as a claude message batch, or store the results of the batches which have ended'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=['questions', 'rewards', 'trivia', 'poll'])
+        parser.add_argument('--quest', type=int, action='append', default=[], help='Quest id, can be repeated (questions, rewards)')
+        parser.add_argument('--tree', action='store_true', help='Keep submitting the next level until the quest trees are complete (questions)')
+        parser.add_argument('--options', type=int, default=2, help='Number of options per question (questions)')
+        parser.add_argument('--prompt', action='append', default=[], help='Trivia topic, can be repeated (trivia)')
+        parser.add_argument('--questions', type=int, default=10, help='Number of questions per trivia (trivia)')
+
+    def handle(self, *args, **options):
+        kind = options['kind']
+        if kind == 'poll':
+            self.stdout.write(self.style.SUCCESS(f"Processed {poll_generation_batches()} batches."))
+            return
+
+        if kind in ('questions', 'rewards') and not options['quest']:
+            raise CommandError('--quest is required')
+        if kind == 'trivia' and not options['prompt']:
+            raise CommandError('--prompt is required')
+
+        if kind == 'questions':
+            batch = submit_question_batch(options['quest'], options['options'], continue_tree=options['tree'])
+        elif kind == 'rewards':
+            batch = submit_reward_batch(options['quest'])
+        else:
+            batch = submit_trivia_batch(options['prompt'], options['questions'])
+
+        if batch is None:
+            self.stdout.write("Nothing to generate.")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Submitted batch {batch.provider_batch_id} with {len(batch.requests)} requests."))
@@ -0,0 +1,78 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from generator.models import Option
+from generator.quest_service import generate_quest_assets
+from generator.service import generate_question, generate_quest, generate_trivia, generate_universe
+from generator.telemetry_service import get_percentile
+
+
+class Command(BaseCommand):
+    help = 'Measure the throughput of the generation pipeline against the fake providers (GENERATION_PROVIDER_BACKEND=fake)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=4, help='Universes generated, each with a quest, its questions and assets')
+        parser.add_argument('--workers', type=int, default=2, help='Runs generated at the same time')
+        parser.add_argument('--questions', type=int, default=3, help='Questions generated along one path of each quest')
+        parser.add_argument('--no-assets', action='store_true', help='Skip the quest assets and the trivia')
+
+    def handle(self, *args, **options):
+        if settings.GENERATION_PROVIDER_BACKEND != 'fake':
+            raise CommandError('The benchmark calls the providers for every run, set GENERATION_PROVIDER_BACKEND=fake')
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            results = list(executor.map(lambda i: self.run(i, options), range(options['runs'])))
+        elapsed = time.monotonic() - started
+
+        stages = {}
+        failed = 0
+        for timings in results:
+            if timings is None:
+                failed += 1
+                continue
+            for stage, seconds in timings:
+                stages.setdefault(stage, []).append(seconds)
+
+        for stage, seconds in stages.items():
+            seconds = sorted(seconds)
+            self.stdout.write(f"{stage:<12} count={len(seconds):<4} p50={get_percentile(seconds, 50):.2f}s p95={get_percentile(seconds, 95):.2f}s")
+        self.stdout.write(self.style.SUCCESS(
+            f"{options['runs'] - failed} runs in {elapsed:.1f}s ({(options['runs'] - failed) / elapsed * 60:.1f} runs/min), {failed} failed."
+        ))
+
+    def run(self, i, options):
+        '''
+        generates one universe and what is built on it, returns the [(stage, seconds)] of the run
+        '''
+        timings = []
+
+        def measure(stage, function, *args):
+            started = time.monotonic()
+            result = function(*args)
+            timings.append((stage, time.monotonic() - started))
+            return result
+
+        try:
+            universe_id = measure('universe', lambda: [event for event in generate_universe(f"Benchmark universe {i}")][-1]['universe_id'])
+            quest_id = measure('quest', generate_quest, universe_id, None, options['questions'])
+
+            prev_option_id = None
+            for _ in range(options['questions']):
+                question_id = measure('question', generate_question, quest_id, prev_option_id)
+                if question_id is None:
+                    break
+                prev_option_id = Option.objects.filter(question_id=question_id).values_list('id', flat=True).first()
+
+            if not options['no_assets']:
+                measure('quest_assets', lambda: list(generate_quest_assets(quest_id)))
+                measure('trivia', generate_trivia, f"Benchmark trivia {i}", 5)
+            return timings
+        except Exception as e:
+            self.stderr.write(f"Run {i} failed: {e!r}")
+            return None
+        finally:
+            connection.close()
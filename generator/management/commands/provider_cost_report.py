@@ -0,0 +1,33 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from generator.telemetry_service import get_cost_report
+
+
+class Command(BaseCommand):
+    help = 'Report the latency (p50/p95) and estimated cost of the provider calls per entity'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entity-type', help='universe, quest, trivia or user')
+        parser.add_argument('--entity-id', type=int)
+        parser.add_argument('--days', type=int, default=7, help='Report the calls of the last days')
+        parser.add_argument('--limit', type=int, default=20, help='Number of entities shown, the costliest first')
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(days=options['days'])
+        report = get_cost_report(since, options['entity_type'], options['entity_id'])
+        if not report:
+            self.stdout.write("No provider calls.")
+            return
+
+        self.stdout.write(f"{'entity':<20} {'calls':>6} {'failed':>6} {'p50_ms':>8} {'p95_ms':>8} {'in_tokens':>10} {'out_tokens':>10} {'cached':>10} {'cost_usd':>10}")
+        for row in report[:options['limit']]:
+            entity = f"{row['entity_type'] or '-'}:{row['entity_id'] or '-'}"
+            self.stdout.write(
+                f"{entity:<20} {row['calls']:>6} {row['failed']:>6} {row['p50_ms']:>8} {row['p95_ms']:>8} "
+                f"{row['input_tokens']:>10} {row['output_tokens']:>10} {row['cache_read_tokens']:>10} {row['cost']:>10.4f}"
+            )
+
+        total = sum(row['cost'] for row in report)
+        self.stdout.write(self.style.SUCCESS(f"{sum(row['calls'] for row in report)} calls of {len(report)} entities, ${total:.4f} in total."))
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.1 on 2026-10-18 14:48
+
+from django.db import migrations, models
+
+
+def backfill_question_depth_and_path(apps, schema_editor):
+    '''
+    parents are always created before their children, so walking the questions
+    in id order guarantees the parent's path is known when the child is reached
+    '''
+    Question = apps.get_model('generator', 'Question')
+    Option = apps.get_model('generator', 'Option')
+
+    question_of_option = dict(Option._base_manager.values_list('id', 'question_id'))
+    depth_and_path = {}
+    questions = []
+
+    for question in Question._base_manager.order_by('id').only('id', 'parent_option_id'):
+        parent_question_id = question_of_option.get(question.parent_option_id)
+
+        if parent_question_id in depth_and_path:
+            parent_depth, parent_path = depth_and_path[parent_question_id]
+            question.depth = parent_depth + 1
+            question.path = f"{parent_path}{parent_question_id}/"
+        else:
+            question.depth = 0
+            question.path = ''
+
+        depth_and_path[question.id] = (question.depth, question.path)
+        questions.append(question)
+
+    Question._base_manager.bulk_update(questions, ['depth', 'path'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('generator', '0032_merge_0028_shortvideos_raw_url_0031_alter_news_slug'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='depth',
+            field=models.IntegerField(default=0, help_text='Number of questions above this question in its path. 0 for the first question of the quest.'),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, default='', help_text='Ids of the ancestor questions from the first question, each followed by a slash. e.g. "12/45/"', max_length=1000),
+        ),
+        migrations.RunPython(backfill_question_depth_and_path, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.1 on 2026-10-18 15:11
+
+from django.db import migrations, models
+import utils.helpers
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('generator', '0033_question_depth_question_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenerationBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('deleted_at', models.DateTimeField(blank=True, null=True)),
+                ('kind', models.CharField(choices=[('QUESTION', 'Question'), ('REWARD', 'Reward'), ('TRIVIA', 'Trivia')], max_length=20)),
+                ('provider_batch_id', models.CharField(max_length=255, unique=True)),
+                ('status', models.CharField(choices=[('IN_PROGRESS', 'In progress'), ('PROCESSED', 'Processed'), ('FAILED', 'Failed')], db_index=True, default='IN_PROGRESS', max_length=20)),
+                ('requests', models.JSONField(default=dict, help_text='Target of the result of each request, by custom id')),
+                ('succeeded_count', models.IntegerField(default=0)),
+                ('failed_count', models.IntegerField(default=0)),
+                ('continue_tree', models.BooleanField(default=False, help_text='Question batches: submit the next level of the quest trees once processed')),
+            ],
+            options={
+                'abstract': False,
+            },
+            managers=[
+                ('objects', utils.helpers.BaseManager()),
+            ],
+        ),
+    ]
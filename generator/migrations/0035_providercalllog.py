@@ -0,0 +1,41 @@
+# Generated by Django 4.2.1 on 2026-10-18 15:13
+
+from django.db import migrations, models
+import utils.helpers
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('generator', '0034_generationbatch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProviderCallLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('deleted_at', models.DateTimeField(blank=True, null=True)),
+                ('provider', models.CharField(max_length=50)),
+                ('model', models.CharField(blank=True, default='', max_length=100)),
+                ('operation', models.CharField(max_length=50)),
+                ('entity_type', models.CharField(blank=True, help_text='What the call was generating: universe, quest, trivia, user', max_length=50, null=True)),
+                ('entity_id', models.BigIntegerField(blank=True, null=True)),
+                ('latency_ms', models.IntegerField()),
+                ('attempts', models.IntegerField(default=1)),
+                ('input_tokens', models.IntegerField(default=0)),
+                ('output_tokens', models.IntegerField(default=0)),
+                ('units', models.IntegerField(default=0, help_text='Images generated or characters converted to audio')),
+                ('cost', models.DecimalField(decimal_places=6, default=0, help_text='Estimated from list prices, in USD', max_digits=12)),
+                ('success', models.BooleanField(default=True)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['entity_type', 'entity_id'], name='generator_p_entity__a99b8a_idx')],
+            },
+            managers=[
+                ('objects', utils.helpers.BaseManager()),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.1 on 2026-10-18 15:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('generator', '0035_providercalllog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='providercalllog',
+            name='cache_read_tokens',
+            field=models.IntegerField(default=0, help_text='Input tokens read from the prompt cache of the provider'),
+        ),
+        migrations.AddField(
+            model_name='providercalllog',
+            name='cache_write_tokens',
+            field=models.IntegerField(default=0, help_text='Input tokens written to the prompt cache of the provider'),
+        ),
+    ]
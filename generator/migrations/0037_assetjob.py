@@ -0,0 +1,54 @@
+# Generated by Django 4.2.1 on 2026-10-18 15:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+import utils.helpers
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('generator', '0036_providercalllog_cache_tokens'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AssetJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('deleted_at', models.DateTimeField(blank=True, null=True)),
+                ('entity_type', models.CharField(choices=[('UNIVERSE', 'Universe'), ('QUEST', 'Quest')], max_length=20)),
+                ('entity_id', models.BigIntegerField()),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('RUNNING', 'Running'), ('SUCCEEDED', 'Succeeded'), ('FAILED', 'Failed')], db_index=True, default='PENDING', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            managers=[
+                ('objects', utils.helpers.BaseManager()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AssetJobStep',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('deleted_at', models.DateTimeField(blank=True, null=True)),
+                ('name', models.CharField(max_length=50)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('RUNNING', 'Running'), ('SUCCEEDED', 'Succeeded'), ('FAILED', 'Failed')], default='PENDING', max_length=20)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='steps', to='generator.assetjob')),
+            ],
+            managers=[
+                ('objects', utils.helpers.BaseManager()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='assetjob',
+            index=models.Index(fields=['entity_type', 'entity_id'], name='generator_a_entity__db345f_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='assetjobstep',
+            unique_together={('job', 'name')},
+        ),
+    ]
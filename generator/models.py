@@ -44,10 +44,18 @@ class Question(BaseModelMixin):
     question_text       = models.TextField()
     parent_option       = models.ForeignKey('Option', on_delete=models.SET_NULL, null=True, related_name='child_questions')
     question_number     = models.IntegerField(default=1)
+    depth               = models.IntegerField(default=0, help_text='Number of questions above this question in its path. 0 for the first question of the quest.')
+    path                = models.CharField(max_length=1000, default='', blank=True, db_index=True, help_text='Ids of the ancestor questions from the first question, each followed by a slash. e.g. "12/45/"')
     characters          = models.JSONField(default=list)
     audio_file_path     = models.CharField(max_length=500, null=True, blank=True)
     image_file_path     = models.CharField(max_length=500, null=True, blank=True)
 
+    def get_ancestor_ids(self):
+        return [int(question_id) for question_id in self.path.split('/') if question_id]
+
+    def get_child_path(self):
+        return f"{self.path}{self.id}/"
+
 
 class Option(BaseModelMixin):
     question            = models.ForeignKey(Question, on_delete=models.CASCADE, related_name='options')
@@ -292,4 +300,101 @@ class News(BaseModelMixin):
             slug = f"{base_slug[:42]}-{get_random_string(8)}"
             self.slug = slug
         
-        super().save(*args, **kwargs)
\ No newline at end of file
+        super().save(*args, **kwargs)
+
+
+class GenerationBatch(BaseModelMixin):
+    '''
+    Prompts sent to the provider as one message batch (generator/batch_service.py). The results
+    are stored once the provider has processed the batch.
+    '''
+    class BatchKinds(models.TextChoices):
+        QUESTION    = 'QUESTION', 'Question'
+        REWARD      = 'REWARD', 'Reward'
+        TRIVIA      = 'TRIVIA', 'Trivia'
+
+    class BatchStatuses(models.TextChoices):
+        IN_PROGRESS = 'IN_PROGRESS', 'In progress'
+        PROCESSED   = 'PROCESSED', 'Processed'
+        FAILED      = 'FAILED', 'Failed'
+
+    kind                = models.CharField(max_length=20, choices=BatchKinds.choices)
+    provider_batch_id   = models.CharField(max_length=255, unique=True)
+    status              = models.CharField(max_length=20, choices=BatchStatuses.choices, default=BatchStatuses.IN_PROGRESS, db_index=True)
+    requests            = models.JSONField(default=dict, help_text='Target of the result of each request, by custom id')
+    succeeded_count     = models.IntegerField(default=0)
+    failed_count        = models.IntegerField(default=0)
+    continue_tree       = models.BooleanField(default=False, help_text='Question batches: submit the next level of the quest trees once processed')
+
+    def __str__(self):
+        return f"{self.kind} {self.provider_batch_id}"
+
+
+class ProviderCallLog(BaseModelMixin):
+    '''
+    One call to a generation provider (generator/telemetry_service.py). Rows are only appended.
+    '''
+    provider            = models.CharField(max_length=50)
+    model               = models.CharField(max_length=100, blank=True, default='')
+    operation           = models.CharField(max_length=50)
+    entity_type         = models.CharField(max_length=50, null=True, blank=True, help_text='What the call was generating: universe, quest, trivia, user')
+    entity_id           = models.BigIntegerField(null=True, blank=True)
+    latency_ms          = models.IntegerField()
+    attempts            = models.IntegerField(default=1)
+    input_tokens        = models.IntegerField(default=0)
+    output_tokens       = models.IntegerField(default=0)
+    cache_read_tokens   = models.IntegerField(default=0, help_text='Input tokens read from the prompt cache of the provider')
+    cache_write_tokens  = models.IntegerField(default=0, help_text='Input tokens written to the prompt cache of the provider')
+    units               = models.IntegerField(default=0, help_text='Images generated or characters converted to audio')
+    cost                = models.DecimalField(max_digits=12, decimal_places=6, default=0, help_text='Estimated from list prices, in USD')
+    success             = models.BooleanField(default=True)
+    error               = models.TextField(null=True, blank=True)
+    created_at          = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['entity_type', 'entity_id'])]
+
+
+class AssetJob(BaseModelMixin):
+    '''
+    Asset generation of a universe or a quest, run as a DAG of celery tasks (generator/asset_job_service.py).
+    '''
+    class EntityTypes(models.TextChoices):
+        UNIVERSE    = 'UNIVERSE', 'Universe'
+        QUEST       = 'QUEST', 'Quest'
+
+    class JobStatuses(models.TextChoices):
+        PENDING     = 'PENDING', 'Pending'
+        RUNNING     = 'RUNNING', 'Running'
+        SUCCEEDED   = 'SUCCEEDED', 'Succeeded'
+        FAILED      = 'FAILED', 'Failed'
+
+    entity_type         = models.CharField(max_length=20, choices=EntityTypes.choices)
+    entity_id           = models.BigIntegerField()
+    status              = models.CharField(max_length=20, choices=JobStatuses.choices, default=JobStatuses.PENDING, db_index=True)
+    created_at          = models.DateTimeField(auto_now_add=True)
+    finished_at         = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['entity_type', 'entity_id'])]
+
+    def __str__(self):
+        return f"{self.entity_type} {self.entity_id} assets"
+
+
+class AssetJobStep(BaseModelMixin):
+    '''
+    One task of an AssetJob, e.g. the thumbnail or the score category icons of a quest.
+    '''
+    job                 = models.ForeignKey(AssetJob, on_delete=models.CASCADE, related_name='steps')
+    name                = models.CharField(max_length=50)
+    status              = models.CharField(max_length=20, choices=AssetJob.JobStatuses.choices, default=AssetJob.JobStatuses.PENDING)
+    error               = models.TextField(null=True, blank=True)
+    started_at          = models.DateTimeField(null=True, blank=True)
+    finished_at         = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('job', 'name')
+
+    def __str__(self):
+        return f"{self.job} {self.name}"
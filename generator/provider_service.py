@@ -0,0 +1,280 @@
+'''
+Asynchronous clients of the asset providers (openai images and speech, elevenlabs). Claude is
+called synchronously by generator/service.py, through the response cache.
+
+The clients live on one event loop per process, run by a background thread, so their connection
+pools are reused by every call instead of a new client being created per request. Calls to a
+provider are limited by a semaphore of PROVIDER_CONCURRENCY[provider] slots.
+
+Synchronous code (views, admin, celery tasks) hands coroutines to the loop with run_async, and
+fans out many calls with run_all, e.g. the 30 reward images of a quest are generated together
+instead of one after another. The ORM is not used on the loop: callers read the rows, run the
+provider calls and save the results.
+'''
+import asyncio
+import contextvars
+import os
+import threading
+
+import httpx
+from django.conf import settings
+from elevenlabs.client import AsyncElevenLabs
+from openai import AsyncOpenAI
+from structlog import get_logger
+
+from utils.rate_limiter import acquire_async
+from utils.resilience import call_async, get_timeout
+from . import fake_provider_service
+from .service import IMAGE_TIMEOUT, MODEL, get_safe_image_prompt, upload_image_from_url
+from .telemetry_service import track_call_async
+
+logger = get_logger()
+
+_loop       = None
+_loop_pid   = None
+_loop_lock  = threading.Lock()
+_clients    = {}
+_semaphores = {}
+
+
+def get_loop():
+    '''
+    returns the event loop of the process, started on first use.
+    celery forks its workers after the app is loaded, so a forked process starts its own loop
+    '''
+    global _loop, _loop_pid
+    with _loop_lock:
+        if _loop is None or _loop_pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            _loop_pid = os.getpid()
+            _clients.clear()
+            _semaphores.clear()
+            threading.Thread(target=_loop.run_forever, name='provider-loop', daemon=True).start()
+    return _loop
+
+
+def run_async(coroutine):
+    '''
+    runs the coroutine on the shared loop and returns its result
+    '''
+    loop = get_loop()
+    try:
+        running_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        running_loop = None
+    if running_loop is loop:
+        coroutine.close()
+        raise RuntimeError("run_async can't be called from the provider loop, await the coroutine instead")
+    return asyncio.run_coroutine_threadsafe(propagate_context(coroutine), loop).result()
+
+
+def propagate_context(coroutine):
+    '''
+    returns a coroutine which runs coroutine with the context variables of the caller (the deadline,
+    the entity of the calls). Needed as the loop's tasks don't get the context of the calling thread
+    '''
+    context = contextvars.copy_context()
+
+    async def run():
+        for var, value in context.items():
+            var.set(value)
+        return await coroutine
+    return run()
+
+
+def run_all(coroutines):
+    '''
+    runs the coroutines concurrently on the shared loop.
+    returns their results in order, None for the ones which failed
+    '''
+    return run_async(gather(coroutines))
+
+
+def submit(coroutine):
+    '''
+    starts the coroutine on the shared loop without waiting for it, returns its future
+    '''
+    return asyncio.run_coroutine_threadsafe(propagate_context(coroutine), get_loop())
+
+
+def wait_all(futures):
+    '''
+    waits for the submitted futures, returns their results in order, None for the ones which failed
+    '''
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            logger.error("Provider call failed", er=e)
+            results.append(None)
+    return results
+
+
+async def gather(coroutines):
+    results = await asyncio.gather(*coroutines, return_exceptions=True)
+    for i, result in enumerate(results):
+        if isinstance(result, BaseException):
+            logger.error("Provider call failed", er=result, index=i)
+            results[i] = None
+    return results
+
+
+def get_client(provider):
+    '''
+    returns the pooled client of the provider, created on the loop of the process
+    '''
+    if fake_provider_service.is_enabled():
+        if f"fake:{provider}" not in _clients:
+            _clients[f"fake:{provider}"] = fake_provider_service.ASYNC_CLIENTS[provider]()
+        return _clients[f"fake:{provider}"]
+
+    if provider not in _clients:
+        if provider == 'openai':
+            _clients[provider] = AsyncOpenAI(api_key=settings.OPEN_AI_API_KEY)
+        elif provider == 'elevenlabs':
+            _clients[provider] = AsyncElevenLabs(api_key=settings.ELEVEN_LABS_API_KEY)
+        elif provider == 'http':
+            _clients[provider] = httpx.AsyncClient(timeout=60, follow_redirects=True)
+        else:
+            raise ValueError(f"Unknown provider {provider}")
+    return _clients[provider]
+
+
+def limit(provider):
+    '''
+    returns the semaphore limiting the concurrent calls to the provider
+    '''
+    size = settings.PROVIDER_CONCURRENCY[provider]
+    if (provider, size) not in _semaphores:
+        _semaphores[(provider, size)] = asyncio.Semaphore(size)
+    return _semaphores[(provider, size)]
+
+
+async def create_image(prompt):
+    await acquire_async('openai', MODEL['image_model'])
+    async with limit('openai'):
+        return await get_client('openai').images.generate(
+            model=MODEL['image_model'],
+            prompt=prompt,
+            size="1024x1024",
+            quality="standard",
+            n=1,
+            timeout=get_timeout(IMAGE_TIMEOUT),
+        )
+
+
+async def generate_image_async(prompt):
+    '''
+    returns the url of the dall-e image generated for the prompt, None if it failed
+    '''
+    try:
+        async with track_call_async('openai', MODEL['image_model'], 'image') as record:
+            response = await call_async('openai', create_image, get_safe_image_prompt(prompt))
+            record.units = 1
+    except Exception as e:
+        logger.error('Something went wrong while generating image from dalle', e=e)
+        return None
+    return response.data[0].url
+
+
+async def generate_and_upload_image(prompt, output_path):
+    '''
+    generates the image and uploads it to s3. returns the s3 url, None if the generation failed
+    '''
+    image_url = await generate_image_async(prompt)
+    if not image_url:
+        return None
+    return await asyncio.to_thread(upload_image_from_url, image_url, output_path)
+
+
+def generate_and_upload_images(jobs):
+    '''
+    generates and uploads the images of [(prompt, output_path)] concurrently.
+    returns their s3 urls in order, None for the failed ones
+    '''
+    return run_all([generate_and_upload_image(prompt, output_path) for prompt, output_path in jobs])
+
+
+async def generate_speech_openai(text):
+    '''
+    returns the mp3 bytes of the openai speech of the text
+    '''
+    async with track_call_async('openai', 'tts-1', 'speech') as record:
+        audio = await call_async('openai', create_speech_openai, text)
+        record.units = len(text)
+    return audio
+
+
+async def create_speech_openai(text):
+    await acquire_async('openai', 'tts-1')
+    async with limit('openai'):
+        response = await get_client('openai').audio.speech.create(
+            input=text,
+            model='tts-1',
+            response_format='mp3',
+            voice='shimmer',
+            speed=1.0
+        )
+        return response.content
+
+
+async def generate_sound_effect(text, duration_seconds, prompt_influence):
+    '''
+    returns the mp3 bytes of the elevenlabs sound effect of the text
+    '''
+    async with track_call_async('elevenlabs', 'sound-generation', 'sound_effect') as record:
+        audio = await call_async('elevenlabs', create_sound_effect, text, duration_seconds, prompt_influence)
+        record.units = 1
+    return audio
+
+
+async def create_sound_effect(text, duration_seconds, prompt_influence):
+    await acquire_async('elevenlabs', 'sound-generation')
+    async with limit('elevenlabs'):
+        chunks = [chunk async for chunk in get_client('elevenlabs').text_to_sound_effects.convert(
+            text=text,
+            duration_seconds=duration_seconds,
+            prompt_influence=prompt_influence,
+        )]
+    return b''.join(chunks)
+
+
+async def generate_speech_elevenlabs(text, voice, model=None, operation='speech'):
+    '''
+    returns the mp3 bytes of the elevenlabs speech of the text, in the default model of the client
+    unless model is given
+    '''
+    async with track_call_async('elevenlabs', 'eleven_multilingual_v2', operation) as record:
+        audio = await call_async('elevenlabs', create_elevenlabs_speech, text, voice, model)
+        record.units = len(text)
+    return audio
+
+
+async def create_elevenlabs_speech(text, voice, model):
+    await acquire_async('elevenlabs', 'eleven_multilingual_v2')
+    async with limit('elevenlabs'):
+        options = {'model': model} if model else {}
+        audio = await get_client('elevenlabs').generate(text=text, voice=voice, **options)
+        chunks = [chunk async for chunk in audio]
+    return b''.join(chunks)
+
+
+async def clone_elevenlabs_voice(name, files, description):
+    '''
+    returns the elevenlabs voice cloned from the files. Not retried, a retry could clone the voice twice
+    '''
+    async with track_call_async('elevenlabs', 'voice-clone', 'voice_clone'):
+        await acquire_async('elevenlabs', 'voice-clone')
+        async with limit('elevenlabs'):
+            return await get_client('elevenlabs').clone(name=name, files=files, description=description, labels=None)
+
+
+async def download(url):
+    '''
+    returns the content at the url
+    '''
+    async with limit('http'):
+        response = await get_client('http').get(url)
+    response.raise_for_status()
+    return response.content
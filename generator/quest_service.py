@@ -1,4 +1,6 @@
 from .service import *
+from .provider_service import generate_and_upload_image, generate_and_upload_images, generate_sound_effect, run_async, submit, wait_all
+from utils.streaming_json import iter_array_items
 
 
 def generate_quest_thumbnail_image(quest_id):
@@ -26,7 +28,8 @@ def generate_quest_thumbnail_image(quest_id):
     image_url = upload_image_from_url(image_url, f"universe/{quest.universe.id}/quest/{quest.id}")
 
     quest.thumbnail = image_url
-    quest.save()
+    # the assets of a quest are generated in parallel, each task saves only its own field
+    quest.save(update_fields=['thumbnail'])
     return image_url
 
 
@@ -42,13 +45,17 @@ def generate_icons_for_score_categories(quest_id):
     '''
     generates icons for the score categories for the given quest
     '''
-    score_categories = ScoreCategory.objects.filter(quest_id=quest_id)
-    for category in score_categories:
-        if category.icon:
-            continue
-        prompt = get_prompt_for_score_category_icon_image(category.name, category.quest.quest_name, category.description)
-        image_url = generate_image(prompt=prompt)
-        image_url = upload_image_from_url(image_url, f"universe/{category.quest.universe.id}/quest/{category.quest.id}/score_category/{category.id}")
+    score_categories = [c for c in ScoreCategory.objects.filter(quest_id=quest_id).select_related('quest') if not c.icon]
+
+    # the icons are generated concurrently
+    image_urls = generate_and_upload_images([
+        (
+            get_prompt_for_score_category_icon_image(category.name, category.quest.quest_name, category.description),
+            f"universe/{category.quest.universe_id}/quest/{category.quest.id}/score_category/{category.id}"
+        )
+        for category in score_categories
+    ])
+    for category, image_url in zip(score_categories, image_urls):
         category.icon = image_url
         category.save()
 
@@ -62,6 +69,7 @@ def generate_image_for_character_in_quest(quest_id):
 
     universe_main_characters = get_main_characters_migrated(universe_id=universe.id)
 
+    jobs = []
     for i in range(len(main_characters)):
         # if image is already present, skip
         if main_characters[i].get('image'):
@@ -76,7 +84,7 @@ def generate_image_for_character_in_quest(quest_id):
             }
             continue
 
-        image_url = generate_image(
+        jobs.append((i, (
             f''' Generate an image for the character {main_characters[i]['name']} whose role is {main_characters[i]['role']} in the quest {quest.quest_name} in the universe {quest.universe.universe_name}.
             The description of the character is as follows: {main_characters[i]['description']}
             The image description is as follows: {main_characters[i]['image_description']}
@@ -84,16 +92,20 @@ def generate_image_for_character_in_quest(quest_id):
             The quest description is as follows: {quest.description}
             The universe description is as follows: {quest.universe.description}
             Do not add any text to the image. The image should be visually appealing and should represent the character.
-        ''')
-        image_url = upload_image_from_url(image_url, f"universe/{quest.universe.id}/quest/{quest.id}/character/{i}")
+        ''',
+            f"universe/{quest.universe.id}/quest/{quest.id}/character/{i}"
+        )))
 
+    # the character images are generated concurrently
+    image_urls = generate_and_upload_images([job for _, job in jobs])
+    for (i, _), image_url in zip(jobs, image_urls):
         main_characters[i] = {
             **main_characters[i],
             'image': image_url
         }
 
     quest.main_characters = json.dumps(main_characters)
-    quest.save()
+    quest.save(update_fields=['main_characters'])
 
 
 
@@ -122,15 +134,18 @@ def generate_quest_assets(quest_id):
     generates images/audio/video for quest
     '''
     # rewards
-    generate_rewards_for_quest(quest_id) 
+    with tag_entity('quest', quest_id):
+        generate_rewards_for_quest(quest_id) 
 
     # images
     yield {'status': 'Generating quest images'}
-    generate_quest_images(quest_id)
+    with tag_entity('quest', quest_id):
+        generate_quest_images(quest_id)
 
     # audio
     yield {'status': 'Generating quest audios'}
-    generate_quest_audio(quest_id)
+    with tag_entity('quest', quest_id):
+        generate_quest_audio(quest_id)
 
     yield {'status': 'Asset generation completed'}
 
@@ -163,14 +178,11 @@ def generate_quest_audio(quest_id):
 
     # audio_url = "https://qverse-universe-test.s3.ap-south-1.amazonaws.com/test/d09f6ddf-85d2-4a83-ab63-05c306a5043c.mp3"
 
-    client = ElevenLabs(
-        api_key=ELEVEN_LABS_API_KEY, # Defaults to ELEVEN_API_KEY
-    )
-    result = client.text_to_sound_effects.convert(
+    result = run_async(generate_sound_effect(
         text=prompt,
         duration_seconds=10,
         prompt_influence=0.7,  # Optional, if not provided will use the default value of 0.3
-    )
+    ))
 
     # save the audio in a temp file with uuid as name
     audio_path = f"tmp/audio/{str(uuid.uuid4())}.mp3"
@@ -178,26 +190,18 @@ def generate_quest_audio(quest_id):
     # check if the directory exists else create it
     os.makedirs(os.path.dirname(audio_path), exist_ok=True)
 
-    save(result, audio_path)
+    with open(audio_path, 'wb') as f:
+        f.write(result)
 
     # upload the audio to s3
     audio_url = upload_audio_from_input_path(audio_path, f"universe/{quest.universe.id}/quest/{quest.id}")
     quest.audio_url = audio_url
-    quest.save()
+    quest.save(update_fields=['audio_url'])
 
     return audio_url
 
 
-def generate_rewards_for_quest(quest_id):
-    '''
-    generates rewards for the quest
-    '''
-    quest = get_object_or_404(Quest, pk=quest_id)
-    # check if quest rewards are generated
-    rewards = QuestRewardCollection.objects.filter(quest_id=quest_id)
-    if len(rewards)>0:
-        return
-    
+def get_rewards_prompt(quest):
     prompt = f"""
     Generate rewards for the quest: "{quest.quest_name}" in the universe: "{quest.universe.universe_name}".
     A reward are rare collectibles to be given to the user. provide name and description for the collectibles.
@@ -214,26 +218,39 @@ def generate_rewards_for_quest(quest_id):
     ]
     }}
     """
+    return prompt
+
+
+def generate_rewards_for_quest(quest_id):
+    '''
+    generates rewards for the quest
+    '''
+    quest = get_object_or_404(Quest, pk=quest_id)
+    # check if quest rewards are generated
+    rewards = QuestRewardCollection.objects.filter(quest_id=quest_id)
+    if len(rewards)>0:
+        return
+    
+    prompt = get_rewards_prompt(quest)
 
-    response = query_claude(prompt)
+    # every reward is stored and its image generation started as soon as claude has written it
+    image_jobs = []
     try:
-        data = json.loads(response)
-    except json.JSONDecodeError as e:
-        try:
-            json.loads(response.replace('""', '"'))
-        except json.JSONDecodeError as e:
-            logger.error("Failed to decode response from claude", response=response, er=e)
-            raise
-
-    rewards = data['collectible_rewards']
-
-    # store it in QuestRewardCollection 
-    for reward in rewards:
-        r = QuestRewardCollection.objects.create(
-            quest=quest,
-            name=reward['name'],
-            description=reward['description']
-        )
+        for reward in iter_array_items(stream_claude(prompt), 'collectible_rewards'):
+            r = QuestRewardCollection.objects.create(
+                quest=quest,
+                name=reward['name'],
+                description=reward['description']
+            )
+            image_jobs.append((r, submit(generate_and_upload_image(*get_quest_reward_image_job(r)))))
+    except Exception as e:
+        # a quest with part of the rewards would never get the rest
+        logger.error("Failed to generate rewards for quest", quest_id=quest_id, er=e)
+        QuestRewardCollection.objects.filter(id__in=[r.id for r, _ in image_jobs]).delete()
+        raise
+
+    for (r, _), image_url in zip(image_jobs, wait_all([job for _, job in image_jobs])):
+        r.image_path = image_url
         r.save()
 
 
@@ -241,26 +258,41 @@ def generate_all_images_for_quest_rewards(quest_id):
     '''
     generates images for all the quest rewards
     '''
-    rewards = QuestRewardCollection.objects.filter(quest_id=quest_id)
-    for reward in rewards:
-        generate_image_for_quest_reward(reward.id)
+    rewards = [
+        r for r in QuestRewardCollection.objects.filter(quest_id=quest_id).select_related('quest__universe')
+        if not r.image_path
+    ]
 
+    # the reward images are generated concurrently
+    image_urls = generate_and_upload_images([get_quest_reward_image_job(reward) for reward in rewards])
+    for reward, image_url in zip(rewards, image_urls):
+        reward.image_path = image_url
+        reward.save()
 
-def generate_image_for_quest_reward(collectible_id):
-
-    collectible = QuestRewardCollection.objects.get(pk=collectible_id)
-    # if image is already present, return the url
-    if collectible.image_path:
-        return collectible.image_path
 
+def get_quest_reward_image_job(collectible):
+    '''
+    returns (prompt, output_path) of the image of the quest reward
+    '''
     prompt = f"""
     Create an image for the collectible: "{collectible.name}".
     The collectible is associated with the quest: "{collectible.quest.quest_name}" in the universe: "{collectible.quest.universe.universe_name}".
     The description of the collectible is as follows: {collectible.description}.
     The image should be visually appealing and should represent the collectible.
     """
+    return prompt, f"universe/{collectible.quest.universe.id}/quest/{collectible.quest.id}/collectible/{collectible.id}"
+
+
+def generate_image_for_quest_reward(collectible_id):
+
+    collectible = QuestRewardCollection.objects.get(pk=collectible_id)
+    # if image is already present, return the url
+    if collectible.image_path:
+        return collectible.image_path
+
+    prompt, output_path = get_quest_reward_image_job(collectible)
     image_url = generate_image(prompt)
-    image_url = upload_image_from_url(image_url, f"universe/{collectible.quest.universe.id}/quest/{collectible.quest.id}/collectible/{collectible.id}")
+    image_url = upload_image_from_url(image_url, output_path)
     collectible.image_path = image_url
     collectible.save()
     return image_url
@@ -317,27 +349,22 @@ def generate_background_images(quest_id, num_of_images=20):
     }}
     '''
 
-    response = query_claude(prompt)
-    try:
-        data = json.loads(response)
-    except json.JSONDecodeError as e:
-        try:
-            json.loads(response.replace('""', '"'))
-        except json.JSONDecodeError as e:
-            logger.error("Failed to decode response from claude", response=response, er=e)
-            raise
-
-    image_descriptions = data['image_descriptions']
-
-    for i in image_descriptions:
-        # generate image for the description
+    main_characters = ', '.join([f"{c['name']} ({c['role']})" for c in json.loads(quest.main_characters)])
+    story_outline = ', '.join(json.loads(quest.story_outline))
+
+    # the image of every description is generated as soon as claude has written the description
+    image_jobs = []
+    for i in iter_array_items(stream_claude(prompt), 'image_descriptions'):
         image_prompt = f'''
-        Generate an image to be used in a game of the quest "{quest.quest_name}" in the universe "{quest.universe.universe_name}". The quest description is as follows: {quest.description}. The quest involves the following main characters: {', '.join([f"{c['name']} ({c['role']})" for c in json.loads(quest.main_characters)])}. The story outline for this quest is as follows: {', '.join(json.loads(quest.story_outline))}.
+        Generate an image to be used in a game of the quest "{quest.quest_name}" in the universe "{quest.universe.universe_name}". The quest description is as follows: {quest.description}. The quest involves the following main characters: {main_characters}. The story outline for this quest is as follows: {story_outline}.
         The image description is as follows: {i}
         The image should be visually appealing and should be immersive.
         '''
-        image_url = generate_image(image_prompt)
-        image_url = upload_image_from_url(image_url, f"universe/{quest.universe.id}/quest/{quest.id}/background")
+        image_jobs.append((i, submit(generate_and_upload_image(image_prompt, f"universe/{quest.universe.id}/quest/{quest.id}/background"))))
+
+    for (i, _), image_url in zip(image_jobs, wait_all([job for _, job in image_jobs])):
+        if not image_url:
+            continue
         # QuestGameplayImages
         qgi = QuestGameplayImages.objects.create(
             quest=quest,
@@ -0,0 +1,101 @@
+'''
+Pre-generation of the whole decision tree of a quest, so that no player waits on claude for a branch.
+
+The tree is generated breadth-first: every level is read from the database (the options which have no
+next question yet) and its questions are generated with at most `concurrency` claude calls at a time.
+The questions already in the tree are kept, so a run stopped by its node budget or by a failure is
+resumed by running it again. Questions are generated through generate_question_single_flight, a
+player answering a frontier option at the same time waits for the same generation.
+'''
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from structlog import get_logger
+
+from .models import Option, Quest, Question
+from .service import generate_question_single_flight
+
+logger = get_logger()
+
+TREE_LOCK_TIMEOUT = 60 * 60
+
+
+def get_frontier(quest, exclude_ids=()):
+    '''
+    returns the ids of the options of the shallowest level of the quest which have no next question,
+    [None] for a quest without questions and [] once the tree is complete
+    '''
+    if not Question.objects.filter(quest=quest).exists():
+        return [None]
+
+    options = Option.objects.filter(
+        question__quest=quest,
+        next_question__isnull=True,
+        question__depth__lt=quest.max_questions
+    ).exclude(id__in=exclude_ids).order_by('question__depth', 'id').values_list('id', 'question__depth')
+
+    frontier = []
+    for option_id, depth in options:
+        if frontier and depth != frontier_depth:
+            break
+        frontier_depth = depth
+        frontier.append(option_id)
+    return frontier
+
+
+def generate_node(quest_id, prev_option_id, num_of_options):
+    '''
+    generates the question after the option in a worker thread, returns its id or None if it failed
+    '''
+    try:
+        return generate_question_single_flight(quest_id, prev_option_id, num_of_options)
+    except Exception as e:
+        logger.error("Failed to pre-generate question", quest_id=quest_id, prev_option_id=prev_option_id, er=e)
+        return None
+    finally:
+        connection.close()
+
+
+def generate_quest_tree(quest_id, max_nodes=None, concurrency=None, num_of_options=2):
+    '''
+    generates the questions of the quest tree level by level till it is complete or max_nodes questions
+    are generated (QUEST_TREE_MAX_NODES and QUEST_TREE_CONCURRENCY by default).
+    returns {'generated', 'failed', 'complete'}
+    '''
+    max_nodes = max_nodes or settings.QUEST_TREE_MAX_NODES
+    concurrency = concurrency or settings.QUEST_TREE_CONCURRENCY
+
+    lock_key = f"quest_tree_lock:{quest_id}"
+    if not cache.add(lock_key, 1, timeout=TREE_LOCK_TIMEOUT):
+        logger.info("Quest tree already being generated", quest_id=quest_id)
+        return {'generated': 0, 'failed': 0, 'complete': False}
+
+    quest = Quest.objects.get(id=quest_id)
+    generated = 0
+    failed_ids = set()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while generated < max_nodes:
+                # the options which failed are left for the next run, else the level would never end
+                frontier = get_frontier(quest, failed_ids)[:max_nodes - generated]
+                if not frontier:
+                    break
+
+                question_ids = list(executor.map(lambda option_id: generate_node(quest_id, option_id, num_of_options), frontier))
+                for option_id, question_id in zip(frontier, question_ids):
+                    if question_id:
+                        generated += 1
+                    else:
+                        failed_ids.add(option_id)
+
+                logger.info("Pre-generated quest tree level", quest_id=quest_id, questions=len(frontier), generated=generated, failed=len(failed_ids))
+                if None in failed_ids:
+                    break
+    finally:
+        cache.delete(lock_key)
+
+    complete = not get_frontier(quest)
+    logger.info("Pre-generated quest tree", quest_id=quest_id, generated=generated, failed=len(failed_ids), complete=complete)
+    return {'generated': generated, 'failed': len(failed_ids), 'complete': complete}
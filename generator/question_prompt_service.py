@@ -0,0 +1,108 @@
+'''
+Prompt of the question generation, split in a prefix which is the same for every question of a
+quest (universe, quest, characters, story outline, score categories, instructions and format) and a
+short suffix with the position in the story (question number, previous question and option).
+
+The prefix is sent marked for claude's prompt cache, so the questions of a quest after the first
+one read it from the cache instead of paying and waiting for its tokens again. It is also rendered
+once per process: the memo is kept while the quest and universe fields and the score categories in
+it are the same. The score categories are read from the lookup tables in the shared cache, which
+every process drops when a category changes (generator/signals.py), so a category changed by
+another process is seen at once.
+'''
+import json
+import threading
+from collections import OrderedDict
+
+from .lookup_service import get_quest_lookups
+
+PREFIX_MEMO_MAX_SIZE    = 512
+
+_prefixes       = OrderedDict()     # (quest_id, num_of_options) -> (version, prefix)
+_prefixes_lock  = threading.Lock()
+
+
+def get_score_categories(quest_id):
+    '''
+    returns [(id, name, description)] of the score categories of the quest, ordered by id
+    '''
+    score_categories = get_quest_lookups(quest_id)['score_categories']
+    return [
+        (category_id, score_categories[category_id]['name'], score_categories[category_id]['description'])
+        for category_id in sorted(score_categories)
+    ]
+
+
+def build_prompt_prefix(quest, num_of_options, score_categories):
+    universe = quest.universe
+    main_characters = json.loads(quest.main_characters)
+    story_outline   = json.loads(quest.story_outline)
+    key_elements    = json.loads(universe.key_elements)
+
+    return f"""Generate a new question for the quest: "{quest.quest_name}" in the universe: "{universe.universe_name}".
+    Universe key elements: {', '.join(key_elements)}
+    Quest description: {quest.description}
+    This quest has maximum of {quest.max_questions} questions.
+    Main characters: {', '.join([f"{c['name']} ({c['role']})" for c in main_characters])}
+    Story outline: {', '.join(story_outline)}
+    Create a question that advances the story and relates to the universe's themes. Irrespective of what option is choosen, the story should progress positively.
+    The question should be engaging. The question should be limited to 150 characters at max. The question should not contain phrases like "What do you think", "What would you do", "How will you", etc rather it should be like a description of a scenario which the player has to respond to.
+    Provide {num_of_options} options that offer meaningful choices and potentially different story directions.\
+    The option should be limited to 70 characters at max.\
+    Provide the characters involved in the question.\
+    Each option modifies the score of the player for the below score categories. Provide the points in score_rewards for each category that the player will receive if they choose this option. The points can be positive or negative.
+    Score categories: {', '.join([f"ID: {category_id}  Name: {name}  Description: ({description})" for category_id, name, description in score_categories])}
+    Format the response as a JSON object with the following structure.
+    {{
+        "text": "string",
+        "options": [
+            {{
+                "text": "string",
+                "score_rewards": {{"score_category_id": points, "score_category_id": points}}
+            }} for _ in range(num_of_options)
+        ],
+        "characters" : ["string", "string"]
+    }}
+    The question is generated for the following point of the story.
+    """
+
+
+def get_prompt_prefix(quest, num_of_options):
+    '''
+    returns the prefix of the question prompts of the quest, rendered once per process
+    '''
+    key = (quest.id, num_of_options)
+    universe = quest.universe
+    score_categories = get_score_categories(quest.id)
+    version = (
+        quest.quest_name, quest.description, quest.max_questions, quest.main_characters, quest.story_outline,
+        universe.universe_name, universe.key_elements, tuple(score_categories)
+    )
+    with _prefixes_lock:
+        memo = _prefixes.get(key)
+        if memo and memo[0] == version:
+            _prefixes.move_to_end(key)
+            return memo[1]
+
+    prefix = build_prompt_prefix(quest, num_of_options, score_categories)
+    with _prefixes_lock:
+        _prefixes[key] = (version, prefix)
+        _prefixes.move_to_end(key)
+        while len(_prefixes) > PREFIX_MEMO_MAX_SIZE:
+            _prefixes.popitem(last=False)
+    return prefix
+
+
+def get_prompt_suffix(questions_in_path, prev_option, previous_question, other_options):
+    return f"""
+    This is question number {questions_in_path+1}.
+    Previous question: "{previous_question.question_text if previous_question else 'Initial question'}"
+    Previous selected option: "{prev_option.option_text if prev_option else 'N/A'}"
+    Option that was selected in the previous question: {', '.join([option.option_text for option in other_options]) if prev_option else 'N/A'}
+    """
+
+
+def invalidate_prompt_prefix(quest_id):
+    with _prefixes_lock:
+        for key in [key for key in _prefixes if key[0] == quest_id]:
+            del _prefixes[key]
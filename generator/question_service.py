@@ -1,7 +1,5 @@
 from .service import *
-from elevenlabs.client import ElevenLabs
-from elevenlabs import save
-import urllib
+from .provider_service import clone_elevenlabs_voice, download, generate_speech_elevenlabs, generate_speech_openai, run_all, run_async
 
 ELEVEN_LABS_API_KEY = settings.ELEVEN_LABS_API_KEY
 
@@ -9,8 +7,10 @@ def generate_question_assets(question_id):
     '''
     generates images/audio/video for question
     '''
-    generate_question_image(question_id)
-    generate_question_speech_openai(question_id)
+    quest_id = Question.objects.filter(pk=question_id).values_list('quest_id', flat=True).first()
+    with tag_entity('quest', quest_id):
+        generate_question_image(question_id)
+        generate_question_speech_openai(question_id)
 
 
 def generate_question_image(question_id):
@@ -47,6 +47,7 @@ def generate_question_image(question_id):
     # store the image_url in question
     question.image_file_path = image_url
     question.save()
+    invalidate_quest_snapshot(question.quest_id, debounce=True)
     return image_url
 
 
@@ -62,36 +63,34 @@ def generate_question_speech_elevenlabs(question_id):
         if question.audio_file_path:
             return question.audio_file_path
 
-        client = ElevenLabs(
-            api_key=ELEVEN_LABS_API_KEY, # Defaults to ELEVEN_API_KEY
-            )
-        
-        if question.quest.universe.narrator_voice_description and len(question.quest.universe.narrator_voice_samples):
-            voice = clone_voice(
-                voice_name=question.quest.universe.slug,
-                voice_description=question.quest.universe.narrator_voice_description,
-                voice_files=question.quest.universe.narrator_voice_samples
-            )
-            audio = client.generate(text=text, voice=voice)
-        else:
-            audio = client.generate(
-            text=text,
-            voice="Brian",
-            model="eleven_multilingual_v2"
-            )
-
-        # save the audio in a temp file with uuid as name
-        audio_path = f"tmp/audio/{str(uuid.uuid4())}.mp3"
-
-        # check if the directory exists else create it
-        os.makedirs(os.path.dirname(audio_path), exist_ok=True)
-
-        save(audio, audio_path)
+        with tag_entity('quest', question.quest_id):
+            if question.quest.universe.narrator_voice_description and len(question.quest.universe.narrator_voice_samples):
+                voice = clone_voice(
+                    voice_name=question.quest.universe.slug,
+                    voice_description=question.quest.universe.narrator_voice_description,
+                    voice_files=question.quest.universe.narrator_voice_samples
+                )
+            else:
+                voice = None
+
+            # save the audio in a temp file with uuid as name
+            audio_path = f"tmp/audio/{str(uuid.uuid4())}.mp3"
+
+            # check if the directory exists else create it
+            os.makedirs(os.path.dirname(audio_path), exist_ok=True)
+
+            if voice:
+                audio = run_async(generate_speech_elevenlabs(text, voice))
+            else:
+                audio = run_async(generate_speech_elevenlabs(text, "Brian", model="eleven_multilingual_v2"))
+            with open(audio_path, 'wb') as f:
+                f.write(audio)
 
         # upload the audio to s3
         audio_url = upload_audio_from_input_path(audio_path, f"universe/{question.quest.universe.id}/quest/{question.quest.id}/question/{question.id}")
         question.audio_file_path = audio_url
         question.save()
+        invalidate_quest_snapshot(question.quest_id, debounce=True)
         return audio_url
 
     except Question.DoesNotExist:
@@ -105,16 +104,11 @@ def generate_question_speech_elevenlabs(question_id):
 def clone_voice(voice_name, voice_description, voice_files:list):
     files= download_files_from_url(voice_files)
 
-    client = ElevenLabs(
-                api_key=ELEVEN_LABS_API_KEY, # Defaults to ELEVEN_API_KEY
-            )
-    
-    voice = client.clone(
-                name=voice_name,
-                files=files,
-                description=voice_description, # Optional
-            )
-    return voice
+    return run_async(clone_elevenlabs_voice(
+        name=voice_name,
+        files=files,
+        description=voice_description, # Optional
+    ))
 
 
 def download_files_from_url(file_urls:list):
@@ -125,9 +119,13 @@ def download_files_from_url(file_urls:list):
     folder_name = '/temp/'+str(uuid.uuid4())
     os.makedirs(folder_name)
     file_paths = []
-    for file_url in file_urls:
+    # the files are downloaded concurrently
+    for file_url, content in zip(file_urls, run_all([download(file_url) for file_url in file_urls])):
+        if content is None:
+            raise Exception(f"Failed to download {file_url}")
         file_path = os.path.join(folder_name, file_url.split('/')[-1])
-        urllib.request.urlretrieve(file_url, file_path)
+        with open(file_path, 'wb') as f:
+            f.write(content)
         file_paths.append(file_path)
     return file_paths
 
@@ -144,15 +142,7 @@ def generate_question_speech_openai(question_id):
         if question.audio_file_path:
             return question.audio_file_path
 
-        client = OpenAI(api_key= settings.OPEN_AI_API_KEY)
-        
-        audio = client.audio.speech.create(
-            input=text,
-            model='tts-1',
-            response_format='mp3',
-            voice='shimmer',
-            speed=1.0
-        )
+        audio = run_async(generate_speech_openai(text))
         
         # save the audio in a temp file with uuid as name
         audio_path = f"tmp/audio/{str(uuid.uuid4())}.mp3"
@@ -161,13 +151,13 @@ def generate_question_speech_openai(question_id):
         os.makedirs(os.path.dirname(audio_path), exist_ok=True)
 
         with open(audio_path, 'wb') as f:
-            for chunk in audio.iter_bytes():
-                f.write(chunk)
+            f.write(audio)
                 
         # upload the audio to s3
         audio_url = upload_audio_from_input_path(audio_path, f"universe/{question.quest.universe.id}/quest/{question.quest.id}/question/{question.id}")
         question.audio_file_path = audio_url
         question.save()
+        invalidate_quest_snapshot(question.quest_id, debounce=True)
         return audio_url
 
     except Question.DoesNotExist:
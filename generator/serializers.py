@@ -1,6 +1,7 @@
 import json
 
 from rest_framework import serializers
+from .lookup_service import get_character_index
 from .models import Universe, Quest, Question, Option, HomePage, Trivia, TriviaQuestion, AudioStory, Episode, Comic, ComicPage, ShortVideos, News
 
 class OptionSerializer(serializers.ModelSerializer):
@@ -14,19 +15,14 @@ class QuestionSerializer(serializers.ModelSerializer):
     characters = serializers.SerializerMethodField()
 
     def get_characters(self, obj):
-        quest = obj.quest
-        main_characters = json.loads(quest.main_characters or '[]') if quest else []
-        characters = []
-        question_characters = json.loads(obj.characters or '[]')
-        for i in main_characters:
-            if i['name'] in question_characters:
-                characters.append({
-                    'name': i.get('name'),
-                    'image': i.get('image'),
-                    'role': i.get('role'),
-                    'description': i.get('description')
-                })
-        return characters
+        # callers serializing many questions of a quest pass its index in the context to fetch it once
+        character_index = self.context.get('character_index')
+        if character_index is None:
+            character_index = get_character_index(obj.quest_id)
+
+        question_characters = set(json.loads(obj.characters or '[]'))
+        # characters keep the order of the quest's main characters
+        return [character for name, character in character_index.items() if name in question_characters]
     
     class Meta:
         model = Question
@@ -3,6 +3,7 @@ import json
 from .models import Universe, Quest, Question, Option, ScoreCategory, Collectible, QuestRewardCollection, QuestGameplayImages, Character, News
 import anthropic
 from django.db import transaction
+from django.utils import timezone
 import requests
 import mimetypes
 import uuid
@@ -16,9 +17,15 @@ from django.core.cache import cache
 from django.conf import settings
 from urllib.parse import urlparse
 from .serializers import *
+from .snapshot_service import invalidate_quest_snapshot
+from .claude_cache_service import get_cached_response, store_response
+from .telemetry_service import tag_entity, track_call
+from .question_prompt_service import get_prompt_prefix, get_prompt_suffix
+from . import fake_provider_service
+from utils.rate_limiter import acquire, estimate_tokens, record_tokens
+from utils.streaming_json import StreamingJsonParser, iter_json_events
+from utils.resilience import call, check_circuit, deadline, get_remaining_time, get_timeout
 from common.utils import *
-from elevenlabs.client import ElevenLabs
-from elevenlabs import save
 from structlog import get_logger
 from qverse.celery_manager import celery_app
 # from phi.agent import Agent
@@ -49,6 +56,11 @@ AWS_ACCESS_KEY_ID=settings.AWS_ACCESS_KEY_ID
 AWS_SECRET_ACCESS_KEY=settings.AWS_SECRET_ACCESS_KEY
 
 client = anthropic.Anthropic(api_key=CLAUDE_API_KEY)
+openai_client = None
+CLAUDE_MODEL        = "claude-3-5-sonnet-20240620"
+CLAUDE_MAX_TOKENS   = 8192
+CLAUDE_TIMEOUT      = 300
+IMAGE_TIMEOUT       = 120
 
 
 def get_s3_base_url(base_url):
@@ -57,33 +69,156 @@ def get_s3_base_url(base_url):
 
 S3_UNIVERSE_BASE_URL=get_s3_base_url('qverse-universe-test')
 
-def query_claude(prompt):
+# a question generation lease must outlive a slow claude call, else a follower takes over
+QUESTION_LEASE_TIMEOUT          = 120
+QUESTION_LEASE_POLL_INTERVAL    = 0.5
+
+def get_claude_usage_tokens(message):
+    return message.usage.input_tokens + message.usage.output_tokens
+
+
+def get_claude_messages(prompt, cached_prefix=None):
+    '''
+    returns the messages of the prompt, answered after the '{' prefill. cached_prefix, the start of
+    the prompt shared by many requests, is marked for claude's prompt cache
+    '''
+    content = prompt
+    if cached_prefix:
+        content = [
+            {"type": "text", "text": cached_prefix, "cache_control": {"type": "ephemeral"}},
+            {"type": "text", "text": prompt[len(cached_prefix):]},
+        ]
+    return [
+        {"role": "user", "content": content},
+        {"role": "assistant", "content": "{"}
+    ]
+
+
+def get_claude_messages_api(messages):
+    '''
+    returns the messages api of the client, the prompt caching one when the messages use the cache
+    '''
+    if isinstance(messages[0]['content'], list):
+        return get_claude_client().beta.prompt_caching.messages
+    return get_claude_client().messages
+
+
+def create_claude_message(**kwargs):
+    '''
+    client.messages.create within the rate limits of the model
+    '''
+    estimate = estimate_tokens(json.dumps(kwargs['messages']))
+    acquire('anthropic', kwargs['model'], tokens=estimate)
+    message = get_claude_messages_api(kwargs['messages']).create(**kwargs, timeout=get_timeout(CLAUDE_TIMEOUT))
+    record_tokens('anthropic', kwargs['model'], get_claude_usage_tokens(message) - estimate)
+    return message
+
+
+def is_cacheable_response(response, stop_reason, parse=json.loads):
+    '''
+    the responses of claude are json documents. One cut at max_tokens or which doesn't parse isn't
+    cached, else every retry of the request would be answered with it
+    '''
+    if stop_reason == 'max_tokens':
+        logger.warning("Claude response truncated at max tokens, not cached", length=len(response))
+        return False
     try:
-        message = client.messages.create(
-            model="claude-3-5-sonnet-20240620",
-            max_tokens=8192,
-            messages=[
-                {"role": "user", "content": prompt},
-                {"role": "assistant", "content": "{"}
-            ]
-        )
-        return '{'+message.content[0].text
+        parse(response)
+    except ValueError as e:
+        logger.warning("Claude response isn't valid json, not cached", er=e)
+        return False
+    return True
+
+
+def parse_streamed_response(response):
+    parser = StreamingJsonParser()
+    parser.feed(response)
+    return parser.close()
+
+
+def query_claude(prompt, use_cache=True, cached_prefix=None):
+    '''
+    use_cache=False always calls claude, e.g. to regenerate a response that was cached.
+    cached_prefix is the start of the prompt which is cached by claude (see get_claude_messages)
+    '''
+    if use_cache:
+        response = get_cached_response(CLAUDE_MODEL, CLAUDE_MAX_TOKENS, prompt)
+        if response is not None:
+            return response
+
+    try:
+        # retried with backoff on timeouts, rate limits and overloads, always with the same request
+        with track_call('anthropic', CLAUDE_MODEL, 'message') as record:
+            message = call(
+                'anthropic',
+                create_claude_message,
+                model=CLAUDE_MODEL,
+                max_tokens=CLAUDE_MAX_TOKENS,
+                messages=get_claude_messages(prompt, cached_prefix)
+            )
+            record.set_claude_usage(message.usage)
     except Exception as e:
-        logger.info("Failed to query claude, trying again to check if timeout", er=e)
-        time.sleep(5)
-        # if timeout error, retry
+        logger.error("Failed to query claude", er=e)
+        raise
+
+    response = '{'+message.content[0].text
+    if is_cacheable_response(response, message.stop_reason):
+        store_response(CLAUDE_MODEL, CLAUDE_MAX_TOKENS, prompt, response)
+    return response
+
+
+def query_claude_stream(prompt, cached_prefix=None):
+    '''
+    streams the response of claude, yields the response received so far after every chunk.
+    returns the stop reason of the message
+    '''
+    estimate = estimate_tokens(prompt)
+    messages = get_claude_messages(prompt, cached_prefix)
+    check_circuit('anthropic')
+    with track_call('anthropic', CLAUDE_MODEL, 'message_stream') as record:
+        acquire('anthropic', CLAUDE_MODEL, tokens=estimate)
+        with get_claude_messages_api(messages).stream(
+            model=CLAUDE_MODEL,
+            max_tokens=CLAUDE_MAX_TOKENS,
+            messages=messages,
+            timeout=get_timeout(CLAUDE_TIMEOUT)
+        ) as stream:
+            response = '{'
+            for text in stream.text_stream:
+                response += text
+                yield response
+            message = stream.get_final_message()
+            record.set_claude_usage(message.usage)
+            record_tokens('anthropic', CLAUDE_MODEL, get_claude_usage_tokens(message) - estimate)
+    return message.stop_reason
+
+
+def stream_claude(prompt, use_cache=True):
+    '''
+    yields the response of claude in chunks as it is written, starting with the '{' prefill.
+    A cached response is yielded in one chunk. Parse the chunks with utils.streaming_json
+    to work on the items of the response before it is complete
+    '''
+    if use_cache:
+        response = get_cached_response(CLAUDE_MODEL, CLAUDE_MAX_TOKENS, prompt)
+        if response is not None:
+            yield response
+            return
+
+    response = ''
+    stream = query_claude_stream(prompt)
+    while True:
         try:
-            message = client.messages.create(
-                model="claude-3-5-sonnet-20240620",
-                max_tokens=1000,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ]
-            )
-            return message.content[0].text
-        except Exception as e:
-            logger.error("Failed to query claude", er=e)
-            raise
+            partial_response = next(stream)
+        except StopIteration as stop:
+            stop_reason = stop.value
+            break
+        yield partial_response[len(response):]
+        response = partial_response
+
+    # the consumer has read the whole stream, the response is cached only if it parses like it does
+    if use_cache and is_cacheable_response(response, stop_reason, parse_streamed_response):
+        store_response(CLAUDE_MODEL, CLAUDE_MAX_TOKENS, prompt, response)
 
 
 def get_generate_universe_prompt(universe_description):
@@ -105,8 +240,7 @@ def get_generate_universe_prompt(universe_description):
         """
     return prompt
 
-@transaction.atomic
-def generate_universe(universe_description, prompt = None):
+def generate_universe(universe_description, prompt = None, use_cache=True):
     yield {'status': 'Generating universe data'}
 
     if not prompt:
@@ -114,30 +248,34 @@ def generate_universe(universe_description, prompt = None):
 
     yield {'status': 'Prompt generated'}
 
-    response = query_claude(prompt)
-    data = json.loads(response)
-    
+    with tag_entity('universe') as entity:
+        # claude is called outside of the transaction, only the saves hold a connection
+        response = query_claude(prompt, use_cache=use_cache)
+        data = json.loads(response)
+
+        with transaction.atomic():
+            universe = Universe.objects.create(
+                universe_name=data['name'],
+                description=data['description'],
+                key_elements=json.dumps(data['key_elements']),
+                main_characters=json.dumps(data['main_characters']),
+                slug=generate_slug(data['name']) 
+            )
+            entity['id'] = universe.id
+
+            # Save the characters in the character model as well
+            for character in data['main_characters']:
+                Character.objects.create(
+                    universe=universe,
+                    name=character['name'],
+                    role=character['role'],
+                    description=character['description'],
+                    image_description=character['image_description'],
+                    voice_description=character['voice_description'],
+                    slug= generate_slug(character['name'])
+                )
     yield {'status': 'Adding universe in database'}
-    universe = Universe.objects.create(
-        universe_name=data['name'],
-        description=data['description'],
-        key_elements=json.dumps(data['key_elements']),
-        main_characters=json.dumps(data['main_characters']),
-        slug=generate_slug(data['name']) 
-    )
     yield {'status': 'Universe created'}
-
-    # Save the characters in the character model as well
-    for character in data['main_characters']:
-        Character.objects.create(
-            universe=universe,
-            name=character['name'],
-            role=character['role'],
-            description=character['description'],
-            image_description=character['image_description'],
-            voice_description=character['voice_description'],
-            slug= generate_slug(character['name'])
-        )
     yield {'status': 'Characters created', 'universe_id': universe.id}
     
     return universe.id
@@ -181,8 +319,7 @@ def generate_quest_prompt(universe_id, quest_prompt = None, max_questions=9):
     return prompt
 
 
-@transaction.atomic
-def generate_quest(universe_id, quest_prompt=None,max_questions=9):
+def generate_quest(universe_id, quest_prompt=None,max_questions=9, use_cache=True):
     '''
     Generates a quest for the given universe.
     This does not generate questions for the quest. Use generate_question for that.
@@ -190,104 +327,99 @@ def generate_quest(universe_id, quest_prompt=None,max_questions=9):
     '''
     
     prompt = generate_quest_prompt(universe_id, quest_prompt, max_questions)
-    response = query_claude(prompt)
-    data = json.loads(response)
-
-    quest = Quest.objects.create(
-        universe_id=universe_id,
-        quest_name=data['name'],
-        intro = data['intro'],
-        description=data['description'],
-        main_characters=json.dumps(data['main_characters']),
-        story_outline=json.dumps(data['story_outline']),
-        max_questions=max_questions,
-        slug=generate_slug(data['name']),
-        background_audio_description=data['background_audio_description']
-    )
+    with tag_entity('quest') as entity:
+        # claude is called outside of the transaction, only the saves hold a connection
+        response = query_claude(prompt, use_cache=use_cache)
+        data = json.loads(response)
 
-    # create score categories for the quest from the response
-    for category in data['score_categories']:
-        ScoreCategory.objects.create(
-            quest=quest,
-            name=category['category_name'],
-            description=category['description']
-        )
+        with transaction.atomic():
+            quest = Quest.objects.create(
+                universe_id=universe_id,
+                quest_name=data['name'],
+                intro = data['intro'],
+                description=data['description'],
+                main_characters=json.dumps(data['main_characters']),
+                story_outline=json.dumps(data['story_outline']),
+                max_questions=max_questions,
+                slug=generate_slug(data['name']),
+                background_audio_description=data['background_audio_description']
+            )
+            entity['id'] = quest.id
+
+            # create score categories for the quest from the response
+            for category in data['score_categories']:
+                ScoreCategory.objects.create(
+                    quest=quest,
+                    name=category['category_name'],
+                    description=category['description']
+                )
 
     return quest.id
 
 
 
-@transaction.atomic
-def generate_question(quest_id, prev_option_id=None, num_of_options=2):
-    quest = Quest.objects.get(id=quest_id)
-    universe = quest.universe
-    prev_option = Option.objects.get(id=prev_option_id) if prev_option_id else None
-    
-    # check if max questions are reached
-    # to check this we have to backtrack from current question to 1st question 
-    # and count the number of questions
-
-    questions_in_path = 0
-
-    if prev_option:
-        first_question = prev_option.question
+def prepare_question_generation(quest_id, prev_option_id=None, num_of_options=2):
+    '''
+    loads what the question after prev_option_id (or the first question) is generated from and builds
+    the prompt. returns None if the quest has reached max questions
+    '''
+    quest = Quest.objects.select_related('universe').get(id=quest_id)
+    prev_option = Option.objects.select_related('question').get(id=prev_option_id) if prev_option_id else None
+    previous_question = prev_option.question if prev_option else None
 
-        while first_question.parent_option:
-            questions_in_path += 1
-            first_question = first_question.parent_option.question
+    # check if max questions are reached
+    # depth of the previous question is the number of questions above it in the path
+    questions_in_path = previous_question.depth if previous_question else 0
 
     if questions_in_path >= quest.max_questions:
         return None
-    
-    main_characters = json.loads(quest.main_characters)
-    story_outline   = json.loads(quest.story_outline)
-    key_elements    = json.loads(universe.key_elements)
 
-    # get score categories for the quest
-    score_categories = ScoreCategory.objects.filter(quest_id=quest_id).values('id', 'name', 'description')
+    other_options = Option.objects.filter(question=previous_question).exclude(pk=prev_option_id) if previous_question else []
 
-    previous_question = prev_option.question if prev_option else None
-    if previous_question:
-        options_in_previous_question = Option.objects.filter(question=previous_question).exclude(pk=prev_option_id)
-    
-    prompt = f"""Generate a new question for the quest: "{quest.quest_name}" in the universe: "{universe.universe_name}".
-    Universe key elements: {', '.join(key_elements)}
-    Quest description: {quest.description}
-    This quest has maximum of {quest.max_questions} questions and this is question number {questions_in_path+1}.
-    Main characters: {', '.join([f"{c['name']} ({c['role']})" for c in main_characters])}
-    Story outline: {', '.join(story_outline)}
-    Previous question: "{prev_option.question.question_text if prev_option else 'Initial question'}"
-    Previous selected option: "{prev_option.option_text if prev_option else 'N/A'}"
-    Option that was selected in the previous question: {', '.join([option.option_text for option in options_in_previous_question]) if prev_option else 'N/A'}
-    Create a question that advances the story and relates to the universe's themes. Irrespective of what option is choosen, the story should progress positively.
-    The question should be engaging. The question should be limited to 150 characters at max. The question should not contain phrases like "What do you think", "What would you do", "How will you", etc rather it should be like a description of a scenario which the player has to respond to.
-    Provide {num_of_options} options that offer meaningful choices and potentially different story directions.\
-    The option should be limited to 70 characters at max.\
-    Provide the characters involved in the question.\
-    Each option modifies the score of the player for the below score categories. Provide the points in score_rewards for each category that the player will receive if they choose this option. The points can be positive or negative.
-    Score categories: {', '.join([f"ID: {category['id']}  Name: {category['name']}  Description: ({category['description']})" for category in score_categories])}
-    Format the response as a JSON object with the following structure.
-    {{
-        "text": "string",
-        "options": [
-            {{
-                "text": "string",
-                "score_rewards": {{"score_category_id": points, "score_category_id": points}}
-            }} for _ in range(num_of_options)
-        ],
-        "characters" : ["string", "string"]
-    }}
-    """
-    response = query_claude(prompt)
+    # the prefix is the same for every question of the quest and is cached by claude
+    prompt_prefix = get_prompt_prefix(quest, num_of_options)
+    prompt = prompt_prefix + get_prompt_suffix(questions_in_path, prev_option, previous_question, other_options)
+    return {
+        'quest'             : quest,
+        'prev_option'       : prev_option,
+        'previous_question' : previous_question,
+        'questions_in_path' : questions_in_path,
+        'prompt_prefix'     : prompt_prefix,
+        'prompt'            : prompt
+    }
+
+
+def parse_question_response(response):
     try:
-        data = json.loads(response)
+        return json.loads(response)
     except json.JSONDecodeError as e:
         try:
-            json.loads(response.replace('""', '"'))
+            return json.loads(response.replace('""', '"'))
         except json.JSONDecodeError as e:
             logger.error("Failed to decode response from claude", response=response, er=e)
             raise
 
+
+@transaction.atomic
+def save_generated_question(generation, data):
+    '''
+    stores the question generated from prepare_question_generation's prompt and links it to the previous option.
+    The prompt was answered outside of any transaction, so another worker could have stored the question
+    of the same option meanwhile: then nothing is stored and the id of that question is returned
+    '''
+    quest               = generation['quest']
+    prev_option         = generation['prev_option']
+    previous_question   = generation['previous_question']
+    questions_in_path   = generation['questions_in_path']
+
+    if not prev_option:
+        # the first question has no option to link, the quest row serializes its writers
+        Quest.objects.select_for_update().only('id').get(id=quest.id)
+        question_id = get_generated_question_id(quest.id)
+        if question_id:
+            logger.info("Question already generated by another worker", quest_id=quest.id, question_id=question_id)
+            return question_id
+
     question_text=data['text']
 
     question = Question.objects.create(
@@ -295,7 +427,9 @@ def generate_question(quest_id, prev_option_id=None, num_of_options=2):
         question_text=question_text,
         characters=json.dumps(data['characters']),
         parent_option=prev_option,
-        question_number=questions_in_path+1
+        question_number=questions_in_path+1,
+        depth=previous_question.depth + 1 if previous_question else 0,
+        path=previous_question.get_child_path() if previous_question else ''
     )
     
     for option_data in data['options']:
@@ -310,35 +444,169 @@ def generate_question(quest_id, prev_option_id=None, num_of_options=2):
         option_obj.save()
     
     if prev_option:
+        # links the question only if the option still has none, the saves above are rolled back otherwise
+        linked = Option.objects.filter(id=prev_option.id, next_question__isnull=True).update(next_question=question)
+        if not linked:
+            question_id = get_generated_question_id(quest.id, prev_option.id)
+            transaction.set_rollback(True)
+            logger.info("Question already generated by another worker", quest_id=quest.id, prev_option_id=prev_option.id, question_id=question_id)
+            return question_id
         prev_option.next_question = question
-        prev_option.save()
+
+    invalidate_quest_snapshot(quest.id, debounce=True)
 
     return question.id
 
 
-def get_quest_question(quest_id, prev_option_id, num_of_options=2):
+def generate_question(quest_id, prev_option_id=None, num_of_options=2):
+    '''
+    generates the question after prev_option_id (or the first question of the quest). claude is called
+    outside of any transaction, the question is stored by save_generated_question in a short one
+    '''
+    generation = prepare_question_generation(quest_id, prev_option_id, num_of_options)
+    if generation is None:
+        return None
+
+    data = parse_question_response(query_claude(generation['prompt'], cached_prefix=generation['prompt_prefix']))
+    return save_generated_question(generation, data)
+
+
+def get_generated_question_id(quest_id, prev_option_id=None):
+    '''
+    returns the id of the question already generated after prev_option_id
+    (or the first question of the quest), None if it is not generated yet
+    '''
     if prev_option_id:
-        prev_option = Option.objects.get(id=prev_option_id)
+        return Option.objects.filter(id=prev_option_id).values_list('next_question_id', flat=True).first()
+    return Question.objects.filter(quest_id=quest_id).order_by('id').values_list('id', flat=True).first()
+
+
+def get_question_lease_key(quest_id, prev_option_id=None):
+    return f"question_lease:{quest_id}:{prev_option_id or 'root'}"
+
+
+def generate_question_single_flight(quest_id, prev_option_id=None, num_of_options=2):
+    '''
+    generates the question that follows prev_option_id, making sure it is generated only once
+    when several players (or the lookahead worker) pick the same option at the same time.
+    The first caller takes a lease in the shared cache and generates the question, the others
+    wait for the leader's result instead of making their own claude call.
+
+    returns the id of the question, None if the quest has reached max questions
+    '''
+    lease_key = get_question_lease_key(quest_id, prev_option_id)
+    deadline = time.monotonic() + 2 * QUESTION_LEASE_TIMEOUT
+
+    while not cache.add(lease_key, True, timeout=QUESTION_LEASE_TIMEOUT):
+        question_id = get_generated_question_id(quest_id, prev_option_id)
+        if question_id:
+            return question_id
+
+        if time.monotonic() > deadline or get_remaining_time() == 0:
+            raise TimeoutError(f"Timed out waiting for question generation of option {prev_option_id}")
+        time.sleep(QUESTION_LEASE_POLL_INTERVAL)
+
+    try:
+        # the previous leader could have finished right before we took the lease
+        question_id = get_generated_question_id(quest_id, prev_option_id)
+        if not question_id:
+            with tag_entity('quest', quest_id):
+                question_id = generate_question(quest_id, prev_option_id, num_of_options)
+    except Exception:
+        cache.delete(lease_key)
+        raise
+
+    # followers read the question from the database, so keep the lease till it is committed
+    transaction.on_commit(lambda: cache.delete(lease_key))
+    return question_id
+
+
+def generate_question_stream(quest_id, prev_option_id=None, num_of_options=2):
+    '''
+    generates the question like generate_question_single_flight, streaming it while claude writes it.
+    yields {'status': 'text', 'text': question text so far} while the question text is generated and
+    {'status': 'generated', 'question_id': id} once the question is committed (None at max questions).
+    When another request is already generating the question, only the final event is sent.
+    '''
+    lease_key = get_question_lease_key(quest_id, prev_option_id)
+    if not cache.add(lease_key, True, timeout=QUESTION_LEASE_TIMEOUT):
+        yield {'status': 'generated', 'question_id': generate_question_single_flight(quest_id, prev_option_id, num_of_options)}
+        return
+
+    try:
+        question_id = get_generated_question_id(quest_id, prev_option_id)
+        if not question_id:
+            generation = prepare_question_generation(quest_id, prev_option_id, num_of_options)
+            if generation:
+                # only the saves are in the transaction, claude is streamed outside of it
+                response = ''
+                question_text = None
+                parser = StreamingJsonParser()
+                with tag_entity('quest', quest_id):
+                    for chunk in query_claude_stream(generation['prompt'], cached_prefix=generation['prompt_prefix']):
+                        new_text, response = chunk[len(response):], chunk
+                        if parser is None:
+                            continue
+                        try:
+                            parser.feed(new_text)
+                            text = parser.partial_string(('text',))
+                        except ValueError:
+                            # the text isn't streamed any more, parse_question_response reports the error
+                            parser = None
+                            continue
+                        if text and text != question_text:
+                            question_text = text
+                            yield {'status': 'text', 'text': question_text}
+
+                question_id = save_generated_question(generation, parse_question_response(response))
+    finally:
+        cache.delete(lease_key)
+
+    yield {'status': 'generated', 'question_id': question_id}
+
+
+def get_quest_question(quest_id, prev_option_id, num_of_options=2, prev_option=None):
+    '''
+    returns the serialized question that follows prev_option_id (or the first question of the quest).
+    The question is generated synchronously if it doesn't exist yet. 'pregenerated' in the response
+    tells whether the question was already in the tree or had to be generated for this request.
+    prev_option can be passed when the caller already fetched it with next_question and
+    next_question__options, so the next question is serialized without extra queries.
+    '''
+    questions = Question.objects.prefetch_related('options')
+
+    pregenerated = True
+    if prev_option_id:
+        if prev_option is None:
+            prev_option = Option.objects.select_related('next_question').prefetch_related('next_question__options').get(id=prev_option_id)
         if prev_option.next_question:
-            if not prev_option.next_question.image_file_path:
-                prev_option.next_question.save()
             question = prev_option.next_question
         else:
-            new_question = generate_question(quest_id, prev_option_id, num_of_options)
+            pregenerated = False
+            # the player is waiting, give up instead of retrying a slow provider for minutes
+            with deadline(settings.QUESTION_GENERATION_DEADLINE):
+                new_question = generate_question_single_flight(quest_id, prev_option_id, num_of_options)
             if new_question:
-                question = Question.objects.get(id=new_question)
+                question = questions.get(id=new_question)
             else:
                 return None
     else:
         # check if the first question for the quest is already generated
-        question =  Question.objects.filter(quest_id=quest_id).first()
+        question =  questions.filter(quest_id=quest_id).first()
         if not question:
-            question = Question.objects.get(id=generate_question(quest_id, None, num_of_options))
-        
+            pregenerated = False
+            with deadline(settings.QUESTION_GENERATION_DEADLINE):
+                question = questions.get(id=generate_question_single_flight(quest_id, None, num_of_options))
+
         if not question:
             return None
-    
-    return QuestionSerializer(question).data
+
+    logger.info("Serving quest question", quest_id=quest_id, question_id=question.id, pregenerated=pregenerated)
+
+    return {
+        **QuestionSerializer(question).data,
+        'pregenerated': pregenerated
+    }
 
 
 def upload_audio_from_url(input_url, output_path):
@@ -356,7 +624,7 @@ def upload_audio_from_url(input_url, output_path):
             output_path = f"test"
 
         # get the audio file
-        response = requests.get(input_url)
+        response = get_url(input_url)
         if response.status_code == HTTPStatus.OK:
             audio_data = response.content
             content_type = get_mime_type(input_url)
@@ -367,7 +635,7 @@ def upload_audio_from_url(input_url, output_path):
             output_path = output_path + '/' + str(uuid.uuid4()) + audio_format
 
             # upload the audio to s3
-            s3 = boto3.client('s3', aws_access_key_id=AWS_ACCESS_KEY_ID,aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
+            s3 = get_s3_client()
             s3.put_object(Body=audio_data,
                             Bucket='qverse-universe-test',
                             Key=output_path,
@@ -397,7 +665,7 @@ def upload_image_from_url(input_url, output_path):
             output_path = f"test"
 
         # get the image file
-        response = requests.get(input_url)
+        response = get_url(input_url)
         if response.status_code == HTTPStatus.OK:
             image_data = response.content
             img_format = get_file_extension(input_url)
@@ -408,7 +676,7 @@ def upload_image_from_url(input_url, output_path):
             output_path = output_path + '/' + str(uuid.uuid4()) + img_format
 
             # upload the image to s3
-            s3 = boto3.client('s3', aws_access_key_id=AWS_ACCESS_KEY_ID,aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
+            s3 = get_s3_client()
             s3.put_object(Body=image_data,
                             Bucket='qverse-universe-test',
                             Key=output_path,
@@ -450,7 +718,7 @@ def upload_audio_from_input_path(input_path, output_path):
             content_type = mimetypes.types_map['.' + audio_format]
 
             # upload the audio to s3
-            s3 = boto3.client('s3', aws_access_key_id=AWS_ACCESS_KEY_ID,aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
+            s3 = get_s3_client()
             s3.put_object(Body=audio_data,
                             Bucket='qverse-universe-test',
                             Key=output_path,
@@ -484,7 +752,7 @@ def upload_raw_audio(audio, output_path):
         output_path = output_path + '/' + str(uuid.uuid4()) + '.mp3'
 
         # upload the audio to s3
-        s3 = boto3.client('s3', aws_access_key_id=AWS_ACCESS_KEY_ID,aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
+        s3 = get_s3_client()
         s3.put_object(Body=audio,
                         Bucket='qverse-universe-test',
                         Key=output_path,
@@ -525,7 +793,7 @@ def upload_image_from_input_path(input_path, output_path):
             content_type = mimetypes.types_map['.' + img_format]
 
             # upload the image to s3
-            s3 = boto3.client('s3', aws_access_key_id=AWS_ACCESS_KEY_ID,aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
+            s3 = get_s3_client()
             s3.put_object(Body=image_data,
                             Bucket='qverse-universe-test',
                             Key=output_path,
@@ -540,6 +808,16 @@ def upload_image_from_input_path(input_path, output_path):
         return False
     
 
+def get_safe_image_prompt(prompt):
+    '''
+    adds generic instructions to the image prompt to prevent any content which can be harmful
+    '''
+    return f"""
+    {prompt}
+    Make sure the image generated doesn't contain any harmful content like violence, nudity, etc. Also, make sure the image doesn't contain any text
+    """
+
+
 def generate_image(prompt):
     '''
     generates image for the given prompt
@@ -551,41 +829,59 @@ def generate_image(prompt):
         It utilizes the DALL-E model for image generation.
         The DALL-E-3 model is used with a fixed number of images generated (n=1).
     '''
-    # if the generation fails retry 3 times with a delay of 5 seconds
+    prompt = get_safe_image_prompt(prompt)
 
-    # add generic instructions in prompt to prevent any content which can be harmful
-    prompt = f"""
-    {prompt}
-    Make sure the image generated doesn't contain any harmful content like violence, nudity, etc. Also, make sure the image doesn't contain any text
-    """
-
-    attempts = 0
     try:
-        while(attempts<3):
-            try:
-                client = OpenAI(api_key= settings.OPEN_AI_API_KEY)
-                response = client.images.generate(
-                    model=MODEL['image_model'],
-                    prompt=prompt,
-                    size="1024x1024",
-                    quality="standard",
-                    n=1,
-                )
-                if response is None:
-                    logger.error("response is none in generate_image", response=response)
-                else:
-                    image_link= response.data[0].url
-                    return image_link
-            except Exception as e:
-                logger.error('Something went wrong while generating image from dalle',e=e, attempts=attempts)
-            
-            # add delay
-            time.sleep(5)
-            attempts+=1
-
+        # retried with backoff on timeouts, rate limits and server errors
+        with track_call('openai', MODEL['image_model'], 'image') as record:
+            response = call('openai', create_image, prompt)
+            record.units = 1
     except Exception as e:
-        logger.error('Something went wrong while generating image',e=e)
+        logger.error('Something went wrong while generating image from dalle', e=e)
         return None
+    return response.data[0].url
+
+
+def get_openai_client():
+    global openai_client
+    if fake_provider_service.is_enabled():
+        return fake_provider_service.fake_openai
+    if openai_client is None:
+        openai_client = OpenAI(api_key=OPEN_AI_API_KEY)
+    return openai_client
+
+
+def get_claude_client():
+    if fake_provider_service.is_enabled():
+        return fake_provider_service.fake_anthropic
+    return client
+
+
+def get_s3_client():
+    if fake_provider_service.is_enabled():
+        return fake_provider_service.fake_s3
+    return boto3.client('s3', aws_access_key_id=AWS_ACCESS_KEY_ID,aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
+
+
+def get_url(url):
+    '''
+    downloads the url, e.g. an image generated by dall-e
+    '''
+    if fake_provider_service.is_enabled():
+        return fake_provider_service.get(url)
+    return requests.get(url)
+
+
+def create_image(prompt):
+    acquire('openai', MODEL['image_model'])
+    return get_openai_client().images.generate(
+        model=MODEL['image_model'],
+        prompt=prompt,
+        size="1024x1024",
+        quality="standard",
+        n=1,
+        timeout=get_timeout(IMAGE_TIMEOUT),
+    )
 
 
 def get_main_characters_migrated(universe_id):
@@ -599,60 +895,130 @@ def get_main_characters_migrated(universe_id):
     return characters
 
 
-@transaction.atomic
 def generate_trivia(trivia_prompt=None, no_of_questions=10):
     '''
     Generates a trivia with the given prompt and number of questions, 
     then saves the trivia, questions, options, and characters to the database.
+    The providers are called outside of any transaction: the trivia row is created hidden (soft deleted)
+    to name the paths of its images, and is published with its questions in one short transaction.
+    It is deleted if the generation fails.
     '''
 
+    from .provider_service import generate_and_upload_image, submit, wait_all
+
     prompt = generate_trivia_prompt(trivia_prompt, no_of_questions)
-    response = query_claude(prompt)
-    data = json.loads(response)
-    
-    trivia_name = data.get('name')
-    trivia_description = data.get('description')
-    thumbnail_description = data.get('thumbnail_description')
-    background_audio_description = data.get('background_audio_description')
-    main_characters_data = data.get('main_characters', [])
-    questions_data = data.get('questions', [])
 
-    trivia = Trivia.objects.create(
-        name=trivia_name,
-        description=trivia_description,
-    )  
-        
-    trivia_thumbnail_url  = generate_image(thumbnail_description)
-    trivia_thumbnail_url = upload_image_from_url(trivia_thumbnail_url, f"trivia/{trivia.id}")
-    audio_url = generate_trivia_audio(trivia.id, background_audio_description)
-
-    trivia.audio_url = audio_url
-    trivia.thumbnail = trivia_thumbnail_url
-    trivia.save()
-
-    previous_question = None
-    for index, question_data in enumerate(questions_data):
-        question_image_url = generate_image(question_data['question_image_description'])
-        question_image_url = upload_image_from_url(question_image_url, f"trivia/{trivia.id}/question/{index}")
-
-        trivia_question = TriviaQuestion.objects.create(
-            trivia=trivia,
-            question_text=question_data['question_text'],
-            question_number=question_data['question_number'],
-            options=question_data['options'],
-            image=question_image_url
-        )
+    with tag_entity('trivia') as entity:
+        # the trivia is read while claude writes it: the images of the thumbnail and of every question
+        # are generated as soon as they are complete
+        fields = {}
+        data = None
+        trivia = None
+        thumbnail_job = None
+        question_jobs = []
+        try:
+            for path, value in iter_json_events(stream_claude(prompt)):
+                if len(path) == 1:
+                    fields[path[0]] = value
+
+                is_question = len(path) == 2 and path[0] == 'questions'
+                if trivia is None and (is_question or path == ('thumbnail_description',)):
+                    # name and description come first in the response
+                    trivia = Trivia.objects.create(
+                        name=fields.get('name'),
+                        description=fields.get('description'),
+                        deleted_at=timezone.now()
+                    )
+                    entity['id'] = trivia.id
+
+                if path == ('thumbnail_description',):
+                    thumbnail_job = submit(generate_and_upload_image(value, f"trivia/{trivia.id}"))
+
+                elif is_question:
+                    question_jobs.append((value, submit(
+                        generate_and_upload_image(value['question_image_description'], f"trivia/{trivia.id}/question/{path[1]}")
+                    )))
+
+                elif path == ():
+                    data = value
+
+            if not isinstance(data, dict):
+                raise ValueError("Claude response is not a trivia object")
+
+            if trivia is None:
+                trivia = Trivia.objects.create(name=data.get('name'), description=data.get('description'), deleted_at=timezone.now())
+                entity['id'] = trivia.id
+
+            audio_url = generate_trivia_audio(trivia.id, data.get('background_audio_description'))
+            thumbnail = wait_all([thumbnail_job])[0] if thumbnail_job else None
+            question_image_urls = wait_all([job for _, job in question_jobs])
+
+            publish_trivia(trivia, data, [question_data for question_data, _ in question_jobs], question_image_urls, thumbnail, audio_url)
+        except Exception:
+            # the hidden trivia of a failed generation would never be published nor cleaned up
+            if trivia is not None:
+                trivia.delete()
+            raise
 
-        if previous_question:
-            trivia_question.previous_question = previous_question  
-            previous_question.next_question = trivia_question  
-            previous_question.save()
-        
-        trivia_question.save()
+    return data
 
-        previous_question = trivia_question
 
-    return data
+def publish_trivia(trivia, data, questions_data, question_image_urls, thumbnail, audio_url):
+    '''
+    creates the questions of the hidden trivia and publishes it, in one transaction
+    '''
+    with transaction.atomic():
+        previous_question = None
+        for question_data, question_image_url in zip(questions_data, question_image_urls):
+            trivia_question = TriviaQuestion.objects.create(
+                trivia=trivia,
+                question_text=question_data['question_text'],
+                question_number=question_data['question_number'],
+                options=question_data['options'],
+                image=question_image_url,
+                previous_question=previous_question
+            )
+            if previous_question:
+                previous_question.next_question = trivia_question
+                previous_question.save()
+            previous_question = trivia_question
+
+        trivia.name = data.get('name')
+        trivia.description = data.get('description')
+        trivia.audio_url = audio_url
+        trivia.thumbnail = thumbnail
+        trivia.deleted_at = None
+        trivia.save()
+
+
+def save_trivia(data):
+    '''
+    stores a trivia generated from generate_trivia_prompt, generating the images of the thumbnail
+    and of the questions concurrently. Used for trivias generated in a batch.
+    Like generate_trivia, the trivia stays hidden while the providers are called and is deleted if they fail.
+    '''
+    from .provider_service import generate_and_upload_images
+
+    trivia = Trivia.objects.create(
+        name=data.get('name'),
+        description=data.get('description'),
+        deleted_at=timezone.now()
+    )
+
+    questions_data = data.get('questions', [])
+    try:
+        with tag_entity('trivia', trivia.id):
+            image_urls = generate_and_upload_images(
+                [(data.get('thumbnail_description'), f"trivia/{trivia.id}")] +
+                [(q['question_image_description'], f"trivia/{trivia.id}/question/{index}") for index, q in enumerate(questions_data)]
+            )
+            audio_url = generate_trivia_audio(trivia.id, data.get('background_audio_description'))
+
+        publish_trivia(trivia, data, questions_data, image_urls[1:], image_urls[0], audio_url)
+    except Exception:
+        trivia.delete()
+        raise
+    return trivia
 
 
 def generate_trivia_prompt(trivia_prompt, no_of_questions):
@@ -719,7 +1085,8 @@ def generate_trivia_audio(trivia_id, prompt):
     Generates a background audio for the given trivia using the prompt given.
     '''
    
-    trivia = get_object_or_404(Trivia, pk=trivia_id)
+    # the trivia is still hidden while generate_trivia generates it
+    trivia = get_object_or_404(Trivia.objects.all_objects(), pk=trivia_id)
 
     # if trivia.audio_url:
     #     return trivia.audio_url
@@ -732,19 +1099,19 @@ def generate_trivia_audio(trivia_id, prompt):
     - Soft, non-distracting, with gentle, steady tempo
     """
 
-    client = ElevenLabs(
-        api_key=ELEVEN_LABS_API_KEY, 
-    )
-    result = client.text_to_sound_effects.convert(
+    from .provider_service import generate_sound_effect, run_async
+
+    result = run_async(generate_sound_effect(
         text=prompt,
-        # duration_seconds=10,
+        duration_seconds=None,
         prompt_influence=0.7,  # Optional, if not provided will use the default value of 0.3
-    )
+    ))
 
     # save the audio in a temp file with uuid as name
     audio_path = f"tmp/audio/{str(uuid.uuid4())}.mp3"
     os.makedirs(os.path.dirname(audio_path), exist_ok=True)
-    save(result, audio_path)
+    with open(audio_path, 'wb') as f:
+        f.write(result)
 
     audio_url = upload_audio_from_input_path(audio_path, f"trivia/{trivia.id}/audio")
 
@@ -861,14 +1228,12 @@ def generate_voice_over(
         voice = voice_mapping.get(voice_style, "Adam")
 
         # Generate audio using ElevenLabs
-        elevenlabs_client = ElevenLabs(api_key=ELEVEN_LABS_API_KEY)
-        audio = elevenlabs_client.generate(
-            text=text,
-            voice=voice,
-            model="eleven_multilingual_v2"
-        )
+        from .provider_service import generate_speech_elevenlabs, run_async
+
+        audio = run_async(generate_speech_elevenlabs(text, voice, model="eleven_multilingual_v2", operation='voice_over'))
         # Save the audio
-        save(audio, output_path)
+        with open(output_path, 'wb') as f:
+            f.write(audio)
         
         # Upload to S3
         s3_url = upload_audio_from_input_path(output_path, "news/audio")
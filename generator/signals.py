@@ -0,0 +1,42 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Universe, Quest, ScoreCategory, Collectible, Option
+from .catalog_service import invalidate_catalog
+from .lookup_service import invalidate_quest_lookups, invalidate_character_index
+from .question_prompt_service import invalidate_prompt_prefix
+from .snapshot_service import invalidate_quest_snapshot
+
+
+@receiver([post_save, post_delete], sender=Universe)
+def universe_changed(sender, instance, **kwargs):
+    invalidate_catalog()
+
+
+@receiver(post_save, sender=Quest)
+def quest_changed(sender, instance, **kwargs):
+    invalidate_catalog()
+    invalidate_character_index(instance.id)
+    invalidate_quest_snapshot(instance.id)
+
+
+@receiver(post_delete, sender=Quest)
+def quest_deleted(sender, instance, **kwargs):
+    invalidate_catalog()
+
+
+@receiver([post_save, post_delete], sender=ScoreCategory)
+def score_category_changed(sender, instance, **kwargs):
+    invalidate_prompt_prefix(instance.quest_id)
+    invalidate_quest_lookups(instance.quest_id)
+    invalidate_quest_snapshot(instance.quest_id)
+
+
+@receiver([post_save, post_delete], sender=Collectible)
+def collectible_changed(sender, instance, **kwargs):
+    quest_id = Option.objects.filter(id=instance.option_id).values_list('question__quest_id', flat=True).first()
+    if quest_id is None:
+        # the option is being deleted with its question or quest
+        return
+    invalidate_quest_lookups(quest_id)
+    invalidate_quest_snapshot(quest_id)
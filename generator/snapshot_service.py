@@ -0,0 +1,293 @@
+'''
+A compiled snapshot is the whole generated tree of a quest (questions, options, score rewards,
+collectibles and score categories) serialized once into plain dicts. Generated nodes never change,
+so start_quest and answer_question can serve them from the snapshot instead of querying postgres
+on every answer.
+
+Snapshots are keyed by quest id and version. The version lives in the shared cache and is replaced
+whenever the quest changes, so every worker drops its local copy on the next read. Nodes added to
+the tree (or their assets) replace it at most once per SNAPSHOT_REFRESH_INTERVAL: while a quest is
+pregenerated the older snapshot keeps being served, its missing nodes are answered from postgres.
+Compiled snapshots are kept in the shared cache and in a small per-process LRU.
+'''
+import json
+import threading
+import uuid
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.core.cache import cache
+from django.db import transaction
+from structlog import get_logger
+
+from .models import Quest, Question
+from .lookup_service import build_quest_lookups, get_character_index, get_score_values
+from .serializers import QuestionSerializer
+
+logger = get_logger()
+
+SNAPSHOT_TIMEOUT            = 60 * 60 * 24
+SNAPSHOT_REFRESH_INTERVAL   = 5
+LOCAL_SNAPSHOTS_MAX         = 64
+QUEST_IDS_MAX               = 50000
+
+_local_snapshots    = OrderedDict()     # (quest_id, version) -> snapshot
+_local_lock         = threading.Lock()
+
+
+def get_snapshot_version(quest_id):
+    '''
+    returns the current snapshot version of the quest. A random token is used instead of a counter,
+    so an evicted version key can never bring back a stale snapshot.
+    A refresh left pending by invalidate_quest_snapshot(debounce=True) is applied here once the interval is over.
+    '''
+    key = f"quest_snapshot_version:{quest_id}"
+    pending_key = f"quest_snapshot_pending:{quest_id}"
+    values = cache.get_many([key, pending_key])
+    version = values.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+        version = cache.get(key)
+    elif pending_key in values and cache.add(f"quest_snapshot_refreshed:{quest_id}", 1, timeout=SNAPSHOT_REFRESH_INTERVAL):
+        cache.delete(pending_key)
+        version = uuid.uuid4().hex
+        cache.set(key, version, timeout=None)
+    return version
+
+
+def invalidate_quest_snapshot(quest_id, debounce=False):
+    '''
+    marks the compiled snapshot of the quest as outdated. The version is replaced after the current
+    transaction commits, else a concurrent read could compile the old tree under the new version.
+
+    debounce is used for the nodes of the tree: the snapshot is recompiled at most once per SNAPSHOT_REFRESH_INTERVAL
+    instead of after every generated question, later changes are left pending for get_snapshot_version
+    '''
+    def replace_version():
+        if debounce and not cache.add(f"quest_snapshot_refreshed:{quest_id}", 1, timeout=SNAPSHOT_REFRESH_INTERVAL):
+            cache.set(f"quest_snapshot_pending:{quest_id}", 1, timeout=None)
+            return
+        cache.set(f"quest_snapshot_version:{quest_id}", uuid.uuid4().hex, timeout=None)
+
+    transaction.on_commit(replace_version)
+
+
+def compile_quest_snapshot(quest_id, version):
+    '''
+    serializes the generated tree of the quest into one immutable snapshot
+    '''
+    quest = Quest.objects.get(id=quest_id)
+    questions = Question.objects.filter(quest_id=quest_id).prefetch_related('options').order_by('id')
+    lookups = build_quest_lookups(quest_id)
+    serializer_context = {'character_index': get_character_index(quest_id)}
+
+    snapshot_questions = {}
+    snapshot_options = {}
+    for question in questions:
+        snapshot_questions[question.id] = {
+            'data'          : dict(QuestionSerializer(question, context=serializer_context).data),
+            'depth'         : question.depth,
+            'option_ids'    : [option.id for option in question.options.all()]
+        }
+        for option in question.options.all():
+            snapshot_options[option.id] = {
+                'question_id'       : question.id,
+                'next_question_id'  : option.next_question_id,
+                'score_rewards'     : option.score_rewards,
+                'collectible'       : lookups['collectibles'].get(option.id, {})
+            }
+
+    return {
+        'quest_id'          : quest.id,
+        'version'           : version,
+        'quest': {
+            'slug'          : quest.slug,
+            'quest_name'    : quest.quest_name,
+            'description'   : quest.description,
+            'intro'         : quest.intro,
+            'thumbnail'     : quest.thumbnail,
+            'audio_url'     : quest.audio_url,
+            'max_questions' : quest.max_questions,
+            'main_characters': json.loads(quest.main_characters or '[]')
+        },
+        'score_categories'  : lookups['score_categories'],
+        'first_question_id' : next(iter(snapshot_questions), None),
+        'questions'         : snapshot_questions,
+        'options'           : snapshot_options
+    }
+
+
+def get_quest_snapshot(quest_id):
+    '''
+    returns the compiled snapshot of the quest, compiling it if the current version isn't compiled yet
+    '''
+    version = get_snapshot_version(quest_id)
+
+    with _local_lock:
+        snapshot = _local_snapshots.get((quest_id, version))
+        if snapshot is not None:
+            _local_snapshots.move_to_end((quest_id, version))
+            return snapshot
+
+    cache_key = f"quest_snapshot:{quest_id}:{version}"
+    snapshot = cache.get(cache_key)
+    if snapshot is None:
+        snapshot = compile_quest_snapshot(quest_id, version)
+        cache.set(cache_key, snapshot, timeout=SNAPSHOT_TIMEOUT)
+        logger.info("Compiled quest snapshot", quest_id=quest_id, questions=len(snapshot['questions']))
+
+    with _local_lock:
+        _local_snapshots[(quest_id, version)] = snapshot
+        while len(_local_snapshots) > LOCAL_SNAPSHOTS_MAX:
+            _local_snapshots.popitem(last=False)
+
+    return snapshot
+
+
+# question ids and quest slugs never move between quests. A missing row raises, so it isn't cached.
+@lru_cache(maxsize=QUEST_IDS_MAX)
+def _quest_id_of_question(question_id):
+    return Question.objects.values_list('quest_id', flat=True).get(id=question_id)
+
+
+@lru_cache(maxsize=QUEST_IDS_MAX)
+def _quest_id_of_slug(slug):
+    return Quest.objects.values_list('id', flat=True).get(slug=slug)
+
+
+def get_quest_id_of_question(question_id):
+    try:
+        return _quest_id_of_question(question_id)
+    except Question.DoesNotExist:
+        return None
+
+
+def is_frontier_question(question_id):
+    '''
+    returns True if any option of the question doesn't have its next question generated yet
+    '''
+    snapshot = get_quest_snapshot(get_quest_id_of_question(question_id))
+    question = snapshot['questions'].get(question_id)
+    if not question:
+        return True
+
+    return any(not snapshot['options'][option_id]['next_question_id'] for option_id in question['option_ids'])
+
+
+def get_quest_id_of_slug(slug):
+    try:
+        return _quest_id_of_slug(slug)
+    except Quest.DoesNotExist:
+        return None
+
+
+def get_start_from_snapshot(slug):
+    '''
+    returns the start_quest response for the quest if its first question is already generated,
+    None otherwise
+    '''
+    quest_id = get_quest_id_of_slug(slug)
+    if quest_id is None:
+        return None
+
+    snapshot = get_quest_snapshot(quest_id)
+    first_question_id = snapshot['first_question_id']
+    if not first_question_id:
+        return None
+
+    quest = snapshot['quest']
+    return {
+        **snapshot['questions'][first_question_id]['data'],
+        'pregenerated'      : True,
+        'score'             : get_score_values(quest_id, score_categories=snapshot['score_categories']),
+        'collectible'       : {},
+        'quest_audio'       : quest['audio_url'],
+        'quest_thumbnail'   : quest['thumbnail'],
+        'description'       : quest['description'],
+        'quest_name'        : quest['quest_name'],
+        'quest_intro'       : quest['intro']
+    }
+
+
+def get_answer_from_snapshot(question_id, option_id):
+    '''
+    returns the answer_question response when the branch after the option is already generated
+    (or the quest ends there), None when the next question has to be generated
+    '''
+    quest_id = get_quest_id_of_question(question_id)
+    if quest_id is None:
+        return None
+
+    snapshot = get_quest_snapshot(quest_id)
+    option = snapshot['options'].get(option_id)
+    if not option or option['question_id'] != question_id:
+        return None
+
+    score_values = get_score_values(quest_id, option['score_rewards'], snapshot['score_categories'])
+    next_question_id = option['next_question_id']
+
+    if next_question_id and next_question_id in snapshot['questions']:
+        return {
+            **snapshot['questions'][next_question_id]['data'],
+            'pregenerated'  : True,
+            'score'         : score_values,
+            'collectible'   : option['collectible']
+        }
+
+    # generate_question doesn't go deeper than max_questions, so the quest ends here
+    if not next_question_id and snapshot['questions'][question_id]['depth'] >= snapshot['quest']['max_questions']:
+        return {
+            'message'       : 'Quest completed',
+            'score'         : score_values,
+            'collectible'   : option['collectible']
+        }
+
+    return None
+
+
+def get_quest_bundle_etag(quest_id, version=None):
+    return f'"{quest_id}-{version or get_snapshot_version(quest_id)}"'
+
+
+def get_quest_bundle_from_snapshot(quest_id):
+    '''
+    returns the whole generated tree of the quest and its etag.
+    Options without next_question_id are the frontier of the tree, the client calls answer_question
+    for them (unless the question is at max_questions depth, then the quest ends there).
+    '''
+    snapshot = get_quest_snapshot(quest_id)
+    quest = snapshot['quest']
+
+    questions = []
+    for question_id, question in snapshot['questions'].items():
+        options = []
+        for option_data in question['data']['options']:
+            option = snapshot['options'][option_data['id']]
+            options.append({
+                **option_data,
+                'score_rewards'     : option['score_rewards'],
+                'collectible'       : option['collectible'],
+                'next_question_id'  : option['next_question_id']
+            })
+        questions.append({
+            **question['data'],
+            'options'       : options,
+            'depth'         : question['depth']
+        })
+
+    bundle = {
+        'quest_id'          : quest_id,
+        'version'           : snapshot['version'],
+        'slug'              : quest['slug'],
+        'quest_name'        : quest['quest_name'],
+        'quest_intro'       : quest['intro'],
+        'description'       : quest['description'],
+        'quest_thumbnail'   : quest['thumbnail'],
+        'quest_audio'       : quest['audio_url'],
+        'max_questions'     : quest['max_questions'],
+        'characters'        : quest['main_characters'],
+        'score'             : get_score_values(quest_id, score_categories=snapshot['score_categories']),
+        'first_question_id' : snapshot['first_question_id'],
+        'questions'         : questions
+    }
+    return bundle, get_quest_bundle_etag(quest_id, snapshot['version'])
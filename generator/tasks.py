@@ -0,0 +1,99 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from structlog import get_logger
+
+from qverse.celery_manager import celery_app
+from .models import Question, Option
+from .service import generate_question_single_flight
+from .batch_service import poll_generation_batches
+from .quest_tree_service import generate_quest_tree
+from .asset_job_service import finish_asset_job, run_asset_step
+
+logger = get_logger()
+
+
+def consume_lookahead_budget(quest_id):
+    '''
+    Speculative generation is capped per quest so that a burst of players can't spend the
+    Claude quota on branches nobody picks.
+    returns False once the budget of the current window is used up
+    '''
+    key = f"lookahead_budget:{quest_id}"
+    window = settings.QUEST_LOOKAHEAD_BUDGET_WINDOW
+
+    cache.add(key, 0, timeout=window)
+    try:
+        used = cache.incr(key)
+    except ValueError:
+        # the window expired between add and incr
+        cache.add(key, 1, timeout=window)
+        used = 1
+
+    return used <= settings.QUEST_LOOKAHEAD_BUDGET
+
+
+@celery_app.task(ignore_result=True)
+def generate_lookahead_questions(question_id, depth=1):
+    '''
+    generates the child question of every option of the given question which is not generated yet,
+    so that the player's next answer is served from the database instead of waiting on claude.
+    depth > 1 continues the lookahead below the generated children.
+    '''
+    question = Question.objects.filter(id=question_id).first()
+    if not question:
+        return
+
+    options = list(Option.objects.filter(question_id=question_id))
+
+    for option in options:
+        next_question_id = option.next_question_id
+
+        if not next_question_id:
+            if not consume_lookahead_budget(question.quest_id):
+                logger.info("Lookahead budget exhausted", quest_id=question.quest_id, question_id=question_id)
+                return
+
+            next_question_id = generate_question_single_flight(question.quest_id, option.id, len(options))
+
+        if next_question_id and depth > 1:
+            generate_lookahead_questions.delay(next_question_id, depth - 1)
+
+
+def schedule_lookahead(question_id):
+    '''
+    enqueues the lookahead generation for the given question once the current transaction commits.
+    Failing to enqueue never fails the request, the branch is then generated synchronously on answer.
+    '''
+    depth = settings.QUEST_LOOKAHEAD_DEPTH
+    if depth <= 0 or not question_id:
+        return
+
+    def enqueue():
+        try:
+            generate_lookahead_questions.apply_async((question_id, depth), retry=False)
+        except Exception as e:
+            logger.error("Failed to enqueue lookahead generation", question_id=question_id, er=e)
+
+    transaction.on_commit(enqueue)
+
+
+@celery_app.task(ignore_result=True)
+def poll_generation_batches_task():
+    poll_generation_batches()
+
+
+@celery_app.task(ignore_result=True)
+def generate_quest_tree_task(quest_id, max_nodes=None, concurrency=None, num_of_options=2):
+    generate_quest_tree(quest_id, max_nodes, concurrency, num_of_options)
+
+
+@celery_app.task
+def run_asset_step_task(job_id, name):
+    # the result is read by the chord of the job
+    return run_asset_step(job_id, name)
+
+
+@celery_app.task(ignore_result=True)
+def finish_asset_job_task(job_id):
+    finish_asset_job(job_id)
@@ -0,0 +1,259 @@
+'''
+Latency, retries, usage and estimated cost of every call to the generation providers, for the
+entity (universe, quest, trivia, user) the call was made for.
+
+    with tag_entity('quest', quest_id):
+        generate_question(...)
+
+    with track_call('openai', 'dall-e-3', 'image') as record:
+        response = call('openai', create_image, prompt)
+        record.units = 1
+
+Each call is logged as it ends and stored as a ProviderCallLog row. The rows of the calls made
+inside tag_entity are written when the block ends, so the id of an entity created inside the block
+(entity['id'] = universe.id) is set on the calls which generated it. The provider_cost_report
+command reports the p50/p95 latency and the cost per entity.
+
+Costs are estimated from PRICES, the list prices in USD; calls of unknown models cost 0.
+'''
+import asyncio
+import contextvars
+import math
+import time
+from contextlib import asynccontextmanager, contextmanager
+from decimal import Decimal
+
+from structlog import get_logger
+
+from utils.resilience import count_attempts
+from .models import ProviderCallLog
+
+logger = get_logger()
+
+MILLION = 1000000
+
+# (provider, model) -> price per input token, per output token, per prompt cache read and write token
+# and per unit (image, character, generation)
+PRICES = {
+    ('anthropic', 'claude-3-5-sonnet-20240620')         : {
+        'input'         : Decimal(3) / MILLION,
+        'output'        : Decimal(15) / MILLION,
+        'cache_read'    : Decimal('0.3') / MILLION,
+        'cache_write'   : Decimal('3.75') / MILLION,
+    },
+    ('openai', 'dall-e-3')                              : {'unit': Decimal('0.04')},
+    ('openai', 'tts-1')                                 : {'unit': Decimal(15) / MILLION},
+    ('openai', 'gpt-4o')                                : {'input': Decimal('2.5') / MILLION, 'output': Decimal(10) / MILLION},
+    ('openai', 'gpt-4o-mini')                           : {'input': Decimal('0.15') / MILLION, 'output': Decimal('0.6') / MILLION},
+    ('elevenlabs', 'eleven_multilingual_v2')            : {'unit': Decimal('0.0003')},
+    ('elevenlabs', 'sound-generation')                  : {'unit': Decimal('0.06')},
+}
+
+_entity = contextvars.ContextVar('telemetry_entity', default=None)
+
+
+class CallRecord:
+    def __init__(self, provider, model, operation):
+        self.provider       = provider
+        self.model          = model or ''
+        self.operation      = operation
+        self.entity         = _entity.get()
+        self.input_tokens   = 0
+        self.output_tokens  = 0
+        self.cache_read_tokens  = 0
+        self.cache_write_tokens = 0
+        self.units          = 0
+        self.attempts       = 1
+        self.latency_ms     = 0
+        self.success        = True
+        self.error          = None
+
+    def set_usage(self, input_tokens, output_tokens):
+        self.input_tokens = input_tokens or 0
+        self.output_tokens = output_tokens or 0
+
+    def set_claude_usage(self, usage):
+        '''
+        usage of a claude message, with the prompt cache tokens when the prompt caching api was used
+        '''
+        self.set_usage(usage.input_tokens, usage.output_tokens)
+        cache_read = getattr(usage, 'cache_read_input_tokens', None)
+        cache_write = getattr(usage, 'cache_creation_input_tokens', None)
+        self.cache_read_tokens = cache_read if isinstance(cache_read, int) else 0
+        self.cache_write_tokens = cache_write if isinstance(cache_write, int) else 0
+
+    def get_cost(self):
+        prices = PRICES.get((self.provider, self.model), {})
+        return (
+            self.input_tokens * prices.get('input', 0) +
+            self.output_tokens * prices.get('output', 0) +
+            self.cache_read_tokens * prices.get('cache_read', 0) +
+            self.cache_write_tokens * prices.get('cache_write', 0) +
+            self.units * prices.get('unit', 0)
+        )
+
+    def to_log(self):
+        entity = self.entity or {}
+        return ProviderCallLog(
+            provider=self.provider,
+            model=self.model,
+            operation=self.operation,
+            entity_type=entity.get('type'),
+            entity_id=entity.get('id'),
+            latency_ms=self.latency_ms,
+            attempts=self.attempts,
+            input_tokens=self.input_tokens,
+            output_tokens=self.output_tokens,
+            cache_read_tokens=self.cache_read_tokens,
+            cache_write_tokens=self.cache_write_tokens,
+            units=self.units,
+            cost=round(self.get_cost(), 6),
+            success=self.success,
+            error=self.error,
+        )
+
+
+@contextmanager
+def tag_entity(entity_type, entity_id=None):
+    '''
+    attributes the provider calls made inside the block to the entity. yields the entity, whose
+    'id' can be set inside the block when the entity is created by it
+    '''
+    entity = {'type': entity_type, 'id': entity_id, 'calls': []}
+    token = _entity.set(entity)
+    try:
+        yield entity
+    finally:
+        _entity.reset(token)
+        write_calls(entity['calls'])
+
+
+def write_calls(records):
+    '''
+    stores the calls, failing to store them never fails the generation
+    '''
+    if not records:
+        return
+    try:
+        ProviderCallLog.objects.bulk_create([record.to_log() for record in records])
+    except Exception as e:
+        logger.error("Failed to store provider calls", er=e, calls=len(records))
+
+
+def end_call(record, started, counter):
+    record.latency_ms = int((time.monotonic() - started) * 1000)
+    record.attempts = max(counter['attempts'], 1)
+    logger.info(
+        "Provider call",
+        provider=record.provider,
+        model=record.model,
+        operation=record.operation,
+        entity_type=(record.entity or {}).get('type'),
+        entity_id=(record.entity or {}).get('id'),
+        latency_ms=record.latency_ms,
+        attempts=record.attempts,
+        input_tokens=record.input_tokens,
+        output_tokens=record.output_tokens,
+        cache_read_tokens=record.cache_read_tokens,
+        units=record.units,
+        cost=float(record.get_cost()),
+        success=record.success,
+    )
+    if record.entity is not None:
+        # written with the entity's id when its tag_entity block ends
+        record.entity['calls'].append(record)
+        return False
+    return True
+
+
+@contextmanager
+def track_call(provider, model, operation):
+    '''
+    measures the provider call (with its retries) made inside the block. yields the CallRecord,
+    on which the usage of the call is set
+    '''
+    record = CallRecord(provider, model, operation)
+    started = time.monotonic()
+    with count_attempts() as counter:
+        try:
+            yield record
+        except Exception as e:
+            record.success = False
+            record.error = repr(e)
+            raise
+        finally:
+            if end_call(record, started, counter):
+                write_calls([record])
+
+
+@asynccontextmanager
+async def track_call_async(provider, model, operation):
+    '''
+    track_call for coroutines, the call is stored without blocking the event loop
+    '''
+    record = CallRecord(provider, model, operation)
+    started = time.monotonic()
+    with count_attempts() as counter:
+        try:
+            yield record
+        except Exception as e:
+            record.success = False
+            record.error = repr(e)
+            raise
+        finally:
+            if end_call(record, started, counter):
+                await asyncio.to_thread(write_calls, [record])
+
+
+def get_percentile(values, percentile):
+    '''
+    nearest rank percentile of the sorted values
+    '''
+    if not values:
+        return 0
+    return values[max(math.ceil(percentile / 100 * len(values)) - 1, 0)]
+
+
+def get_cost_report(since, entity_type=None, entity_id=None):
+    '''
+    returns the calls since the given time grouped by entity, the costliest first:
+    [{'entity_type', 'entity_id', 'calls', 'failed', 'p50_ms', 'p95_ms', 'input_tokens', 'output_tokens', 'cache_read_tokens', 'cost'}]
+    '''
+    logs = ProviderCallLog.objects.filter(created_at__gte=since)
+    if entity_type:
+        logs = logs.filter(entity_type=entity_type)
+    if entity_id:
+        logs = logs.filter(entity_id=entity_id)
+
+    groups = {}
+    for log in logs.values_list(
+        'entity_type', 'entity_id', 'latency_ms', 'success', 'input_tokens', 'output_tokens', 'cache_read_tokens', 'cost'
+    ):
+        group_type, group_id, latency_ms, success, input_tokens, output_tokens, cache_read_tokens, cost = log
+        group = groups.setdefault((group_type, group_id), {
+            'entity_type'       : group_type,
+            'entity_id'         : group_id,
+            'latencies'         : [],
+            'failed'            : 0,
+            'input_tokens'      : 0,
+            'output_tokens'     : 0,
+            'cache_read_tokens' : 0,
+            'cost'              : Decimal(0),
+        })
+        group['latencies'].append(latency_ms)
+        group['failed'] += 0 if success else 1
+        group['input_tokens'] += input_tokens
+        group['output_tokens'] += output_tokens
+        group['cache_read_tokens'] += cache_read_tokens
+        group['cost'] += cost
+
+    report = []
+    for group in groups.values():
+        latencies = sorted(group.pop('latencies'))
+        report.append({
+            **group,
+            'calls'     : len(latencies),
+            'p50_ms'    : get_percentile(latencies, 50),
+            'p95_ms'    : get_percentile(latencies, 95),
+        })
+    return sorted(report, key=lambda group: group['cost'], reverse=True)
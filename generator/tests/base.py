@@ -0,0 +1,75 @@
+import json
+
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase
+from rest_framework.test import APIClient
+
+from generator import snapshot_service
+from generator.models import Universe, Quest, ScoreCategory, Question, Option
+
+
+def create_quest_with_first_question():
+    universe = Universe.objects.create(
+        universe_name='Test Universe',
+        description='A universe for tests',
+        key_elements=json.dumps(['courage']),
+        slug='test-universe'
+    )
+    quest = Quest.objects.create(
+        universe=universe,
+        quest_name='Test Quest',
+        intro='intro',
+        description='A quest for tests',
+        main_characters=json.dumps([{'name': 'Ava', 'role': 'hero', 'description': 'brave'}]),
+        story_outline=json.dumps(['start', 'end']),
+        slug='test-quest'
+    )
+    category = ScoreCategory.objects.create(quest=quest, name='Courage', description='how brave')
+    question = Question.objects.create(quest=quest, question_text='First question', characters=json.dumps(['Ava']))
+    options = [
+        Option.objects.create(question=question, option_text=text, score_rewards={str(category.id): 1})
+        for text in ['Go left', 'Go right']
+    ]
+    return quest, question, options
+
+
+def claude_question_response(category_id):
+    return json.dumps({
+        'text': 'Generated question',
+        'options': [
+            {'text': 'Option A', 'score_rewards': {str(category_id): 1}},
+            {'text': 'Option B', 'score_rewards': {str(category_id): -1}},
+        ],
+        'characters': ['Ava']
+    })
+
+
+class ProviderError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+
+class QuestFixtureMixin:
+    '''
+    starts every test from empty caches and a quest with its first question, two options and a score category
+    '''
+    client_class = APIClient
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        # the ids of the rolled back rows are given again to the next test's rows
+        snapshot_service._quest_id_of_question.cache_clear()
+        snapshot_service._quest_id_of_slug.cache_clear()
+        self.quest, self.question, self.options = create_quest_with_first_question()
+        self.category = ScoreCategory.objects.get(quest=self.quest)
+
+
+class QuestTestCase(QuestFixtureMixin, TestCase):
+    pass
+
+
+# for the tests whose worker threads need the rows committed
+class QuestTransactionTestCase(QuestFixtureMixin, TransactionTestCase):
+    pass
@@ -0,0 +1,67 @@
+import json
+from unittest import mock
+
+from django.test import override_settings
+
+from .base import QuestTestCase, claude_question_response
+from ..models import Question, Option, GenerationBatch, QuestRewardCollection, Trivia
+from .. import batch_service, provider_service
+
+
+@override_settings(GENERATION_BATCH_BACKEND='fake')
+class GenerationBatchTest(QuestTestCase):
+    def setUp(self):
+        super().setUp()
+        self.quest.max_questions = 2
+        self.quest.save()
+        category_id = self.category.id
+
+        def respond(prompt):
+            if 'Generate rewards' in prompt:
+                return json.dumps({'collectible_rewards': [{'name': 'Sword', 'description': 'sharp'}]})[1:]
+            if 'Go right' in prompt and 'Previous selected option: "Go right"' in prompt:
+                return None
+            return claude_question_response(category_id)[1:]
+        batch_service.fake_batch_client.respond = respond
+
+    def test_quest_tree_is_generated_level_by_level(self):
+        batch = batch_service.submit_question_batch([self.quest.id], continue_tree=True)
+        self.assertEqual(len(batch.requests), 2)
+
+        self.assertEqual(batch_service.poll_generation_batches(), 1)
+        batch.refresh_from_db()
+        self.assertEqual((batch.status, batch.succeeded_count, batch.failed_count), ('PROCESSED', 1, 1))
+        self.assertIsNotNone(Option.objects.get(id=self.options[0].id).next_question)
+        self.assertIsNone(Option.objects.get(id=self.options[1].id).next_question)
+
+        # the next level holds the failed option and the options of the generated question
+        next_batch = GenerationBatch.objects.exclude(id=batch.id).get()
+        self.assertEqual(len(next_batch.requests), 3)
+        batch_service.poll_generation_batches()
+        self.assertEqual(Question.objects.filter(quest=self.quest, depth=2).count(), 2)
+
+    def test_rewards_are_stored_once(self):
+        batch_service.submit_reward_batch([self.quest.id])
+        batch_service.poll_generation_batches()
+        self.assertEqual(list(QuestRewardCollection.objects.values_list('name', flat=True)), ['Sword'])
+        self.assertIsNone(batch_service.submit_reward_batch([self.quest.id]))
+
+    def test_trivia_is_published_once_its_assets_are_generated(self):
+        trivia = {'name': 'Birds', 'description': 'About birds', 'thumbnail_description': 'a bird', 'background_audio_description': 'chirps',
+                  'questions': [{'question_text': 'Which bird?', 'question_number': 1, 'options': [], 'question_image_description': 'a crow'}]}
+        batch_service.fake_batch_client.respond = lambda prompt: json.dumps(trivia)[1:]
+
+        with mock.patch.object(provider_service, 'generate_and_upload_images', return_value=['thumbnail.png', 'crow.png']), \
+                mock.patch('generator.service.generate_trivia_audio', side_effect=RuntimeError('audio failed')):
+            batch_service.submit_trivia_batch(['birds'])
+            batch_service.poll_generation_batches()
+        # a trivia whose assets failed is never published
+        self.assertFalse(Trivia.objects.all_objects().exists())
+
+        with mock.patch.object(provider_service, 'generate_and_upload_images', return_value=['thumbnail.png', 'crow.png']), \
+                mock.patch('generator.service.generate_trivia_audio', return_value='chirps.mp3'):
+            batch_service.submit_trivia_batch(['birds'])
+            batch_service.poll_generation_batches()
+        published = Trivia.objects.get()
+        self.assertEqual((published.thumbnail, published.audio_url), ('thumbnail.png', 'chirps.mp3'))
+        self.assertEqual(list(published.triviaquestion_set.values_list('image', flat=True)), ['crow.png'])
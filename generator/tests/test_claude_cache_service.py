@@ -0,0 +1,71 @@
+import os
+import tempfile
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from .. import claude_cache_service
+from utils.streaming_json import iter_json_events
+from ..service import CLAUDE_MODEL, CLAUDE_MAX_TOKENS, query_claude, stream_claude
+
+
+class ClaudeResponseCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        claude_cache_service._backend = None
+        self.addCleanup(setattr, claude_cache_service, '_backend', None)
+
+    def claude_message(self, text, stop_reason='end_turn'):
+        return mock.Mock(content=[mock.Mock(text=text)], usage=mock.Mock(input_tokens=10, output_tokens=5), stop_reason=stop_reason)
+
+    def test_identical_prompts_call_claude_once(self):
+        with mock.patch('generator.service.client') as client:
+            client.messages.create.return_value = self.claude_message('"a": 1}')
+            self.assertEqual(query_claude('prompt'), '{"a": 1}')
+            self.assertEqual(query_claude('prompt'), '{"a": 1}')
+            query_claude('prompt', use_cache=False)
+            query_claude('another prompt')
+
+        self.assertEqual(client.messages.create.call_count, 3)
+        stats = claude_cache_service.get_cache_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+
+        with override_settings(CLAUDE_RESPONSE_CACHE_BYPASS=True), mock.patch('generator.service.client') as client:
+            client.messages.create.return_value = self.claude_message('"a": 2}')
+            self.assertEqual(query_claude('prompt'), '{"a": 2}')
+
+    def test_truncated_and_malformed_responses_are_not_cached(self):
+        with mock.patch('generator.service.client') as client:
+            client.messages.create.side_effect = [
+                self.claude_message('"a": [1, 2', stop_reason='max_tokens'),
+                self.claude_message('"a": 1,}'),
+                self.claude_message('"a": 1}'),
+            ]
+            query_claude('prompt')
+            query_claude('prompt')
+            self.assertEqual(query_claude('prompt'), '{"a": 1}')
+            self.assertEqual(query_claude('prompt'), '{"a": 1}')
+        self.assertEqual(client.messages.create.call_count, 3)
+
+        def truncated_stream(prompt):
+            yield '{"questions": [{"a"'
+            return 'max_tokens'
+
+        with mock.patch('generator.service.query_claude_stream', side_effect=truncated_stream):
+            with self.assertRaises(ValueError):
+                list(iter_json_events(stream_claude('trivia prompt')))
+        self.assertIsNone(claude_cache_service.get_cached_response(CLAUDE_MODEL, CLAUDE_MAX_TOKENS, 'trivia prompt'))
+
+    def test_sqlite_backend_evicts_least_recently_used(self):
+        path = os.path.join(tempfile.mkdtemp(), 'claude_cache.sqlite3')
+        backend = claude_cache_service.SqliteBackend(path, max_entries=2, ttl=60)
+
+        backend.set('a', 'response a')
+        backend.set('b', 'response b')
+        backend.get('a')
+        backend.set('c', 'response c')
+        self.assertEqual((backend.get('a'), backend.get('b'), backend.get('c')), ('response a', None, 'response c'))
+
+        expired = claude_cache_service.SqliteBackend(path, max_entries=2, ttl=0)
+        self.assertIsNone(expired.get('a'))
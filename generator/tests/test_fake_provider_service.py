@@ -0,0 +1,90 @@
+import json
+import os
+import tempfile
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from ..models import Quest, ScoreCategory, Question, Option, QuestRewardCollection, Trivia, AssetJob
+from .. import fake_provider_service
+from utils import resilience
+from ..quest_service import generate_quest_assets
+from ..asset_job_service import get_asset_job_status, start_asset_job
+from ..service import generate_question, generate_quest, generate_trivia, generate_universe
+
+
+@override_settings(GENERATION_PROVIDER_BACKEND='fake', FAKE_PROVIDERS={}, PROVIDER_RATE_LIMITS={})
+class FakeProviderTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        # the audio is written to tmp/ of the working directory
+        cwd = os.getcwd()
+        os.chdir(tempfile.mkdtemp())
+        self.addCleanup(os.chdir, cwd)
+
+    def test_generation_pipeline_runs_against_the_fakes(self):
+        universe_id = list(generate_universe('A universe of clockwork birds'))[-1]['universe_id']
+        quest_id = generate_quest(universe_id, None, 3)
+        question_id = generate_question(quest_id)
+        option = Option.objects.filter(question_id=question_id).first()
+        generate_question(quest_id, option.id)
+        list(generate_quest_assets(quest_id))
+        trivia = generate_trivia('Clockwork birds', 3)
+
+        quest = Quest.objects.get(id=quest_id)
+        category_ids = {str(category_id) for category_id in ScoreCategory.objects.filter(quest=quest).values_list('id', flat=True)}
+        self.assertEqual(set(option.score_rewards), category_ids)
+        self.assertEqual(Question.objects.filter(quest=quest).count(), 2)
+        self.assertTrue(quest.thumbnail and quest.audio_url)
+        self.assertEqual(QuestRewardCollection.objects.filter(quest=quest, image_path__isnull=False).count(), 30)
+        self.assertEqual(len(trivia['questions']), 3)
+        self.assertEqual(Trivia.objects.get(name=trivia['name']).triviaquestion_set.exclude(image=None).count(), 3)
+
+    def test_failed_trivia_generation_leaves_no_hidden_trivia(self):
+        with mock.patch('generator.service.generate_trivia_audio', side_effect=RuntimeError('audio failed')):
+            with self.assertRaises(RuntimeError):
+                generate_trivia('Clockwork birds', 3)
+        # the stream ends in the middle of the questions
+        with mock.patch('generator.service.stream_claude', return_value=iter(['{"name": "Birds", "description": "x", "thumbnail_description": "a bird", "questions": ['])):
+            with self.assertRaises(ValueError):
+                generate_trivia('Clockwork birds', 3)
+        self.assertFalse(Trivia.objects.all_objects().exists())
+
+    # the celery settings are read from the django settings, the canvas runs in the test without a broker
+    @override_settings(
+        CELERY_TASK_ALWAYS_EAGER=True,
+        CELERY_TASK_EAGER_PROPAGATES=True,
+        CELERY_BROKER_URL='memory://',
+        CELERY_RESULT_BACKEND='cache+memory://'
+    )
+    def test_quest_assets_run_as_an_asset_job(self):
+        universe_id = list(generate_universe('A universe of clockwork birds'))[-1]['universe_id']
+        quest_id = generate_quest(universe_id, None, 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            job = start_asset_job(AssetJob.EntityTypes.QUEST, quest_id)
+            # the job which is still pending is returned instead of starting a second one
+            self.assertEqual(start_asset_job(AssetJob.EntityTypes.QUEST, quest_id).id, job.id)
+
+        status = get_asset_job_status(job.id)
+        self.assertEqual(status['status'], AssetJob.JobStatuses.SUCCEEDED)
+        self.assertEqual({step['status'] for step in status['steps']}, {AssetJob.JobStatuses.SUCCEEDED})
+        quest = Quest.objects.get(id=quest_id)
+        self.assertTrue(quest.thumbnail and quest.audio_url)
+        self.assertTrue(all(character.get('image') for character in json.loads(quest.main_characters)))
+        self.assertEqual(QuestRewardCollection.objects.filter(quest=quest, image_path__isnull=False).count(), 30)
+
+    def test_latency_and_errors_are_drawn_from_the_seed(self):
+        behaviour = {'anthropic': {'latency': 2, 'latency_sigma': 0.5, 'error_rate': 0.5, 'error_status': 529}}
+        draws = []
+        for _ in range(2):
+            fake_provider_service._random = None
+            with override_settings(FAKE_PROVIDERS=behaviour):
+                draws.append([fake_provider_service.draw('anthropic') for _ in range(20)])
+        fake_provider_service._random = None
+
+        self.assertEqual(draws[0], draws[1])
+        self.assertTrue(any(fails for _, fails in draws[0]) and not all(fails for _, fails in draws[0]))
+        self.assertTrue(all(latency > 0 for latency, _ in draws[0]))
+        self.assertTrue(resilience.is_retryable(fake_provider_service.FakeProviderError('anthropic', 529)))
@@ -0,0 +1,43 @@
+import json
+
+from .base import QuestTestCase
+from ..lookup_service import get_quest_lookups, get_score_values, get_character_index
+from ..serializers import QuestionSerializer
+from ..models import ScoreCategory, Question, Collectible
+
+
+class QuestLookupsTest(QuestTestCase):
+    def test_lookups_are_dropped_when_a_collectible_or_category_changes(self):
+        self.assertEqual(get_quest_lookups(self.quest.id)['collectibles'], {})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Collectible.objects.create(option=self.options[1], name='Map', description='old', image_path='map.png')
+        self.assertEqual(get_quest_lookups(self.quest.id)['collectibles'][self.options[1].id]['name'], 'Map')
+
+        category = ScoreCategory.objects.get(quest=self.quest)
+        category.name = 'Bravery'
+        with self.captureOnCommitCallbacks(execute=True):
+            category.save()
+
+        self.assertEqual(get_quest_lookups(self.quest.id)['score_categories'][category.id]['name'], 'Bravery')
+        with self.assertNumQueries(0):
+            self.assertEqual(get_score_values(self.quest.id, {str(category.id): 3})[category.id]['score_change'], 3)
+
+    def test_characters_are_served_from_the_index(self):
+        self.quest.main_characters = json.dumps([
+            {'name': 'Ava', 'role': 'hero', 'description': 'brave', 'image': 'ava.png'},
+            {'name': 'Bo', 'role': 'sidekick', 'description': 'loyal'}
+        ])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.quest.save()
+
+        for i in range(3):
+            Question.objects.create(quest=self.quest, question_text=f'Question {i}', characters=json.dumps(['Bo', 'Ava']))
+        questions = list(Question.objects.filter(quest=self.quest).exclude(id=self.question.id).prefetch_related('options'))
+        character_index = get_character_index(self.quest.id)
+
+        # the quest isn't loaded and main_characters isn't parsed per question
+        with self.assertNumQueries(0):
+            data = QuestionSerializer(questions, many=True, context={'character_index': character_index}).data
+        self.assertEqual([character['name'] for character in data[0]['characters']], ['Ava', 'Bo'])
+        self.assertEqual(data[0]['characters'][0]['image'], 'ava.png')
@@ -0,0 +1,33 @@
+import asyncio
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from .. import provider_service
+
+
+class ProviderServiceTest(TestCase):
+    @override_settings(PROVIDER_CONCURRENCY={'anthropic': 4, 'openai': 2, 'elevenlabs': 2, 'http': 10})
+    def test_images_are_generated_concurrently_within_the_limit(self):
+        running = []
+        peak = []
+
+        async def generate(prompt, **kwargs):
+            running.append(prompt)
+            peak.append(len(running))
+            await asyncio.sleep(0.02)
+            running.remove(prompt)
+            if 'broken' in prompt:
+                raise ValueError('content policy')
+            return mock.Mock(data=[mock.Mock(url=f"https://images/{prompt.split()[0]}.png")])
+
+        openai_client = mock.Mock()
+        openai_client.images.generate = generate
+        jobs = [(f"image{i}", f"path/{i}") for i in range(6)] + [('broken', 'path/broken')]
+
+        with mock.patch.object(provider_service, 'get_client', return_value=openai_client), \
+                mock.patch.object(provider_service, 'upload_image_from_url', side_effect=lambda url, path: f"s3/{path}"):
+            image_urls = provider_service.generate_and_upload_images(jobs)
+
+        self.assertEqual(image_urls, [f"s3/path/{i}" for i in range(6)] + [None])
+        self.assertEqual(max(peak), 2)
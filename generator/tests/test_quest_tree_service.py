@@ -0,0 +1,23 @@
+from unittest import mock
+
+from .base import QuestTransactionTestCase, claude_question_response
+from ..models import Question
+from ..quest_tree_service import generate_quest_tree
+
+
+class QuestTreeTest(QuestTransactionTestCase):
+    def test_quest_tree_is_generated_breadth_first_and_resumed(self):
+        self.quest.max_questions = 2
+        self.quest.save()
+
+        with mock.patch('generator.service.query_claude', return_value=claude_question_response(self.category.id)):
+            first_run = generate_quest_tree(self.quest.id, max_nodes=3, concurrency=2)
+            # the two options of the first question come before any deeper option
+            self.assertEqual(Question.objects.filter(quest=self.quest, depth=1).count(), 2)
+            self.assertEqual(Question.objects.filter(quest=self.quest, depth=2).count(), 1)
+
+            second_run = generate_quest_tree(self.quest.id, max_nodes=10, concurrency=2)
+
+        self.assertEqual((first_run['generated'], first_run['complete']), (3, False))
+        self.assertEqual((second_run['generated'], second_run['complete']), (3, True))
+        self.assertEqual(Question.objects.filter(quest=self.quest, depth=2).count(), 4)
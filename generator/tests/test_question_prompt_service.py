@@ -0,0 +1,41 @@
+from unittest import mock
+
+from django.core.cache import cache
+
+from .base import QuestTestCase, claude_question_response
+from ..lookup_service import get_lookups_key
+from ..models import ScoreCategory
+from .. import question_prompt_service
+from ..service import generate_question, prepare_question_generation
+
+
+class QuestionPromptCacheTest(QuestTestCase):
+    def test_quest_context_is_sent_as_a_cached_prefix(self):
+        message = mock.Mock(
+            content=[mock.Mock(text=claude_question_response(self.category.id)[1:])],
+            usage=mock.Mock(input_tokens=50, output_tokens=40, cache_read_input_tokens=900, cache_creation_input_tokens=0)
+        )
+        with mock.patch('generator.service.client') as client, \
+                mock.patch.object(question_prompt_service, 'build_prompt_prefix', wraps=question_prompt_service.build_prompt_prefix) as build:
+            client.beta.prompt_caching.messages.create.return_value = message
+            for option in self.options:
+                generate_question(self.quest.id, option.id)
+
+        self.assertEqual(build.call_count, 1)
+        first, second = [c.kwargs['messages'][0]['content'] for c in client.beta.prompt_caching.messages.create.call_args_list]
+        self.assertEqual(first[0], second[0])
+        self.assertEqual(first[0]['cache_control'], {'type': 'ephemeral'})
+        self.assertIn(f"ID: {self.category.id}", first[0]['text'])
+        self.assertIn('Previous selected option: "Go left"', first[1]['text'])
+        self.assertIn('Previous selected option: "Go right"', second[1]['text'])
+
+        # a changed category is in the prompt of the next question
+        self.category.name = 'Bravery'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.save()
+        self.assertIn('Bravery', prepare_question_generation(self.quest.id, self.options[0].id)['prompt_prefix'])
+
+        # also when it is changed by another process, which only drops the shared lookup tables
+        ScoreCategory.objects.filter(id=self.category.id).update(name='Wisdom')
+        cache.delete(get_lookups_key(self.quest.id))
+        self.assertIn('Wisdom', prepare_question_generation(self.quest.id, self.options[0].id)['prompt_prefix'])
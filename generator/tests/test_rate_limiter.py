@@ -0,0 +1,42 @@
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from utils import rate_limiter
+
+
+@override_settings(PROVIDER_RATE_LIMITS={'provider': {'requests_per_minute': 60, 'tokens_per_minute': 600}})
+class RateLimiterTest(TestCase):
+    def setUp(self):
+        self.backend = rate_limiter.LocalBucketBackend()
+        patcher = mock.patch.object(rate_limiter, 'get_backend', return_value=self.backend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_calls_wait_for_room_in_every_bucket(self):
+        for _ in range(3):
+            rate_limiter.acquire('provider', 'model', tokens=200, max_wait=0)
+
+        # the tokens bucket is empty while the requests bucket still has room
+        with self.assertRaises(rate_limiter.RateLimitExceeded):
+            rate_limiter.acquire('provider', 'model', tokens=100, max_wait=5)
+        # 10 tokens refill every second
+        wait = self.backend.take(rate_limiter.get_buckets('provider', 'model', 100))
+        self.assertAlmostEqual(wait, 10, delta=0.1)
+
+        # the response used fewer tokens than estimated, they are given back
+        rate_limiter.record_tokens('provider', 'model', -300)
+        rate_limiter.acquire('provider', 'model', tokens=250, max_wait=0)
+        # other models have their own buckets
+        rate_limiter.acquire('provider', 'other-model', tokens=600, max_wait=0)
+
+    def test_redis_script_is_registered_once(self):
+        redis_cache = mock.Mock()
+        script = redis_cache._cache.get_client.return_value.register_script.return_value
+        script.return_value = b'0'
+        backend = rate_limiter.RedisBucketBackend(redis_cache)
+
+        for _ in range(3):
+            self.assertEqual(backend.take(rate_limiter.get_buckets('provider', 'model', 10)), 0)
+        redis_cache._cache.get_client.return_value.register_script.assert_called_once_with(backend.TAKE_SCRIPT)
+        self.assertEqual(script.call_count, 3)
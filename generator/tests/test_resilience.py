@@ -0,0 +1,42 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from .base import ProviderError
+from utils import resilience
+
+
+@override_settings(CIRCUIT_BREAKER_FAILURES=3)
+class ResilienceTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(resilience.time, 'sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_retryable_errors_are_retried_with_backoff(self):
+        function = mock.Mock(side_effect=[ProviderError(529), ProviderError(429), 'response'])
+        self.assertEqual(resilience.call('provider', function, 'prompt'), 'response')
+        self.assertEqual(function.call_count, 3)
+        delays = [c.args[0] for c in self.sleep.call_args_list]
+        self.assertTrue(0 <= delays[0] <= 1 and 0 <= delays[1] <= 2)
+
+        # a bad request is not retried
+        function = mock.Mock(side_effect=ProviderError(400))
+        with self.assertRaises(ProviderError):
+            resilience.call('provider', function)
+        self.assertEqual(function.call_count, 1)
+
+    def test_circuit_opens_and_the_deadline_is_kept(self):
+        function = mock.Mock(side_effect=ProviderError(503))
+        with self.assertRaises(ProviderError):
+            resilience.call('provider', function, attempts=3)
+        with self.assertRaises(resilience.CircuitOpenError):
+            resilience.call('provider', function)
+        self.assertEqual(function.call_count, 3)
+
+        # the backoff would outlive the deadline, so it fails without sleeping
+        with mock.patch.object(resilience.random, 'uniform', return_value=5), resilience.deadline(0.5):
+            with self.assertRaises(resilience.DeadlineExceeded):
+                resilience.call('other-provider', mock.Mock(side_effect=[ProviderError(503), ProviderError(503), 'response']))
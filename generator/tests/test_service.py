@@ -0,0 +1,84 @@
+import json
+import threading
+import time
+from unittest import mock
+
+from django.db import connection
+
+from .base import QuestTestCase, QuestTransactionTestCase, claude_question_response
+from ..models import Question, Option
+from ..service import prepare_question_generation, save_generated_question, get_quest_question, generate_question_stream
+
+
+class GenerateQuestionConcurrencyTest(QuestTransactionTestCase):
+    def test_parallel_answers_on_same_option_call_claude_once(self):
+        num_of_requests = 5
+        claude_calls = []
+        results = []
+        errors = []
+
+        def slow_claude(prompt, **kwargs):
+            claude_calls.append(prompt)
+            time.sleep(1)
+            return claude_question_response(self.category.id)
+
+        def answer():
+            try:
+                results.append(get_quest_question(self.quest.id, self.options[0].id, 2))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        with mock.patch('generator.service.query_claude', side_effect=slow_claude), \
+             mock.patch('generator.service.QUESTION_LEASE_POLL_INTERVAL', 0.05):
+            threads = [threading.Thread(target=answer) for _ in range(num_of_requests)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(claude_calls), 1)
+        self.assertEqual(len({result['id'] for result in results}), 1)
+        self.assertEqual(Question.objects.filter(parent_option=self.options[0]).count(), 1)
+
+        self.options[0].refresh_from_db()
+        self.assertEqual(self.options[0].next_question_id, results[0]['id'])
+
+
+class GenerateQuestionTest(QuestTestCase):
+    def test_question_stored_meanwhile_wins_over_the_late_one(self):
+        generation = prepare_question_generation(self.quest.id, self.options[0].id)
+        # another worker stores its question while claude answers this one
+        stored_id = save_generated_question(
+            prepare_question_generation(self.quest.id, self.options[0].id), json.loads(claude_question_response(self.category.id))
+        )
+
+        question_id = save_generated_question(generation, json.loads(claude_question_response(self.category.id)))
+
+        self.assertEqual(question_id, stored_id)
+        self.assertEqual(Question.objects.filter(parent_option=self.options[0]).count(), 1)
+        self.assertEqual(Option.objects.filter(question_id=stored_id).count(), 2)
+
+    def test_question_text_is_streamed_before_the_question_is_saved(self):
+        # the first question of the quest is generated
+        self.question.delete()
+        response = claude_question_response(self.category.id)
+
+        def stream_claude(prompt, **kwargs):
+            for end in range(10, len(response) + 1, 10):
+                yield response[:end]
+            yield response
+
+        with mock.patch('generator.service.query_claude_stream', side_effect=stream_claude):
+            events = list(generate_question_stream(self.quest.id))
+
+        texts = [event['text'] for event in events if event['status'] == 'text']
+        self.assertGreater(len(texts), 1)
+        self.assertEqual(texts[-1], 'Generated question')
+        self.assertTrue(all('Generated question'.startswith(text) for text in texts))
+
+        self.assertEqual(events[-1]['status'], 'generated')
+        question = Question.objects.get(id=events[-1]['question_id'])
+        self.assertEqual(question.options.count(), 2)
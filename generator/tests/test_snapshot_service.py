@@ -0,0 +1,34 @@
+import json
+
+from django.core.cache import cache
+
+from .base import QuestTestCase, claude_question_response
+from ..snapshot_service import get_answer_from_snapshot, get_quest_id_of_question, get_quest_snapshot
+from ..service import prepare_question_generation, save_generated_question
+
+
+class QuestSnapshotTest(QuestTestCase):
+    def save_question(self, option):
+        with self.captureOnCommitCallbacks(execute=True):
+            return save_generated_question(
+                prepare_question_generation(self.quest.id, option.id), json.loads(claude_question_response(self.category.id))
+            )
+
+    def test_generated_questions_recompile_the_snapshot_once_per_interval(self):
+        first_id = self.save_question(self.options[0])
+        self.assertIn(first_id, get_quest_snapshot(self.quest.id)['questions'])
+
+        # the next nodes are left pending and answered from postgres meanwhile
+        second_id = self.save_question(self.options[1])
+        with self.assertNumQueries(0):
+            snapshot = get_quest_snapshot(self.quest.id)
+        self.assertNotIn(second_id, snapshot['questions'])
+        self.assertIsNone(get_answer_from_snapshot(self.question.id, self.options[1].id))
+
+        cache.delete(f"quest_snapshot_refreshed:{self.quest.id}")
+        self.assertIn(second_id, get_quest_snapshot(self.quest.id)['questions'])
+        self.assertEqual(get_answer_from_snapshot(self.question.id, self.options[1].id)['id'], second_id)
+        self.assertEqual(get_quest_id_of_question(second_id), self.quest.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_quest_id_of_question(second_id), self.quest.id)
+        self.assertIsNone(get_quest_id_of_question(second_id + 100))
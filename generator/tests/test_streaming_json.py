@@ -0,0 +1,56 @@
+import json
+
+from django.test import TestCase
+
+from utils.streaming_json import StreamingJsonParser, iter_array_items
+
+
+class StreamingJsonParserTest(TestCase):
+    DOCUMENT = {
+        'name': 'Sky "Pirates"\u00e9',
+        'rewards': [{'name': 'Sword', 'value': 1.5e3, 'rare': True}, {'name': 'Shield', 'tags': [], 'owner': None}],
+        'count': -2,
+    }
+
+    def test_items_are_emitted_as_they_complete(self):
+        text = json.dumps(self.DOCUMENT, indent=2)
+        for chunk_size in [1, 3, 7, len(text)]:
+            parser = StreamingJsonParser()
+            completed_at = {}
+            for start in range(0, len(text), chunk_size):
+                for path, value in parser.feed(text[start:start + chunk_size]):
+                    completed_at[path] = (start, value)
+
+            self.assertEqual(parser.close(), self.DOCUMENT)
+            self.assertEqual(completed_at[('rewards', 0)][1], self.DOCUMENT['rewards'][0])
+            # the first reward is available before the second one is written
+            self.assertLess(completed_at[('rewards', 0)][0], text.index('Shield') + 1)
+
+    def test_partial_strings(self):
+        def partial_string(text, path=('text',)):
+            parser = StreamingJsonParser()
+            parser.feed(text)
+            return parser.partial_string(path)
+
+        self.assertIsNone(partial_string('{"te'))
+        self.assertEqual(partial_string('{"text": "A dark \\"ca'), 'A dark "ca')
+        self.assertEqual(partial_string('{"text": "Line\\nTwo", "options": [{"text": "x"'), 'Line\nTwo')
+        self.assertEqual(partial_string('{"text": "Line", "options": [{"text": "x'), 'Line')
+        self.assertEqual(partial_string('{"text": "Line", "options": [{"text": "x', ('options', 0, 'text')), 'x')
+        # the key name inside an earlier value isn't taken for the key
+        self.assertEqual(partial_string('{"title": "the \\"text\\": field", "text": "Hi'), 'Hi')
+        # a surrogate pair is one character, an escape still being received is left for the next chunk
+        self.assertEqual(partial_string('{"text": "Hi \\ud83d\\ude00!'), 'Hi \U0001f600!')
+        self.assertEqual(partial_string('{"text": "Hi \\ud83d\\ude'), 'Hi ')
+        self.assertEqual(partial_string('{"text": "Hi \\u00'), 'Hi ')
+        # an invalid escape stops the text, the complete response won't parse either
+        self.assertEqual(partial_string('{"text": "Hi \\uzz12 there'), 'Hi ')
+        with self.assertRaises(ValueError):
+            partial_string('{"text": "Hi \\uzz12 \\n')
+
+    def test_claude_quirks(self):
+        chunks = ['{"image_descriptions": ["A cliff\nat dawn", "A ', 'cave", ]', '}']
+        self.assertEqual(list(iter_array_items(chunks, 'image_descriptions')), ['A cliff\nat dawn', 'A cave'])
+
+        with self.assertRaises(ValueError):
+            list(iter_array_items(['{"image_descriptions": ["A cliff"'], 'image_descriptions'))
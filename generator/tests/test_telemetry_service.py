@@ -0,0 +1,61 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from .base import ProviderError
+from ..models import ProviderCallLog
+from .. import provider_service, telemetry_service
+from utils import resilience
+from ..service import query_claude, generate_image
+
+
+class TelemetryTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(resilience.time, 'sleep')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @override_settings(CLAUDE_RESPONSE_CACHE_BYPASS=True)
+    def test_calls_are_stored_with_their_entity_and_cost(self):
+        message = mock.Mock(content=[mock.Mock(text='"a": 1}')], usage=mock.Mock(input_tokens=1000, output_tokens=200))
+        with mock.patch('generator.service.client') as client, telemetry_service.tag_entity('quest') as entity:
+            client.messages.create.side_effect = [ProviderError(529), message]
+            query_claude('prompt')
+            # the id of an entity created by the calls is known after them, the calls are stored once it is set
+            self.assertFalse(ProviderCallLog.objects.filter(entity_type='quest').exists())
+            entity['id'] = 7
+
+        openai_client = mock.Mock()
+        openai_client.images.generate.side_effect = ProviderError(400)
+        with mock.patch('generator.service.get_openai_client', return_value=openai_client), telemetry_service.tag_entity('quest', 7):
+            self.assertIsNone(generate_image('a castle'))
+
+        claude_call, image_call = ProviderCallLog.objects.filter(entity_type='quest').order_by('id')
+        self.assertEqual((claude_call.entity_type, claude_call.entity_id, claude_call.attempts), ('quest', 7, 2))
+        self.assertEqual((claude_call.input_tokens, claude_call.output_tokens), (1000, 200))
+        self.assertAlmostEqual(float(claude_call.cost), 0.006)
+        self.assertFalse(image_call.success)
+        self.assertEqual(float(image_call.cost), 0)
+
+        report = telemetry_service.get_cost_report(claude_call.created_at, entity_type='quest')
+        self.assertEqual(len(report), 1)
+        self.assertEqual((report[0]['calls'], report[0]['failed']), (2, 1))
+        self.assertEqual(report[0]['p95_ms'], max(claude_call.latency_ms, image_call.latency_ms))
+
+    @override_settings(PROVIDER_CONCURRENCY={'anthropic': 4, 'openai': 2, 'elevenlabs': 2, 'http': 10})
+    def test_calls_on_the_provider_loop_keep_the_entity(self):
+        async def generate(prompt, **kwargs):
+            return mock.Mock(data=[mock.Mock(url='https://images/image.png')])
+
+        openai_client = mock.Mock()
+        openai_client.images.generate = generate
+        with mock.patch.object(provider_service, 'get_client', return_value=openai_client), \
+                mock.patch.object(provider_service, 'upload_image_from_url', side_effect=lambda url, path: f"s3/{path}"), \
+                telemetry_service.tag_entity('universe', 3):
+            provider_service.generate_and_upload_images([('a', 'path/a'), ('b', 'path/b')])
+
+        logs = ProviderCallLog.objects.filter(entity_type='universe')
+        self.assertEqual(list(logs.values_list('entity_id', 'operation', 'units')), [(3, 'image', 1)] * 2)
+        self.assertAlmostEqual(float(sum(log.cost for log in logs)), 0.08)
@@ -1,4 +1,5 @@
 from .service import *
+from .provider_service import generate_and_upload_images
 
 
 def generate_universe_thumbnail_image(universe_id):
@@ -27,7 +28,7 @@ def generate_universe_thumbnail_image(universe_id):
         image_url = upload_image_from_url(image_url, f"universe/{universe.id}")
 
     universe.thumbnail = image_url
-    universe.save()
+    universe.save(update_fields=['thumbnail'])
     return image_url
 
 
@@ -35,9 +36,10 @@ def generate_universe_assets(universe_id):
     '''
     generates images/audio/video for universe
     '''
-    generate_universe_thumbnail_image(universe_id)
+    with tag_entity('universe', universe_id):
+        generate_universe_thumbnail_image(universe_id)
 
-    generate_image_for_character_in_universe(universe_id)
+        generate_image_for_character_in_universe(universe_id)
 
     return {'status': 'completed'}
 
@@ -47,12 +49,10 @@ def generate_image_for_character_in_universe(universe_id):
     generates images for the main characters in the given universe
     '''
     universe = Universe.objects.get(pk=universe_id)
-    chatacters = Character.objects.filter(universe=universe)
+    chatacters = [c for c in Character.objects.filter(universe=universe) if not c.image_path]
 
+    jobs = []
     for i in chatacters:
-        if i.image_path:
-            continue
-
         prompt = f"""
         Create an image for the character: "{i.name}" in the universe: "{universe.universe_name}".
         The character has the following description: {i.description}.
@@ -61,11 +61,10 @@ def generate_image_for_character_in_universe(universe_id):
         The universe description is as follows: {universe.description}.
         Do not add any text to the image. The image should be visually appealing and should represent the character.
         """
+        jobs.append((prompt, f"universe/{universe.id}/character/{i.id}"))
 
-        image_url = generate_image(prompt)
-
-        if image_url:
-            image_url = upload_image_from_url(image_url, f"universe/{universe.id}/character/{i.id}")
-
+    # the character images are generated concurrently
+    image_urls = generate_and_upload_images(jobs)
+    for i, image_url in zip(chatacters, image_urls):
         i.image_path = image_url
         i.save()
\ No newline at end of file
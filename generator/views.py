@@ -30,23 +30,10 @@ class QuestViewSet(viewsets.ModelViewSet):
 class QuestionViewSet(viewsets.ModelViewSet):
     authentication_classes = ()
     permission_classes = ()
-    queryset = Question.objects.all()
+    # the characters (with their images) come from the quest's character index, see QuestionSerializer
+    queryset = Question.objects.prefetch_related('options')
     serializer_class = QuestionSerializer
 
-    # override the get to add the character images to the response
-    def get(self, request, *args, **kwargs):
-        response = super().get(request, *args, **kwargs)
-        for question in response.data:
-            for character in question['characters']:
-                # images of the character are in the quest's main_character field in the format as below
-                # [{'name': 'character1', 'role': 'role1', 'image': 'image1'}, {'name': 'character2', 'role': 'role2', 'image': 'image2'}]
-                for main_character in question['main_characters']:
-                    if main_character['name'] == character['name']:
-                        character
-                        character['image'] = main_character['image']
-                        break
-        return response
-
 class OptionViewSet(viewsets.ModelViewSet):
     authentication_classes = ()
     permission_classes = ()
@@ -41,6 +41,132 @@ ALLOWED_HOSTS = []
 
 CELERY_BROKER_URL=f"{os.getenv('REDIS_PROTOCOL_CELERY', 'rediss')}://{os.getenv('REDIS_CELERY_HOST', 'localhost')}:6379/1"
 CELERY_TIMEZONE = 'Asia/Kolkata'
+# chords (the asset jobs of generator/asset_job_service.py) need the results of their header tasks
+CELERY_RESULT_BACKEND=f"{os.getenv('REDIS_PROTOCOL_CELERY', 'rediss')}://{os.getenv('REDIS_CELERY_HOST', 'localhost')}:6379/3"
+CELERY_RESULT_EXPIRES = 60 * 60 * 24
+
+# Shared cache used for cross-worker counters and leases. Falls back to the
+# process local cache when no redis host is configured (local development).
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+if os.getenv('REDIS_CACHE_HOST'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': f"{os.getenv('REDIS_PROTOCOL_CACHE', 'rediss')}://{os.getenv('REDIS_CACHE_HOST')}:6379/2",
+    }
+
+# Gameplay progress buffered before it is written to the database (game_interface/gameplay_service.py).
+# It is the only copy of the progress till it is flushed: REDIS_GAMEPLAY_HOST must be a redis with
+# persistence (AOF) and maxmemory-policy noeviction. Without it the progress is written to the database
+# on every answer.
+if os.getenv('REDIS_GAMEPLAY_HOST'):
+    CACHES['gameplay'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': f"{os.getenv('REDIS_PROTOCOL_GAMEPLAY', 'rediss')}://{os.getenv('REDIS_GAMEPLAY_HOST')}:6379/0",
+        'TIMEOUT': None,
+    }
+
+# Speculative generation of child questions while the player reads the current one.
+# QUEST_LOOKAHEAD_DEPTH is the number of levels generated below the served question,
+# QUEST_LOOKAHEAD_BUDGET caps the speculative generations per quest in each window.
+QUEST_LOOKAHEAD_DEPTH           = int(os.getenv('QUEST_LOOKAHEAD_DEPTH', 1))
+QUEST_LOOKAHEAD_BUDGET          = int(os.getenv('QUEST_LOOKAHEAD_BUDGET', 50))
+QUEST_LOOKAHEAD_BUDGET_WINDOW   = int(os.getenv('QUEST_LOOKAHEAD_BUDGET_WINDOW', 60 * 60))
+
+# Breadth-first pre-generation of whole quest trees (generator/quest_tree_service.py), at most
+# QUEST_TREE_MAX_NODES questions per run with QUEST_TREE_CONCURRENCY claude calls at a time.
+QUEST_TREE_MAX_NODES            = int(os.getenv('QUEST_TREE_MAX_NODES', 200))
+QUEST_TREE_CONCURRENCY          = int(os.getenv('QUEST_TREE_CONCURRENCY', 4))
+
+# Serve already generated questions from the compiled quest snapshot (generator/snapshot_service.py)
+QUEST_SNAPSHOT_ENABLED          = Bool(os.getenv('QUEST_SNAPSHOT_ENABLED', True))
+
+# Responses of claude cached by model, max_tokens and prompt (generator/claude_cache_service.py).
+# CLAUDE_RESPONSE_CACHE_BACKEND is 'django', 'sqlite' or 'none', the sqlite store keeps at most
+# CLAUDE_RESPONSE_CACHE_MAX_ENTRIES responses and evicts the least recently used.
+CLAUDE_RESPONSE_CACHE_BACKEND       = os.getenv('CLAUDE_RESPONSE_CACHE_BACKEND', 'django')
+CLAUDE_RESPONSE_CACHE_TTL           = int(os.getenv('CLAUDE_RESPONSE_CACHE_TTL', 60 * 60 * 24 * 7))
+CLAUDE_RESPONSE_CACHE_MAX_ENTRIES   = int(os.getenv('CLAUDE_RESPONSE_CACHE_MAX_ENTRIES', 10000))
+CLAUDE_RESPONSE_CACHE_PATH          = os.getenv('CLAUDE_RESPONSE_CACHE_PATH', os.path.join(BASE_DIR, 'claude_cache.sqlite3'))
+CLAUDE_RESPONSE_CACHE_BYPASS        = Bool(os.getenv('CLAUDE_RESPONSE_CACHE_BYPASS', False))
+
+# Concurrent calls per provider made by the shared provider loop (generator/provider_service.py),
+# in each process. Asset generation fans out up to this many image/audio requests at a time.
+PROVIDER_CONCURRENCY = {
+    'openai'        : int(os.getenv('OPENAI_CONCURRENCY', 5)),
+    'elevenlabs'    : int(os.getenv('ELEVENLABS_CONCURRENCY', 2)),
+    'http'          : int(os.getenv('HTTP_DOWNLOAD_CONCURRENCY', 10)),
+}
+
+# Requests and tokens per minute sent to each provider by all workers together (utils/rate_limiter.py).
+# '<provider>:<model>' entries override the provider entry for that model. Calls wait for room
+# in the buckets for at most PROVIDER_RATE_LIMIT_MAX_WAIT seconds.
+PROVIDER_RATE_LIMITS = {
+    'anthropic'                 : {
+        'requests_per_minute'   : int(os.getenv('ANTHROPIC_RPM', 50)),
+        'tokens_per_minute'     : int(os.getenv('ANTHROPIC_TPM', 80000)),
+    },
+    'openai'                    : {'requests_per_minute': int(os.getenv('OPENAI_RPM', 500))},
+    'openai:dall-e-3'           : {'requests_per_minute': int(os.getenv('DALLE_IMAGES_PER_MINUTE', 15))},
+    'elevenlabs'                : {'requests_per_minute': int(os.getenv('ELEVENLABS_RPM', 60))},
+}
+PROVIDER_RATE_LIMIT_MAX_WAIT    = int(os.getenv('PROVIDER_RATE_LIMIT_MAX_WAIT', 120))
+
+# Retries of failed provider calls and circuit breakers of the providers (utils/resilience.py).
+# Retryable failures wait PROVIDER_RETRY_BASE_DELAY * 2^attempt seconds at most (with jitter).
+# A provider failing CIRCUIT_BREAKER_FAILURES times within CIRCUIT_BREAKER_WINDOW seconds is not
+# called for CIRCUIT_BREAKER_COOLDOWN seconds.
+PROVIDER_RETRY_ATTEMPTS         = int(os.getenv('PROVIDER_RETRY_ATTEMPTS', 4))
+PROVIDER_RETRY_BASE_DELAY       = float(os.getenv('PROVIDER_RETRY_BASE_DELAY', 1))
+PROVIDER_RETRY_MAX_DELAY        = float(os.getenv('PROVIDER_RETRY_MAX_DELAY', 30))
+CIRCUIT_BREAKER_FAILURES        = int(os.getenv('CIRCUIT_BREAKER_FAILURES', 5))
+CIRCUIT_BREAKER_WINDOW          = int(os.getenv('CIRCUIT_BREAKER_WINDOW', 60))
+CIRCUIT_BREAKER_COOLDOWN        = int(os.getenv('CIRCUIT_BREAKER_COOLDOWN', 30))
+
+# Seconds a player waits for a question generated during the request, retries included
+QUESTION_GENERATION_DEADLINE    = int(os.getenv('QUESTION_GENERATION_DEADLINE', 90))
+
+# Seconds the recommendations assistant run is polled for before it is cancelled (user/service.py)
+RECOMMENDATION_RUN_DEADLINE     = int(os.getenv('RECOMMENDATION_RUN_DEADLINE', 120))
+
+# Seconds between the writes of the gameplay progress buffered in the 'gameplay' cache (see CACHES)
+# by the flush task (game_interface/gameplay_service.py)
+GAMEPLAY_FLUSH_INTERVAL         = int(os.getenv('GAMEPLAY_FLUSH_INTERVAL', 30))
+
+# Message batches of bulk generation (generator/batch_service.py). GENERATION_BATCH_BACKEND is
+# 'anthropic' or 'fake' (tests only: in-process, every batch ends at once), ended batches are stored every
+# GENERATION_BATCH_POLL_INTERVAL seconds.
+GENERATION_BATCH_BACKEND        = os.getenv('GENERATION_BATCH_BACKEND', 'anthropic')
+GENERATION_BATCH_POLL_INTERVAL  = int(os.getenv('GENERATION_BATCH_POLL_INTERVAL', 5 * 60))
+
+# GENERATION_PROVIDER_BACKEND 'fake' answers the claude, openai, elevenlabs and s3 calls locally
+# (generator/fake_provider_service.py) to benchmark the generation pipeline. A fake call takes a
+# lognormal latency around 'latency' seconds and fails with 'error_status' for 'error_rate' of the calls.
+GENERATION_PROVIDER_BACKEND     = os.getenv('GENERATION_PROVIDER_BACKEND', 'live')
+FAKE_PROVIDER_LATENCY_SCALE     = float(os.getenv('FAKE_PROVIDER_LATENCY_SCALE', 1))
+FAKE_PROVIDER_ERROR_RATE        = float(os.getenv('FAKE_PROVIDER_ERROR_RATE', 0))
+FAKE_PROVIDER_SEED              = int(os.getenv('FAKE_PROVIDER_SEED', 0))
+FAKE_PROVIDERS = {
+    'anthropic'     : {'latency': 8 * FAKE_PROVIDER_LATENCY_SCALE, 'latency_sigma': 0.5, 'error_rate': FAKE_PROVIDER_ERROR_RATE, 'error_status': 529},
+    'openai'        : {'latency': 12 * FAKE_PROVIDER_LATENCY_SCALE, 'latency_sigma': 0.3, 'error_rate': FAKE_PROVIDER_ERROR_RATE, 'error_status': 503},
+    'elevenlabs'    : {'latency': 5 * FAKE_PROVIDER_LATENCY_SCALE, 'latency_sigma': 0.4, 'error_rate': FAKE_PROVIDER_ERROR_RATE, 'error_status': 503},
+    's3'            : {'latency': 0.1 * FAKE_PROVIDER_LATENCY_SCALE, 'latency_sigma': 0.3},
+    'http'          : {'latency': 0.2 * FAKE_PROVIDER_LATENCY_SCALE, 'latency_sigma': 0.3},
+}
+
+CELERY_BEAT_SCHEDULE = {
+    'flush-gameplay-buffer': {
+        'task'      : 'game_interface.tasks.flush_gameplay_buffer_task',
+        'schedule'  : GAMEPLAY_FLUSH_INTERVAL,
+    },
+    'poll-generation-batches': {
+        'task'      : 'generator.tasks.poll_generation_batches_task',
+        'schedule'  : GENERATION_BATCH_POLL_INTERVAL,
+    },
+}
 
 # Application definition
 
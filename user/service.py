@@ -11,6 +11,8 @@ from structlog import get_logger
 from .models import User,UserProfile,ContentRecommendation
 from generator.models import AudioStory, ShortVideos
 from generator.serializers import AudioStorySerializer, ShortVideosSerializer
+from generator.telemetry_service import tag_entity, track_call
+from utils.resilience import DeadlineExceeded, deadline, get_remaining_time
 
 OPEN_AI_API_KEY = settings.OPEN_AI_API_KEY 
 client = OpenAI(api_key= OPEN_AI_API_KEY)
@@ -169,29 +171,39 @@ def create_recommendations_by_username(username: str):
                 role="user",
                 content=[{"type": "text", "text": user_prompt}]
         )
-        run = client.beta.threads.runs.create(
-            thread_id=thread_id,
-                assistant_id="asst_ZLmfSP2ijfikLBrbaQhwVVqQ"
-            ) 
+        with tag_entity('user', user_id), track_call('openai', None, 'assistant_run') as record, deadline(settings.RECOMMENDATION_RUN_DEADLINE):
+            run = client.beta.threads.runs.create(
+                thread_id=thread_id,
+                    assistant_id="asst_ZLmfSP2ijfikLBrbaQhwVVqQ"
+                ) 
         
-        logger.info("Run started", extra={"run_id": run.id, "thread_id": thread_id})  
-        recommendation=[] 
-        while True:
-            time.sleep(5)
-            run_status = client.beta.threads.runs.retrieve(
-                            thread_id=thread_id,
-                            run_id=run.id
-                        )
-            if run_status.status == 'completed':
-                messages        = client.beta.threads.messages.list(thread_id=thread_id)
-                latest_message  = messages.data[0] 
-                raw_string      = latest_message.content[0].text.value if latest_message.content[0].text.value else ''
-                cleaned_string  = re.sub(r'```json\n|\n```', '', raw_string)
-                cleaned_string  = json.loads(cleaned_string)
-                recommendations = cleaned_string['recommendations']
-                for recommendation in recommendations:
-                    save_content_recommendation(user_id, recommendation['content_id'], recommendation['content_type'])
-                return recommendations
+            logger.info("Run started", extra={"run_id": run.id, "thread_id": thread_id})  
+            recommendation=[] 
+            while True:
+                if not get_remaining_time():
+                    # an active run keeps the thread from taking the next messages
+                    client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run.id)
+                    raise DeadlineExceeded(f"Recommendation run {run.id} not completed within {settings.RECOMMENDATION_RUN_DEADLINE}s")
+                time.sleep(min(5, get_remaining_time()))
+                run_status = client.beta.threads.runs.retrieve(
+                                thread_id=thread_id,
+                                run_id=run.id
+                            )
+                if run_status.status in ('failed', 'cancelled', 'expired', 'incomplete'):
+                    raise Exception(f"Recommendation run {run.id} ended with status {run_status.status}")
+                if run_status.status == 'completed':
+                    record.model = run_status.model
+                    if run_status.usage:
+                        record.set_usage(run_status.usage.prompt_tokens, run_status.usage.completion_tokens)
+                    messages        = client.beta.threads.messages.list(thread_id=thread_id)
+                    latest_message  = messages.data[0] 
+                    raw_string      = latest_message.content[0].text.value if latest_message.content[0].text.value else ''
+                    cleaned_string  = re.sub(r'```json\n|\n```', '', raw_string)
+                    cleaned_string  = json.loads(cleaned_string)
+                    recommendations = cleaned_string['recommendations']
+                    for recommendation in recommendations:
+                        save_content_recommendation(user_id, recommendation['content_id'], recommendation['content_type'])
+                    return recommendations
     except Exception as e:  
         logger.error("Error getting recommendations: %s", e)
         return []
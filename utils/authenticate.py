@@ -46,6 +46,17 @@ class CustomAuthentication(JWTAuthentication):
         return self.get_user(validated_token), validated_token
 
 
+class OptionalCustomAuthentication(CustomAuthentication):
+    '''
+    authenticates the user when a valid token is sent, lets the request through as anonymous otherwise
+    '''
+    def authenticate(self, request):
+        try:
+            return super().authenticate(request)
+        except AuthenticationFailed:
+            return None
+
+
 class APITokenAuthentication(authentication.BaseAuthentication):
     def authenticate(self, request):
         auth_token = request.headers.get('Authorization') or request.META.get('HTTP_AUTHORIZATION') or request.headers.get('auth_token') or None
@@ -0,0 +1,209 @@
+'''
+Token buckets limiting the requests and tokens per minute sent to the generation providers,
+shared by every worker through redis.
+
+The limits of a call are PROVIDER_RATE_LIMITS['<provider>:<model>'], else PROVIDER_RATE_LIMITS['<provider>'],
+with a 'requests_per_minute' and an optional 'tokens_per_minute'. Each (provider, model) has its own
+buckets, which refill continuously up to the per minute limit. acquire waits until every bucket of the
+call has room and takes from all of them at once.
+
+The buckets live in redis (updated by a lua script, so workers never race) when the default cache
+is redis, else in process memory (local development and tests).
+'''
+import asyncio
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+from structlog import get_logger
+
+from utils.resilience import get_remaining_time
+
+logger = get_logger()
+
+
+class RateLimitExceeded(Exception):
+    pass
+
+
+class LocalBucketBackend:
+    def __init__(self):
+        self.buckets    = {}     # key -> (level, updated)
+        self.lock       = threading.Lock()
+
+    def take(self, buckets, force=False):
+        '''
+        takes the amounts from the [(key, capacity, rate, amount)] buckets if all of them have room,
+        returns 0 when taken, else the seconds to wait for the room. force takes even without room
+        '''
+        now = time.monotonic()
+        with self.lock:
+            wait = 0
+            levels = []
+            for key, capacity, rate, amount in buckets:
+                level, updated = self.buckets.get(key, (capacity, now))
+                level = min(capacity, level + (now - updated) * rate)
+                levels.append(level)
+                if not force:
+                    # a call larger than the bucket goes through once the bucket is full
+                    wait = max(wait, (min(amount, capacity) - level) / rate)
+            if wait > 0:
+                return wait
+
+            for (key, capacity, rate, amount), level in zip(buckets, levels):
+                self.buckets[key] = (min(capacity, level - amount), now)
+            return 0
+
+
+class RedisBucketBackend:
+    # KEYS are the buckets, ARGV is force followed by capacity, rate and amount of each bucket
+    TAKE_SCRIPT = '''
+    local time = redis.call('TIME')
+    local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+    local force = ARGV[1] == '1'
+    local wait = 0
+    local levels = {}
+    for i, key in ipairs(KEYS) do
+        local capacity = tonumber(ARGV[i * 3 - 1])
+        local rate = tonumber(ARGV[i * 3])
+        local amount = tonumber(ARGV[i * 3 + 1])
+        local state = redis.call('HMGET', key, 'level', 'updated')
+        local level = tonumber(state[1]) or capacity
+        local updated = tonumber(state[2]) or now
+        level = math.min(capacity, level + math.max(now - updated, 0) * rate)
+        levels[i] = level
+        if not force then
+            wait = math.max(wait, (math.min(amount, capacity) - level) / rate)
+        end
+    end
+    if wait > 0 then
+        return tostring(wait)
+    end
+    for i, key in ipairs(KEYS) do
+        local capacity = tonumber(ARGV[i * 3 - 1])
+        local rate = tonumber(ARGV[i * 3])
+        local amount = tonumber(ARGV[i * 3 + 1])
+        redis.call('HSET', key, 'level', tostring(math.min(capacity, levels[i] - amount)), 'updated', tostring(now))
+        redis.call('EXPIRE', key, math.ceil(capacity / rate) + 60)
+    end
+    return '0'
+    '''
+
+    def __init__(self, redis_cache):
+        self.redis_cache    = redis_cache
+        self.take_script    = None
+
+    def take(self, buckets, force=False):
+        client = self.redis_cache._cache.get_client(write=True)
+        if self.take_script is None:
+            # registered once, the script is then run by its sha (and loaded again if redis lost it)
+            self.take_script = client.register_script(self.TAKE_SCRIPT)
+        keys = [key for key, _, _, _ in buckets]
+        args = ['1' if force else '0']
+        for _, capacity, rate, amount in buckets:
+            args += [capacity, rate, amount]
+        return float(self.take_script(keys=keys, args=args, client=client))
+
+
+_local_backend = LocalBucketBackend()
+_redis_backend = None
+
+
+def get_backend():
+    global _redis_backend
+    cache = caches['default']
+    if not isinstance(cache, RedisCache):
+        return _local_backend
+    if _redis_backend is None:
+        _redis_backend = RedisBucketBackend(cache)
+    return _redis_backend
+
+
+def get_limits(provider, model=None):
+    return settings.PROVIDER_RATE_LIMITS.get(f"{provider}:{model}") or settings.PROVIDER_RATE_LIMITS.get(provider) or {}
+
+
+def get_buckets(provider, model, tokens):
+    '''
+    returns the [(key, capacity, rate, amount)] buckets of a call of the provider and model
+    '''
+    limits = get_limits(provider, model)
+    buckets = []
+    if limits.get('requests_per_minute'):
+        capacity = limits['requests_per_minute']
+        buckets.append((f"rate_limit:{provider}:{model}:requests", capacity, capacity / 60, 1))
+    if limits.get('tokens_per_minute') and tokens:
+        capacity = limits['tokens_per_minute']
+        buckets.append((f"rate_limit:{provider}:{model}:tokens", capacity, capacity / 60, tokens))
+    return buckets
+
+
+def estimate_tokens(text):
+    '''
+    rough number of tokens of the text, about 4 characters per token
+    '''
+    return math.ceil(len(text) / 4)
+
+
+def get_wait(provider, model, tokens, waited, max_wait):
+    '''
+    takes from the buckets of the call, returns the seconds to wait before trying again (0 when taken)
+    '''
+    buckets = get_buckets(provider, model, tokens)
+    if not buckets:
+        return 0
+
+    wait = get_backend().take(buckets)
+    if wait and waited + wait > max_wait:
+        raise RateLimitExceeded(f"Rate limit of {provider} {model or ''} not available within {max_wait}s")
+    if wait:
+        logger.info("Waiting for provider rate limit", provider=provider, model=model, wait=round(wait, 2))
+    return wait
+
+
+def get_max_wait(max_wait):
+    max_wait = settings.PROVIDER_RATE_LIMIT_MAX_WAIT if max_wait is None else max_wait
+    remaining = get_remaining_time()
+    return max_wait if remaining is None else min(max_wait, remaining)
+
+
+def acquire(provider, model=None, tokens=0, max_wait=None):
+    '''
+    blocks until a call of tokens to the provider and model is within its limits.
+    raises RateLimitExceeded when that takes more than max_wait seconds (or past the deadline)
+    '''
+    max_wait = get_max_wait(max_wait)
+    waited = 0
+    while True:
+        wait = get_wait(provider, model, tokens, waited, max_wait)
+        if not wait:
+            return
+        time.sleep(wait)
+        waited += wait
+
+
+async def acquire_async(provider, model=None, tokens=0, max_wait=None):
+    '''
+    acquire for coroutines, waits without blocking the event loop
+    '''
+    max_wait = get_max_wait(max_wait)
+    waited = 0
+    while True:
+        wait = await asyncio.to_thread(get_wait, provider, model, tokens, waited, max_wait)
+        if not wait:
+            return
+        await asyncio.sleep(wait)
+        waited += wait
+
+
+def record_tokens(provider, model, tokens):
+    '''
+    corrects the tokens bucket once the real usage of a call is known, tokens being the
+    difference with the estimate taken by acquire (negative gives tokens back)
+    '''
+    buckets = [bucket for bucket in get_buckets(provider, model, tokens) if bucket[0].endswith(':tokens')]
+    if buckets:
+        get_backend().take(buckets, force=True)
@@ -0,0 +1,222 @@
+'''
+Retries and circuit breakers of the provider calls.
+
+call(provider, function, ...) runs the function and retries it when it fails with a retryable
+error (timeouts, connection errors, 408/409/429 and 5xx responses) after an exponential backoff
+with full jitter, or the retry-after of the provider. Other errors (bad request, auth, content
+policy) are raised at once.
+
+with deadline(seconds): bounds every call made inside it, retries and rate limit waits included,
+so a request thread gives up instead of sleeping through the retries of a slow provider.
+
+Each provider has a circuit breaker shared by the workers through the cache: after
+CIRCUIT_BREAKER_FAILURES failures within CIRCUIT_BREAKER_WINDOW seconds the provider is not called
+for CIRCUIT_BREAKER_COOLDOWN seconds and calls fail with CircuitOpenError. After the cooldown one
+more failure opens it again, a success closes it.
+'''
+import asyncio
+import contextvars
+import random
+import time
+from contextlib import contextmanager
+
+import anthropic
+import httpx
+import openai
+from django.conf import settings
+from django.core.cache import cache
+from structlog import get_logger
+
+logger = get_logger()
+
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+_deadline = contextvars.ContextVar('provider_deadline', default=None)
+_attempts = contextvars.ContextVar('provider_attempts', default=None)
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+@contextmanager
+def deadline(seconds):
+    '''
+    bounds the provider calls made inside the block to seconds from now (or the enclosing deadline
+    when it is sooner)
+    '''
+    deadline_at = time.monotonic() + seconds
+    if _deadline.get() is not None:
+        deadline_at = min(deadline_at, _deadline.get())
+    token = _deadline.set(deadline_at)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def get_remaining_time():
+    '''
+    returns the seconds left before the deadline, None when there is no deadline
+    '''
+    deadline_at = _deadline.get()
+    if deadline_at is None:
+        return None
+    return max(deadline_at - time.monotonic(), 0)
+
+
+def get_timeout(default):
+    '''
+    returns the timeout of a single provider request, default capped by the deadline
+    '''
+    remaining = get_remaining_time()
+    return default if remaining is None else min(default, remaining)
+
+
+@contextmanager
+def count_attempts():
+    '''
+    counts the attempts of the calls made inside the block, yields the counter {'attempts': n}
+    '''
+    counter = {'attempts': 0}
+    token = _attempts.set(counter)
+    try:
+        yield counter
+    finally:
+        _attempts.reset(token)
+
+
+def add_attempt():
+    counter = _attempts.get()
+    if counter is not None:
+        counter['attempts'] += 1
+
+
+def get_status_code(error):
+    status_code = getattr(error, 'status_code', None)
+    if status_code is None:
+        status_code = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status_code if isinstance(status_code, int) else None
+
+
+def is_retryable(error):
+    if isinstance(error, (
+        anthropic.APIConnectionError, openai.APIConnectionError, httpx.TransportError, ConnectionError, TimeoutError
+    )) and not isinstance(error, DeadlineExceeded):
+        return True
+    status_code = get_status_code(error)
+    return status_code is not None and (status_code in RETRYABLE_STATUS_CODES or status_code >= 500)
+
+
+def get_retry_after(error):
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    try:
+        return float(headers.get('retry-after')) if headers else None
+    except (TypeError, ValueError):
+        return None
+
+
+def get_backoff(attempt, error=None):
+    '''
+    returns the seconds to wait before the retry after the attempt (0 based)
+    '''
+    retry_after = get_retry_after(error)
+    if retry_after is not None:
+        return min(retry_after, settings.PROVIDER_RETRY_MAX_DELAY)
+    return random.uniform(0, min(settings.PROVIDER_RETRY_MAX_DELAY, settings.PROVIDER_RETRY_BASE_DELAY * 2 ** attempt))
+
+
+def get_failures_key(provider):
+    return f"circuit:{provider}:failures"
+
+
+def get_open_key(provider):
+    return f"circuit:{provider}:open"
+
+
+def check_circuit(provider):
+    if cache.get(get_open_key(provider)):
+        raise CircuitOpenError(f"{provider} is failing, not called for {settings.CIRCUIT_BREAKER_COOLDOWN}s")
+
+
+def record_failure(provider):
+    failures_key = get_failures_key(provider)
+    if cache.add(failures_key, 1, timeout=settings.CIRCUIT_BREAKER_WINDOW):
+        failures = 1
+    else:
+        try:
+            failures = cache.incr(failures_key)
+        except ValueError:
+            failures = 1
+            cache.add(failures_key, 1, timeout=settings.CIRCUIT_BREAKER_WINDOW)
+
+    if failures >= settings.CIRCUIT_BREAKER_FAILURES:
+        logger.error("Opening circuit of provider", provider=provider, failures=failures)
+        cache.set(get_open_key(provider), True, timeout=settings.CIRCUIT_BREAKER_COOLDOWN)
+        # half open after the cooldown: the next failure opens the circuit again
+        cache.set(failures_key, settings.CIRCUIT_BREAKER_FAILURES - 1, timeout=settings.CIRCUIT_BREAKER_WINDOW + settings.CIRCUIT_BREAKER_COOLDOWN)
+
+
+def record_success(provider):
+    cache.delete(get_failures_key(provider))
+
+
+def get_retry_delay(provider, error, attempt, attempts):
+    '''
+    returns the seconds to wait before retrying after the failed attempt, raises when not retrying
+    '''
+    if not is_retryable(error):
+        raise error
+    record_failure(provider)
+    if attempt + 1 >= attempts:
+        raise error
+
+    delay = get_backoff(attempt, error)
+    remaining = get_remaining_time()
+    if remaining is not None and delay >= remaining:
+        raise DeadlineExceeded(f"Deadline reached while retrying {provider}") from error
+
+    logger.info("Retrying provider call", provider=provider, attempt=attempt + 1, delay=round(delay, 2), er=error)
+    return delay
+
+
+def call(provider, function, *args, attempts=None, **kwargs):
+    '''
+    returns function(*args, **kwargs), retrying it on retryable errors
+    '''
+    attempts = attempts or settings.PROVIDER_RETRY_ATTEMPTS
+    for attempt in range(attempts):
+        check_circuit(provider)
+        if get_remaining_time() == 0:
+            raise DeadlineExceeded(f"Deadline reached before calling {provider}")
+        add_attempt()
+        try:
+            result = function(*args, **kwargs)
+        except Exception as e:
+            time.sleep(get_retry_delay(provider, e, attempt, attempts))
+            continue
+        record_success(provider)
+        return result
+
+
+async def call_async(provider, function, *args, attempts=None, **kwargs):
+    '''
+    call for coroutine functions, waits between the attempts without blocking the event loop
+    '''
+    attempts = attempts or settings.PROVIDER_RETRY_ATTEMPTS
+    for attempt in range(attempts):
+        await asyncio.to_thread(check_circuit, provider)
+        if get_remaining_time() == 0:
+            raise DeadlineExceeded(f"Deadline reached before calling {provider}")
+        add_attempt()
+        try:
+            result = await function(*args, **kwargs)
+        except Exception as e:
+            await asyncio.sleep(await asyncio.to_thread(get_retry_delay, provider, e, attempt, attempts))
+            continue
+        await asyncio.to_thread(record_success, provider)
+        return result
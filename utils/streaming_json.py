@@ -0,0 +1,180 @@
+'''
+Incremental parsing of a json document received in chunks, e.g. a streamed claude response.
+
+The parser emits (path, value) for every value as soon as it is complete, path being the keys and
+indexes from the root: in {"rewards": [{"name": "a"}, ...]} the first reward is emitted as
+(('rewards', 0), {'name': 'a'}) once its closing brace arrives, while the rest of the response is
+still being written. The root is emitted last with the path ().
+
+partial_string(path) returns the part of a string value received so far, e.g. to show the text of
+a question while claude is still writing it.
+
+Strings may contain raw newlines and tabs, which claude sometimes writes inside long values.
+'''
+import json
+
+LITERAL_CHARS = set('0123456789+-.eEtruefalsn')
+WHITESPACE = set(' \t\r\n')
+
+
+class StreamingJsonParser:
+    def __init__(self):
+        self.stack      = []        # [container, path, key] of the open objects and arrays
+        self.token      = None      # 'string' or 'literal' while a scalar is being read
+        self.buffer     = []
+        self.escaped    = False
+        self.done       = False
+        self.value      = None
+
+    def feed(self, text):
+        '''
+        parses the next chunk of the document, returns the [(path, value)] completed by it
+        '''
+        events = []
+        for char in text:
+            if self.done:
+                break
+
+            if self.token == 'string':
+                self.read_string(char, events)
+                continue
+            if self.token == 'literal':
+                if char in LITERAL_CHARS:
+                    self.buffer.append(char)
+                    continue
+                self.end_literal(events)
+
+            if char in WHITESPACE or char in ':,':
+                continue
+            if char == '"':
+                self.token = 'string'
+                self.buffer = []
+            elif char in '{[':
+                self.stack.append([{} if char == '{' else [], self.get_child_path(), None])
+            elif char in '}]':
+                if not self.stack:
+                    raise ValueError(f"Unexpected {char} in json")
+                container, _, _ = self.stack.pop()
+                self.complete(container, events)
+            elif char in LITERAL_CHARS:
+                self.token = 'literal'
+                self.buffer = [char]
+            else:
+                raise ValueError(f"Unexpected {char} in json")
+        return events
+
+    def read_string(self, char, events):
+        if self.escaped:
+            self.escaped = False
+        elif char == '\\':
+            self.escaped = True
+        elif char == '"':
+            self.token = None
+            self.complete(json.loads('"' + ''.join(self.buffer) + '"', strict=False), events)
+            return
+        self.buffer.append(char)
+
+    def end_literal(self, events):
+        self.token = None
+        self.complete(json.loads(''.join(self.buffer)), events)
+
+    def get_child_path(self):
+        '''
+        returns the path of the value starting at the current position
+        '''
+        if not self.stack:
+            return ()
+        container, path, key = self.stack[-1]
+        return path + ((key,) if isinstance(container, dict) else (len(container),))
+
+    def complete(self, value, events):
+        if not self.stack:
+            self.done = True
+            self.value = value
+            events.append(((), value))
+            return
+
+        frame = self.stack[-1]
+        container = frame[0]
+        if isinstance(container, dict):
+            # a string completed where a key is expected is the key of the next value
+            if frame[2] is None:
+                if not isinstance(value, str):
+                    raise ValueError(f"Expected a key in json, got {value!r}")
+                frame[2] = value
+                return
+            path = self.get_child_path()
+            container[frame[2]] = value
+            frame[2] = None
+        else:
+            path = self.get_child_path()
+            container.append(value)
+        events.append((path, value))
+
+    def partial_string(self, path):
+        '''
+        returns the string at path, as much of it as is received so far. None if it hasn't started
+        (or isn't a string). Raises ValueError if it has an invalid escape before its last one
+        '''
+        if self.token == 'string' and self.stack and self.get_child_path() == path:
+            container, _, key = self.stack[-1]
+            if not (isinstance(container, dict) and key is None):
+                return self.decode_partial_string()
+
+        # the completed values are in the innermost open container on the path, or in the root
+        value, rest = (self.value, path) if self.done else (None, path)
+        for container, container_path, _ in reversed(self.stack):
+            if path[:len(container_path)] == container_path:
+                value, rest = container, path[len(container_path):]
+                break
+        for key in rest:
+            try:
+                value = value[key]
+            except (KeyError, IndexError, TypeError):
+                return None
+        return value if isinstance(value, str) else None
+
+    def decode_partial_string(self):
+        '''
+        decodes the string being read up to its last escape if that one isn't fully received yet (or
+        is invalid). Raises ValueError if an earlier escape is invalid
+        '''
+        text = ''.join(self.buffer)
+        try:
+            value = json.loads('"' + text + '"', strict=False)
+        except ValueError:
+            value = json.loads('"' + text[:text.rfind('\\')] + '"', strict=False)
+        if value and '\ud800' <= value[-1] <= '\udbff':
+            # the low half of the surrogate pair is still to come
+            value = value[:-1]
+        return value
+
+    def close(self):
+        '''
+        ends the document, returns the root value. Raises ValueError if the document is incomplete
+        '''
+        if self.token == 'literal' and not self.stack:
+            self.end_literal([])
+        if not self.done:
+            raise ValueError("Incomplete json")
+        return self.value
+
+
+def iter_json_events(chunks):
+    '''
+    yields (path, value) of the values of the json document in chunks as they are completed
+    '''
+    parser = StreamingJsonParser()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    if not parser.done:
+        parser.close()
+
+
+def iter_array_items(chunks, key):
+    '''
+    yields the items of the array at key of the root object as they are completed
+    '''
+    for path, value in iter_json_events(chunks):
+        if len(path) == 2 and path[0] == key:
+            yield value